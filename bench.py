@@ -0,0 +1,535 @@
+# bench.py — замеры производительности на синтетических данных
+#
+#   python bench.py report --employees 500 --days 92
+#   python bench.py stress --users 300
+#   python bench.py snapshot --employees 500 --years 3
+#   python bench.py memory --employees 1000 --years 3
+#   python bench.py outbound --bulk 300 --users 50
+#   python bench.py suite --employees 500 --days 365 --out bench-suite.json [--baseline old.json]
+#
+# Бот не запускается: main импортируется как модуль с фиктивным токеном
+# и временным DATA_DIR, сеть не нужна.
+import os
+import sys
+import platform
+import subprocess
+import time
+import random
+import asyncio
+import argparse
+import json
+import logging
+import contextlib
+import contextvars
+import datetime
+import tempfile
+import tracemalloc
+
+os.environ.setdefault("BOT_TOKEN", "0:bench")
+os.environ.setdefault("DATA_DIR", tempfile.mkdtemp(prefix="dusberg-bench-"))
+
+import main  # noqa: E402
+
+REASONS = ["пробки", "был у врача", "срочный заказ", "по согласованию с руководителем", "сломался автобус"]
+
+def synth_employees(n: int) -> dict[int, dict]:
+    return {100000 + i: {"name": f"Сотрудник {i:05d}", "active": i % 17 != 0} for i in range(n)}
+
+def synth_shifts(
+    employees: dict[int, dict],
+    date_from: datetime.date,
+    days: int,
+    seed: int = 42,
+    reasons: float = 0.1,
+    comments: float = 0.05,
+) -> dict[str, dict[int, dict]]:
+    """~90% явок, часть с опозданиями/переработками и причинами — как в живых данных.
+    reasons — доля смен с причиной начала (причин завершения вдвое меньше), comments — с комментарием."""
+    rnd = random.Random(seed)
+    out: dict[str, dict[int, main.ShiftRecord]] = {}
+    for i in range(days):
+        day = date_from + datetime.timedelta(days=i)
+        start0 = main.epoch_seconds(datetime.datetime.combine(day, datetime.time(7, 40), main.MSK))
+        end0 = main.epoch_seconds(datetime.datetime.combine(day, datetime.time(17, 20), main.MSK))
+        users: dict[int, main.ShiftRecord] = {}
+        for uid in employees:
+            if rnd.random() > 0.9:
+                continue
+            start = start0 + rnd.randint(0, 3600)
+            end = end0 + rnd.randint(0, 3600)
+            rec = main.ShiftRecord(
+                start=start,
+                end=end if rnd.random() > 0.03 else None,
+                start_reason=rnd.choice(REASONS) if rnd.random() < reasons else None,
+                end_reason=rnd.choice(REASONS) if rnd.random() < reasons / 2 else None,
+                comment="комментарий к смене" if rnd.random() < comments else None,
+            )
+            users[uid] = main.materialize_metrics(rec)
+        out[day.isoformat()] = users
+    return out
+
+def best_of(fn, repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - t0)
+    return best
+
+def bench_report(args) -> None:
+    employees = synth_employees(args.employees)
+    d1 = datetime.date(2025, 1, 1)
+    d2 = d1 + datetime.timedelta(days=args.days - 1)
+    range_data = synth_shifts(employees, d1, args.days)
+    rows = args.employees * args.days
+    print(f"report: {args.employees} сотрудников × {args.days} дней = {rows} строк")
+
+    def consume(gen):
+        for _ in gen:
+            pass
+
+    t = best_of(lambda: consume(main.report_rows(d1, d2, employees, range_data)), args.repeat)
+    print(f"  строки отчёта: {t * 1000:8.1f} мс ({rows / t:,.0f} строк/с)")
+
+    if not args.skip_xlsx:
+        t = best_of(lambda: main.build_xlsx_bytes(d1, d2, employees, range_data), 1)
+        print(f"  build_xlsx_bytes: {t * 1000:8.1f} мс")
+
+def bench_snapshot(args) -> None:
+    employees = synth_employees(args.employees)
+    d1 = datetime.date(2023, 1, 1)
+    days = 365 * args.years
+    data = synth_shifts(employees, d1, days)
+    months = main.months_in_range(d1, d1 + datetime.timedelta(days=days - 1))
+    by_month: dict[str, dict] = {}
+    for day, users in data.items():
+        by_month.setdefault(main.month_of(day), {})[day] = users
+    records = sum(len(users) for users in data.values())
+    print(f"snapshot: {args.employees} сотрудников × {args.years} г. = {records} смен, {len(months)} партиций")
+
+    store = main.JsonStore()
+    base = main.SHIFTS_DIR
+    for fmt in ("json", "binary"):
+        main.SNAPSHOT_FORMAT = fmt
+        main.SHIFTS_DIR = base / fmt
+        t = best_of(lambda: [store.write_partition(ym, by_month[ym]) for ym in months], 1)
+        size = sum(p.stat().st_size for p in main.SHIFTS_DIR.iterdir() if p.suffix in (".json", ".bin"))
+        month = best_of(lambda: store.read_partition(months[-1]), args.repeat)
+        full = best_of(lambda: [store.read_partition(ym) for ym in months], args.repeat)
+        print(f"  {fmt:6s}: {size / 2**20:7.1f} МБ, запись {t * 1000:7.0f} мс, "
+              f"месяц {month * 1000:6.1f} мс, вся история {full * 1000:7.0f} мс")
+    main.SHIFTS_DIR = base
+
+def legacy_shift(d: dict) -> dict:
+    """Смена в прежнем виде — dict с datetime, как его строил shift_from_json до ShiftRecord."""
+    rec = {
+        "start": main.dt_from_iso(d.get("start")),
+        "end": main.dt_from_iso(d.get("end")),
+        "start_reason": d.get("start_reason"),
+        "end_reason": d.get("end_reason"),
+        "comment": d.get("comment"),
+        "comment_done": d.get("comment_done"),
+    }
+    for k in main.METRIC_KEYS:
+        rec[k] = d[k]
+    return rec
+
+def bench_memory(args) -> None:
+    employees = synth_employees(args.employees)
+    d1 = datetime.date(2023, 1, 1)
+    months = main.months_in_range(d1, d1 + datetime.timedelta(days=365 * args.years - 1))
+    print(f"memory: {args.employees} сотрудников × {args.years} г. ({len(months)} мес.), история целиком в памяти")
+
+    # месяцы — JSON-текстом, как на диске; разбираются уже под tracemalloc
+    texts = []
+    for ym in months:
+        lo, hi = (datetime.date.fromisoformat(d) for d in main.month_bounds(ym))
+        data = synth_shifts(employees, lo, (hi - lo).days + 1, seed=int(ym.replace("-", "")))
+        texts.append(json.dumps({day: {str(uid): main.shift_to_json(r) for uid, r in users.items()} for day, users in data.items()}, ensure_ascii=False))
+    del data
+
+    results = {}
+    for label, build in (("dict+datetime", legacy_shift), ("ShiftRecord", main.shift_from_json)):
+        history: dict[str, dict[int, object]] = {}
+        tracemalloc.start()
+        t0 = time.perf_counter()
+        for text in texts:
+            # каждый месяц — свежий json.loads: строки между месяцами не общие, как при чтении с диска
+            for day, users in json.loads(text).items():
+                history[day] = {int(uid): build(d) for uid, d in users.items()}
+        elapsed = time.perf_counter() - t0
+        used = tracemalloc.get_traced_memory()[0]  # живо только то, что держит history
+        tracemalloc.stop()
+        shifts = sum(len(users) for users in history.values())
+        results[label] = used
+        print(f"  {label:14s}: {used / 2**20:8.1f} МБ на {shifts} смен ({used / shifts:5.0f} Б/смену), сборка {elapsed:5.1f} с")
+        del history
+    print(f"  экономия: ×{results['dict+datetime'] / results['ShiftRecord']:.1f}")
+
+# ---- stress: параллельные апдейты через настоящий Dispatcher, Telegram подменён
+from aiogram.client.session.base import BaseSession  # noqa: E402
+from aiogram.exceptions import TelegramRetryAfter  # noqa: E402
+from aiogram.types import Update  # noqa: E402
+
+class FakeSession(BaseSession):
+    """Сессия без сети: каждый вызов API «идёт» случайные 0–latency сек, ответы складываются в sent."""
+
+    def __init__(self, latency: float, seed: int = 1, flood_every: int = 0):
+        super().__init__()
+        self.latency = latency
+        self.rnd = random.Random(seed)
+        self.sent: dict[int, list[str]] = {}
+        self.flood_every = flood_every  # каждый N-й запрос — 429, как при флуде
+        self.requests = 0
+
+    async def make_request(self, bot, method, timeout=None):
+        await asyncio.sleep(self.rnd.random() * self.latency)
+        self.requests += 1
+        if self.flood_every and self.requests % self.flood_every == 0:
+            raise TelegramRetryAfter(method=method, message="Too Many Requests", retry_after=1)
+        chat_id = getattr(method, "chat_id", None)
+        if chat_id is not None:
+            self.sent.setdefault(chat_id, []).append(getattr(method, "text", ""))
+        return None
+
+    async def stream_content(self, url, headers=None, timeout=30, chunk_size=65536, raise_for_status=True):
+        yield b""
+
+    async def close(self):
+        pass
+
+CLOCK: contextvars.ContextVar[datetime.datetime] = contextvars.ContextVar("CLOCK")
+
+def message_update(update_id: int, uid: int, text: str) -> Update:
+    return Update.model_validate({
+        "update_id": update_id,
+        "message": {
+            "message_id": update_id, "date": 0, "text": text,
+            "chat": {"id": uid, "type": "private"},
+            "from": {"id": uid, "is_bot": False, "first_name": str(uid)},
+        },
+    })
+
+async def stress(args) -> dict:
+    # ранний приход и ранний уход в будний день: на каждое действие бот спрашивает причину
+    day = datetime.date(2025, 3, 5)
+    start_at = datetime.datetime.combine(day, datetime.time(7, 30), main.MSK)
+    end_at = datetime.datetime.combine(day, datetime.time(16, 0), main.MSK)
+    main.msk_now = CLOCK.get
+    session = FakeSession(args.latency)
+    main.bot.session = session
+    employees = synth_employees(args.users)
+    for meta in employees.values():
+        meta["active"] = True
+    main.DIRECTORY.replace(employees)
+    CLOCK.set(start_at)
+    main.load_shifts()
+    persist = asyncio.create_task(main.persistence_writer())
+
+    uids = main.DIRECTORY.uids()
+    new_uids = [900000 + i for i in range(args.owner_adds)]
+    script = [
+        (start_at, "Смену начал 🏭"), (start_at, "причина начала {uid}"),
+        (end_at, "Смену закончил 🏡"), (end_at, "причина завершения {uid}"),
+        (end_at, "Мой статус📍"),
+    ]
+    # как при polling: апдейты приходят по порядку, каждый — отдельной задачей;
+    # шаги разных сотрудников перемешаны, а владелец параллельно правит справочник
+    tasks, update_id = [], 0
+    owner_steps = [text for uid in new_uids for text in ("❇️ Добавить сотрудника", f"{uid} Новый {uid}")]
+    owner_chunk = -(-len(owner_steps) // len(script))
+    for at, template in script:
+        for uid in uids:
+            update_id += 1
+            CLOCK.set(at)
+            tasks.append(asyncio.create_task(main.dp.feed_update(main.bot, message_update(update_id, uid, template.format(uid=uid)))))
+        for text in owner_steps[:owner_chunk]:
+            update_id += 1
+            tasks.append(asyncio.create_task(main.dp.feed_update(main.bot, message_update(update_id, main.OWNER_ID, text))))
+        del owner_steps[:owner_chunk]
+    t0 = time.perf_counter()
+    await asyncio.gather(*tasks)
+    elapsed = time.perf_counter() - t0
+    await main.flush_now()
+    persist.cancel()
+
+    stored = main.STORE.read_range(day, day).get(day.isoformat(), {})
+    lost = 0
+    for uid in uids:
+        rec = stored.get(uid) or main.ShiftRecord()
+        ok = (
+            rec.start == main.epoch_seconds(start_at) and rec.end == main.epoch_seconds(end_at)
+            and rec.start_reason == f"причина начала {uid}"
+            and rec.end_reason == f"причина завершения {uid}"
+        )
+        lost += not ok
+    employees = main.STORE.load_employees() or {}
+    missing_emps = sum(uid not in employees or main.DIRECTORY.name(uid) is None for uid in new_uids)
+    return {
+        "updates": update_id, "seconds": elapsed, "updates_per_s": update_id / elapsed,
+        "lost_shifts": lost, "missing_employees": missing_emps,
+        "idle_locks": len(main.USER_ORDER.locks) == 0,
+    }
+
+# ---- outbound: массовая рассылка идёт, а ответы на кнопки не ждут её
+async def outbound(args, lanes: bool) -> dict:
+    main.OUTBOUND = sched = main.OutboundScheduler(args.rate, args.chat_rate, main.SEND_CHAT_BURST, main.SEND_RETRIES)
+    session = FakeSession(args.latency, flood_every=args.flood_every)
+    session.middleware(sched)
+    main.bot.session = session
+    employees = synth_employees(args.users)
+    for meta in employees.values():
+        meta["active"] = True
+    main.DIRECTORY.replace(employees)
+    main.load_shifts()
+
+    async def broadcast():
+        # bulk-полоса; без полос — та же рассылка наравне с ответами
+        with main.bulk_sends() if lanes else contextlib.nullcontext():
+            await asyncio.gather(*(main.bot.send_message(800000 + i, "напоминание") for i in range(args.bulk)))
+
+    async def press(update_id: int, uid: int) -> float:
+        await asyncio.sleep(update_id * args.interval)  # сотрудники жмут по одному, не залпом
+        t0 = time.perf_counter()
+        await main.dp.feed_update(main.bot, message_update(update_id, uid, "Мой статус📍"))
+        return time.perf_counter() - t0
+
+    t0 = time.perf_counter()
+    bulk = asyncio.create_task(broadcast())
+    await asyncio.sleep(0.2)  # рассылка уже упёрлась в лимит
+    latencies = await asyncio.gather(*(press(i + 1, uid) for i, uid in enumerate(employees)))
+    await bulk
+    drained = time.perf_counter() - t0
+    latencies.sort()
+    delivered = sum(len(texts) for chat, texts in session.sent.items() if chat >= 800000)
+    return {
+        "p50_ms": latencies[len(latencies) // 2] * 1000,
+        "p95_ms": latencies[int(len(latencies) * 0.95) - 1] * 1000,
+        "bulk_seconds": drained, "delivered": delivered, "retry_after": sched.retry_after,
+    }
+
+def bench_outbound(args) -> None:
+    logging.getLogger("aiogram").setLevel(logging.ERROR)
+    print(f"outbound: рассылка {args.bulk} сообщений при лимите {args.rate:.0f}/с + {args.users} нажатий «Мой статус» раз в {args.interval} с, "
+          f"429 на каждый {args.flood_every}-й запрос")
+    failed = False
+    for lanes in (False, True):
+        res = asyncio.run(outbound(args, lanes))
+        name = "полосы" if lanes else "одна очередь"
+        print(f"  {name:12s}: ответ на кнопку p50 {res['p50_ms']:7.0f} мс, p95 {res['p95_ms']:7.0f} мс; "
+              f"рассылка {res['bulk_seconds']:.1f} с, доставлено {res['delivered']}/{args.bulk}, 429: {res['retry_after']}")
+        failed |= res["delivered"] != args.bulk
+    if failed:
+        sys.exit(1)
+
+# ---- suite: сквозной набор замеров с результатом в JSON для сравнения между запусками
+def timings(fn, repeat: int, setup=None) -> dict:
+    runs = []
+    for _ in range(repeat):
+        if setup is not None:
+            setup()
+        t0 = time.perf_counter()
+        fn()
+        runs.append(time.perf_counter() - t0)
+    return {"best_s": min(runs), "median_s": sorted(runs)[len(runs) // 2]}
+
+def latency_stats(samples: list[float]) -> dict:
+    samples = sorted(samples)
+    return {
+        "mean_s": sum(samples) / len(samples),
+        "p95_s": samples[max(0, int(len(samples) * 0.95) - 1)],
+        "n": len(samples),
+    }
+
+async def handler_latencies(uids: list[int], day: datetime.date) -> dict:
+    """Настоящий Dispatcher, Telegram без сети: начало и конец смены без вопросов о причинах, статус."""
+    main.bot.session = FakeSession(0.0)
+    out, update_id = {}, 0
+    for name, text, at in (
+        ("handle_start", "Смену начал 🏭", datetime.time(8, 5)),
+        ("handle_status", "Мой статус📍", datetime.time(12, 0)),
+        ("handle_end", "Смену закончил 🏡", datetime.time(17, 35)),
+    ):
+        CLOCK.set(datetime.datetime.combine(day, at, main.MSK))
+        samples = []
+        for uid in uids:
+            update_id += 1
+            update = message_update(update_id, uid, text)
+            t0 = time.perf_counter()
+            await main.dp.feed_update(main.bot, update)
+            samples.append(time.perf_counter() - t0)
+        out[name] = latency_stats(samples)
+    return out
+
+def git_revision() -> str | None:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True,
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+        ).stdout.strip()
+    except Exception:
+        return None
+
+def flat_metrics(results: dict, prefix: str = "") -> dict[str, float]:
+    """{"load_shifts": {"best_s": ..}} -> {"load_shifts.best_s": ..}: только времена, для сравнения."""
+    out = {}
+    for key, value in results.items():
+        name = f"{prefix}{key}"
+        if isinstance(value, dict):
+            out.update(flat_metrics(value, name + "."))
+        elif key.endswith("_s"):
+            out[name] = value
+    return out
+
+def bench_suite(args) -> None:
+    logging.getLogger("aiogram").setLevel(logging.ERROR)
+    # «сегодня» — будний день в конце месяца сразу после истории: текущий месяц загружается с данными
+    today = datetime.date(2025, 3, 26)
+    d1 = today - datetime.timedelta(days=args.days)
+    main.msk_now = CLOCK.get
+    CLOCK.set(datetime.datetime.combine(today, datetime.time(12, 0), main.MSK))
+
+    employees = synth_employees(args.employees)
+    for meta in employees.values():
+        meta["active"] = True
+    data = synth_shifts(employees, d1, args.days, seed=args.seed, reasons=args.reasons, comments=args.comments)
+    shifts_json = {day: {str(uid): main.shift_to_json(r) for uid, r in users.items()} for day, users in data.items()}
+    records = sum(len(users) for users in data.values())
+    print(f"suite: {args.employees} сотрудников × {args.days} дней = {records} смен "
+          f"(причины {args.reasons:.0%}, комментарии {args.comments:.0%}), backend={main.STORE.name}")
+
+    # как после импорта: employees.json и shifts.json в DATA_DIR, история — в хранилище
+    main.atomic_write_text(main.EMP_FILE, json.dumps(main.employees_to_json(employees), ensure_ascii=False, indent=2))
+    main.atomic_write_text(main.SHIFT_FILE, json.dumps(shifts_json, ensure_ascii=False, indent=2))
+    results: dict = {"sizes": {
+        "employees_json_bytes": main.EMP_FILE.stat().st_size,
+        "shifts_json_bytes": main.SHIFT_FILE.stat().st_size,
+    }}
+    main.DIRECTORY.replace(employees)
+    main.save_employees()
+    t0 = time.perf_counter()
+    with open(main.SHIFT_FILE, encoding="utf-8-sig") as f:  # тем же потоковым путём, что импорт заменой
+        main.STORE.replace_shifts(main.iter_import_months(f, main.ImportStats()))
+    results["import_shifts"] = {"best_s": time.perf_counter() - t0}
+
+    results["load_shifts"] = timings(main.load_shifts, args.repeat)
+
+    def dirty_current_month():
+        # все смены текущего месяца — как после дня активной работы
+        for day, users in main.shifts_by_date.items():
+            for uid in users:
+                main.mark_shift_dirty(day, uid)
+    results["save_shifts"] = timings(main.save_shifts, args.repeat, setup=dirty_current_month)
+
+    main.load_shifts()
+    last = today - datetime.timedelta(days=1)
+    for span in (1, 31, 92):
+        if span > args.days:
+            continue
+        lo = last - datetime.timedelta(days=span - 1)
+        results[f"build_xlsx_{span}d"] = timings(lambda: main.build_xlsx_bytes(lo, last), args.repeat)
+
+    uids = main.DIRECTORY.uids(active=True)[:args.handler_users]
+    results["handlers"] = asyncio.run(handler_latencies(uids, today))
+
+    report = {
+        "meta": {
+            "employees": args.employees, "days": args.days, "records": records,
+            "reasons": args.reasons, "comments": args.comments, "seed": args.seed, "repeat": args.repeat,
+            "backend": main.STORE.name, "snapshot_format": main.SNAPSHOT_FORMAT,
+            "python": platform.python_version(), "machine": platform.machine(),
+            "git": git_revision(), "at": datetime.datetime.now(datetime.timezone.utc).isoformat(timespec="seconds"),
+        },
+        "results": results,
+    }
+    for name, value in flat_metrics(results).items():
+        print(f"  {name:32s} {value * 1000:10.2f} мс")
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"  результаты: {args.out}")
+
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)
+        old = flat_metrics(baseline["results"])
+        regressions = []
+        for key in ("employees", "days", "reasons", "comments", "backend", "snapshot_format"):
+            if baseline["meta"].get(key) != report["meta"][key]:
+                print(f"  внимание: {key} = {baseline['meta'].get(key)!r} в базовом запуске, сейчас {report['meta'][key]!r}")
+        print(f"  сравнение с {args.baseline} (порог ×{args.tolerance}):")
+        for name, value in flat_metrics(results).items():
+            if name not in old or not old[name]:
+                continue
+            ratio = value / old[name]
+            mark = "  ← медленнее" if ratio > args.tolerance else ""
+            print(f"  {name:32s} ×{ratio:5.2f}{mark}")
+            if mark:
+                regressions.append(name)
+        if regressions:
+            sys.exit(1)
+
+def bench_stress(args) -> None:
+    res = asyncio.run(stress(args))
+    print(f"stress: {args.users} сотрудников × 5 апдейтов + {args.owner_adds} добавлений владельцем, задержка API до {args.latency * 1000:.0f} мс")
+    print(f"  апдейтов: {res['updates']} за {res['seconds']:.2f} с ({res['updates_per_s']:.0f}/с)")
+    print(f"  потеряно смен/причин: {res['lost_shifts']}, не добавлено сотрудников: {res['missing_employees']}")
+    if res["lost_shifts"] or res["missing_employees"] or not res["idle_locks"]:
+        sys.exit(1)
+
+def main_cli(argv=None) -> None:
+    parser = argparse.ArgumentParser(description="Бенчмарки бота учёта смен")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+
+    p = sub.add_parser("report", help="построение строк и XLSX отчёта")
+    p.add_argument("--employees", type=int, default=500)
+    p.add_argument("--days", type=int, default=92)
+    p.add_argument("--repeat", type=int, default=3)
+    p.add_argument("--skip-xlsx", action="store_true", help="не замерять запись XLSX целиком")
+    p.set_defaults(func=bench_report)
+
+    p = sub.add_parser("snapshot", help="месячные партиции: JSON против бинарного снимка")
+    p.add_argument("--employees", type=int, default=500)
+    p.add_argument("--years", type=int, default=3)
+    p.add_argument("--repeat", type=int, default=3)
+    p.set_defaults(func=bench_snapshot)
+
+    p = sub.add_parser("memory", help="память истории смен: dict с datetime против ShiftRecord")
+    p.add_argument("--employees", type=int, default=1000)
+    p.add_argument("--years", type=int, default=3)
+    p.set_defaults(func=bench_memory)
+
+    p = sub.add_parser("stress", help="параллельные апдейты: ничего не теряется")
+    p.add_argument("--users", type=int, default=300)
+    p.add_argument("--owner-adds", type=int, default=20)
+    p.add_argument("--latency", type=float, default=0.005, help="макс. задержка ответа API, сек")
+    p.set_defaults(func=bench_stress)
+
+    p = sub.add_parser("outbound", help="лимиты отправки: ответы на кнопки во время рассылки")
+    p.add_argument("--bulk", type=int, default=300, help="сообщений в рассылке (каждое — в свой чат)")
+    p.add_argument("--users", type=int, default=50, help="нажатий кнопки во время рассылки")
+    p.add_argument("--interval", type=float, default=0.1, help="сек между нажатиями")
+    p.add_argument("--rate", type=float, default=main.SEND_RATE, help="сообщений/с на бота")
+    p.add_argument("--chat-rate", type=float, default=main.SEND_CHAT_RATE)
+    p.add_argument("--flood-every", type=int, default=50, help="каждый N-й запрос отвечает 429 (0 — никогда)")
+    p.add_argument("--latency", type=float, default=0.005, help="макс. задержка ответа API, сек")
+    p.set_defaults(func=bench_outbound)
+
+    p = sub.add_parser("suite", help="загрузка, запись, отчёты и хендлеры на синтетической истории; результат — JSON")
+    p.add_argument("--employees", type=int, default=500)
+    p.add_argument("--days", type=int, default=365)
+    p.add_argument("--reasons", type=float, default=0.1, help="доля смен с причиной отклонения")
+    p.add_argument("--comments", type=float, default=0.05, help="доля смен с комментарием")
+    p.add_argument("--seed", type=int, default=42)
+    p.add_argument("--repeat", type=int, default=3)
+    p.add_argument("--handler-users", type=int, default=200, help="сотрудников в замере хендлеров")
+    p.add_argument("--out", default="bench-suite.json", help="куда записать результаты (пусто — не писать)")
+    p.add_argument("--baseline", help="прошлый файл результатов: сравнить и вернуть 1 при замедлении")
+    p.add_argument("--tolerance", type=float, default=1.25, help="во сколько раз медленнее считать регрессией")
+    p.set_defaults(func=bench_suite)
+
+    args = parser.parse_args(argv)
+    args.func(args)
+
+if __name__ == "__main__":
+    main_cli(sys.argv[1:])
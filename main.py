@@ -3,33 +3,71 @@ import os
 import io
 import json
 import asyncio
+import bisect
 import logging
+import secrets
+import signal
 import datetime
 import calendar
+import csv
+import gzip
+import hashlib
+import html
+import contextlib
+import contextvars
+import functools
+import sqlite3
+import struct
+import shutil
+import sys
+import tempfile
+import zipfile
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field, replace
 from pathlib import Path
 from collections import defaultdict
 from typing import Dict, Any, Iterable
 
-from aiogram import Bot, Dispatcher, Router, F
+from aiohttp import web
+from apscheduler.schedulers.asyncio import AsyncIOScheduler
+from apscheduler.triggers.cron import CronTrigger
+from aiogram import BaseMiddleware, Bot, Dispatcher, Router, F
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware
+from aiogram.client.telegram import TelegramAPIServer
+from aiogram.dispatcher.event.bases import SkipHandler
+from aiogram.dispatcher.flags import get_flag
 from aiogram.enums import ParseMode
+from aiogram.exceptions import TelegramBadRequest, TelegramForbiddenError, TelegramRetryAfter
 from aiogram.client.default import DefaultBotProperties
 from aiogram.fsm.storage.memory import MemoryStorage
+from aiogram.methods import TelegramMethod
 from aiogram.types import (
     BotCommand,
+    CallbackQuery,
+    InlineKeyboardButton,
+    InlineKeyboardMarkup,
     KeyboardButton,
     Message,
     ReplyKeyboardMarkup,
     BufferedInputFile,
+    FSInputFile,
     BotCommandScopeDefault,
     BotCommandScopeChat,
     Document,
 )
-from aiogram.filters import CommandStart, Command
+from aiogram.filters import CommandStart, Command, CommandObject
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
+from aiogram.webhook.aiohttp_server import SimpleRequestHandler, setup_application
 from zoneinfo import ZoneInfo
 
 from openpyxl import Workbook
+from openpyxl.cell import WriteOnlyCell
 from openpyxl.styles import Alignment, Font
 from openpyxl.utils import get_column_letter
 
@@ -44,13 +82,68 @@ if not BOT_TOKEN or ":" not in BOT_TOKEN:
 OWNER_ID  = 104653853
 ADMIN_IDS = [104653853, 1155243378, 8471837261]  # можно расширять
 
+# ===== Доставка апдейтов: long polling (по умолчанию) или webhook =====
+WEBHOOK_URL = os.getenv("WEBHOOK_URL", "").strip().rstrip("/")   # публичный https-адрес бота; пусто — polling
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/telegram/webhook")
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET", "").strip()          # пусто — случайный на каждый запуск
+WEBHOOK_HOST = os.getenv("WEBHOOK_HOST", "0.0.0.0")
+WEBHOOK_PORT = int(os.getenv("PORT", os.getenv("WEBHOOK_PORT", "8080")))  # Railway задаёт PORT сам
+WEBHOOK_DRAIN_TIMEOUT = float(os.getenv("WEBHOOK_DRAIN_TIMEOUT", "10"))   # сек на дообработку при остановке
+TELEGRAM_API_URL = os.getenv("TELEGRAM_API_URL", "").strip()      # свой Bot API сервер (или локальный фейк)
+
+# ===== Исходящие сообщения: лимиты Telegram (~30 сообщений/с на бота, ~1/с в чат) =====
+SEND_RATE = float(os.getenv("SEND_RATE", "25"))              # сообщений/с на бота
+SEND_CHAT_RATE = float(os.getenv("SEND_CHAT_RATE", "1"))     # сообщений/с в один чат
+SEND_CHAT_BURST = int(os.getenv("SEND_CHAT_BURST", "3"))     # столько в чат можно сразу, без ожидания
+SEND_RETRIES = int(os.getenv("SEND_RETRIES", "3"))           # повторов после 429 (retry_after)
+
+# ===== Метрики в формате Prometheus: отдельный aiohttp-сервер, 0 — выключен =====
+METRICS_PORT = int(os.getenv("METRICS_PORT", "0"))
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+
+# ===== HTTP API только для чтения: отдельный aiohttp-сервер, 0 — выключен, без API_TOKEN не стартует =====
+API_PORT = int(os.getenv("API_PORT", "0"))
+API_HOST = os.getenv("API_HOST", "127.0.0.1")
+API_TOKEN = os.getenv("API_TOKEN", "").strip()        # заголовок Authorization: Bearer <токен>
+
 # ===== Папка для постоянного хранилища =====
-DATA_DIR = Path("/data")
+DATA_DIR = Path(os.getenv("DATA_DIR", "/data"))
 DATA_DIR.mkdir(parents=True, exist_ok=True)
 
 # файлы данных (будут храниться в /data на Railway)
 EMP_FILE   = DATA_DIR / "employees.json"
-SHIFT_FILE = DATA_DIR / "shifts.json"
+SHIFT_FILE = DATA_DIR / "shifts.json"  # единый файл — только для импорта/экспорта и миграции
+# смены хранятся помесячно: /data/shifts/YYYY-MM.json; в памяти — только текущий месяц
+SHIFTS_DIR = DATA_DIR / "shifts"
+# хранилище: "json" (файлы выше) или "sqlite" (одна база DB_FILE, WAL)
+STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "json").strip().lower()
+# формат месячных партиций json-хранилища: "binary" (shifts/YYYY-MM.bin, быстрый старт) или "json";
+# при старте партиции другого формата переписываются в выбранный, экспорт — всегда JSON
+SNAPSHOT_FORMAT = "json" if os.getenv("SNAPSHOT_FORMAT", "binary").strip().lower() == "json" else "binary"
+DB_FILE = DATA_DIR / "dusberg.sqlite3"
+# фоновая запись: изменения копятся PERSIST_WINDOW сек и пишутся одной пачкой вне event loop
+PERSIST_WINDOW = float(os.getenv("PERSIST_WINDOW", "0.5"))
+PERSIST_FSYNC = os.getenv("PERSIST_FSYNC", "0").strip().lower() in ("1", "true", "yes")
+
+# ===== Отчёты: строятся в пуле потоков, чтобы не стопорить кнопки смен =====
+REPORT_WORKERS = int(os.getenv("REPORT_WORKERS", "2"))
+REPORT_QUEUE_MAX = int(os.getenv("REPORT_QUEUE_MAX", "8"))   # отчётов в работе + в очереди
+REPORT_PER_ADMIN = int(os.getenv("REPORT_PER_ADMIN", "1"))   # одновременно на одного админа
+REPORT_CACHE_MB = float(os.getenv("REPORT_CACHE_MB", "32"))   # LRU готовых XLSX, по размеру
+XLSX_MAX_DAYS = 92                                       # дольше — только потоковая выгрузка CSV
+CSV_MAX_DAYS = int(os.getenv("CSV_MAX_DAYS", "3660"))    # предел для выгрузки CSV (~10 лет)
+TELEGRAM_FILE_LIMIT = 50 * 1024 * 1024                    # бот не может отправить файл больше
+# ночная сборка типовых отчётов (вчера, прошлая неделя, прошлый месяц) в /data/reports
+REPORT_NIGHTLY = os.getenv("REPORT_NIGHTLY", "1").strip().lower() in ("1", "true", "yes")
+REPORT_NIGHTLY_AT = datetime.time.fromisoformat(os.getenv("REPORT_NIGHTLY_AT", "03:30"))  # МСК
+REPORTS_DIR = DATA_DIR / "reports"
+# лента изменений для дельта-синхронизации: /data/changes.log, строка JSON с номером seq на изменение
+CHANGES_FILE = DATA_DIR / "changes.log"
+CHANGES_MAX_MB = float(os.getenv("CHANGES_MAX_MB", "64"))  # больше — старшая половина отрезается
+# журнал изменений смен (append-only, по строке JSON на мутацию) поверх месячных снимков
+JOURNAL_FILE = DATA_DIR / "shifts.journal"
+JOURNAL_COMPACT_EVERY = int(os.getenv("JOURNAL_COMPACT_EVERY", "500"))        # записей до внеочередного сжатия
+JOURNAL_COMPACT_INTERVAL = int(os.getenv("JOURNAL_COMPACT_INTERVAL", "600"))  # сек между плановыми сжатиями
 
 # МСК
 MSK = ZoneInfo("Europe/Moscow")
@@ -66,16 +159,23 @@ PROMPT_EARLY_OK_FROM = datetime.time(7, 45)  # раньше — спросим 
 PROMPT_START_OK_TILL = datetime.time(8, 10)  # позже — спросим причину
 PROMPT_END_OK_TILL   = datetime.time(17, 45) # позже — спросим причину
 
+# ===== Напоминания по будням: минуты после допусков выше =====
+REMINDERS = os.getenv("REMINDERS", "1").strip().lower() in ("1", "true", "yes")
+REMIND_START_DELAY = int(os.getenv("REMIND_START_DELAY", "10"))  # не начал смену — через N мин после PROMPT_START_OK_TILL
+REMIND_END_DELAY = int(os.getenv("REMIND_END_DELAY", "30"))      # смена открыта — через N мин после PROMPT_END_OK_TILL
+REMIND_BATCH = int(os.getenv("REMIND_BATCH", "25"))              # сообщений в пачке; темп держит планировщик отправки
+
 # ================== ИНИЦИАЛИЗАЦИЯ ==================
 logging.basicConfig(level=logging.INFO)
-bot = Bot(token=BOT_TOKEN, default=DefaultBotProperties(parse_mode=ParseMode.HTML))
+session = AiohttpSession(api=TelegramAPIServer.from_base(TELEGRAM_API_URL)) if TELEGRAM_API_URL else None
+bot = Bot(token=BOT_TOKEN, session=session, default=DefaultBotProperties(parse_mode=ParseMode.HTML))
 dp = Dispatcher(storage=MemoryStorage())
 router = Router()
 dp.include_router(router)
 
 # ================== ПАМЯТЬ/ДАННЫЕ ==================
-# shifts_by_date["YYYY-MM-DD"][user_id] = {...}
-shifts_by_date: Dict[str, Dict[int, Dict[str, Any]]] = defaultdict(dict)
+# shifts_by_date["YYYY-MM-DD"][user_id] = ShiftRecord
+shifts_by_date: Dict[str, Dict[int, "ShiftRecord"]] = defaultdict(dict)
 
 # EMPLOYEES: id -> {"name": str, "active": bool}
 DEFAULT_EMPLOYEES = {
@@ -86,6 +186,77 @@ EMPLOYEES: Dict[int, Dict[str, Any]] = {}
 # ожидаем причину (по пользователю) — "start_early"|"start_late"|"end_early"|"end_late"
 pending_reason: Dict[int, str] = {}
 
+# ================== МЕТРИКИ ==================
+# Гистограммы копятся с запуска; отдаются текстом Prometheus (METRICS_PORT)
+# и сводкой владельцу по /metrics. Мгновенные значения (очереди, размеры
+# структур в памяти) считаются в момент запроса — см. metrics_text().
+class Histogram:
+    """Гистограмма с одной меткой; observe() можно звать и из пула потоков."""
+
+    def __init__(self, name: str, help_text: str, label: str, buckets: Iterable[float]):
+        self.name, self.help_text, self.label = name, help_text, label
+        self.buckets = tuple(buckets)
+        self.series: dict[str, list[int]] = {}   # значение метки -> счётчики по корзинам (+Inf последней)
+        self.sums: dict[str, float] = {}
+        self.lock = threading.Lock()
+
+    def observe(self, value: float, label_value: str) -> None:
+        i = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            counts = self.series.get(label_value)
+            if counts is None:
+                counts = self.series[label_value] = [0] * (len(self.buckets) + 1)
+                self.sums[label_value] = 0.0
+            counts[i] += 1
+            self.sums[label_value] += value
+
+    @contextlib.contextmanager
+    def time(self, label_value: str):
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - t0, label_value)
+
+    def snapshot(self) -> dict[str, tuple[list[int], float]]:
+        with self.lock:
+            return {k: (list(v), self.sums[k]) for k, v in self.series.items()}
+
+    def quantile(self, counts: list[int], q: float) -> float:
+        """Оценка квантиля по корзинам (линейно внутри корзины)."""
+        rank, seen, lower = q * sum(counts), 0, 0.0
+        for bound, n in zip(self.buckets, counts):
+            if n and seen + n >= rank:
+                return lower + (bound - lower) * (rank - seen) / n
+            seen += n
+            lower = bound
+        return self.buckets[-1]  # всё выше последней корзины
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        for value, (counts, total) in sorted(self.snapshot().items()):
+            label = f'{self.label}="{prom_escape(value)}"'
+            cumulative = 0
+            for bound, n in zip(self.buckets + (float("inf"),), counts):
+                cumulative += n
+                le = "+Inf" if bound == float("inf") else f"{bound:g}"
+                lines.append(f'{self.name}_bucket{{{label},le="{le}"}} {cumulative}')
+            lines.append(f"{self.name}_sum{{{label}}} {total:.6f}")
+            lines.append(f"{self.name}_count{{{label}}} {cumulative}")
+        return lines
+
+def prom_escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+HANDLER_SECONDS = Histogram("dusberg_handler_seconds", "Время хендлера, сек", "handler", LATENCY_BUCKETS)
+WRITE_SECONDS = Histogram("dusberg_file_write_seconds", "Атомарная запись файла, сек", "file", LATENCY_BUCKETS)
+REPORT_SECONDS = Histogram("dusberg_report_build_seconds", "Сборка отчёта (с ожиданием пула), сек", "kind", LATENCY_BUCKETS + (60, 120))
+REPORT_BYTES = Histogram("dusberg_report_bytes", "Размер готового отчёта, байт", "kind",
+                         tuple(2 ** p for p in range(14, 27)))  # 16 КБ … 64 МБ
+API_SECONDS = Histogram("dusberg_api_seconds", "Ответ HTTP API, сек", "route", LATENCY_BUCKETS)
+HISTOGRAMS = (HANDLER_SECONDS, WRITE_SECONDS, REPORT_SECONDS, REPORT_BYTES, API_SECONDS)
+
 # ================== УТИЛИТЫ ==================
 def msk_now() -> datetime.datetime:
     return datetime.datetime.now(MSK)
@@ -102,9 +273,79 @@ def fmt_hm(dt: datetime.datetime | None) -> str:
 def is_weekend(date: datetime.date) -> bool:
     return calendar.weekday(date.year, date.month, date.day) >= 5
 
+def calc_minutes(a: datetime.time, b: datetime.time) -> int:
+    # без построения datetime: секунды от полуночи
+    sec_a = a.hour * 3600 + a.minute * 60 + a.second + a.microsecond / 1e6
+    sec_b = b.hour * 3600 + b.minute * 60 + b.second + b.microsecond / 1e6
+    return int((sec_b - sec_a) // 60)
+
+def deviation_columns(start_dt: datetime.datetime | None, end_dt: datetime.datetime | None) -> tuple[int,int,int,int]:
+    """(раньше_начало, позже_начало, раньше_конец, позже_конец) в минутах (>=0) — для ОТЧЁТА"""
+    early_start = late_start = early_end = late_end = 0
+    if start_dt:
+        st_local = start_dt.astimezone(MSK).time()
+        if st_local < START_NORM:
+            early_start = calc_minutes(st_local, START_NORM)
+        if st_local > START_OK_TILL:
+            late_start = calc_minutes(START_OK_TILL, st_local)
+    if end_dt:
+        en_local = end_dt.astimezone(MSK).time()
+        if en_local < END_NORM:
+            early_end = calc_minutes(en_local, END_NORM)
+        if en_local > END_OK_TILL:
+            late_end = calc_minutes(END_OK_TILL, en_local)
+    return early_start, late_start, early_end, late_end
+
+def minutes_between(start_dt: datetime.datetime | None, end_dt: datetime.datetime | None) -> int:
+    if not start_dt or not end_dt: return 0
+    a = start_dt.astimezone(MSK); b = end_dt.astimezone(MSK)
+    if b < a: return 0
+    return int((b - a).total_seconds() // 60)
+
+def epoch_seconds(dt: datetime.datetime | None) -> int | None:
+    # наивное время — как местное (так же его понимает dt_to_iso)
+    return None if dt is None else int(dt.timestamp())
+
+def msk_datetime(sec: int | None) -> datetime.datetime | None:
+    return None if sec is None else datetime.datetime.fromtimestamp(sec, MSK)
+
+def intern_text(s: str | None) -> str | None:
+    # причины повторяются («пробки», «врач») — одна строка на всю историю
+    return sys.intern(s) if s else s
+
+# Смена сотрудника за день. Вместо dict с двумя datetime — слоты с epoch-секундами:
+# на истории за годы это в разы меньше памяти. Производные поля (метрики) считаются
+# при записи (начало/конец/импорт) и хранятся вместе со сменой; отчёт и статус их
+# только читают. При смене норм — /recompute_metrics.
+METRIC_KEYS = ("start_hm", "end_hm", "early_start", "late_start", "early_end", "late_end", "work_min")
+
+@dataclass(slots=True)
+class ShiftRecord:
+    start: int | None = None          # epoch-секунды
+    end: int | None = None
+    start_reason: str | None = None
+    end_reason: str | None = None
+    comment: str | None = None
+    comment_done: bool | None = None
+    start_hm: str = "—"
+    end_hm: str = "—"
+    early_start: int = 0
+    late_start: int = 0
+    early_end: int = 0
+    late_end: int = 0
+    work_min: int = 0
+
+def materialize_metrics(shift: ShiftRecord) -> ShiftRecord:
+    start_dt, end_dt = msk_datetime(shift.start), msk_datetime(shift.end)
+    shift.start_hm = sys.intern(fmt_hm(start_dt))
+    shift.end_hm = sys.intern(fmt_hm(end_dt))
+    shift.early_start, shift.late_start, shift.early_end, shift.late_end = deviation_columns(start_dt, end_dt)
+    shift.work_min = minutes_between(start_dt, end_dt)
+    return shift
+
 def fio(uid: int) -> str:
-    meta = EMPLOYEES.get(uid)
-    return (meta or {}).get("name") if meta else f"Неизвестный ({uid})"
+    name = DIRECTORY.name(uid)
+    return name if name is not None else f"Неизвестный ({uid})"
 
 def is_admin(uid: int) -> bool:
     return uid in ADMIN_IDS or uid == OWNER_ID
@@ -112,7 +353,7 @@ def is_admin(uid: int) -> bool:
 def is_allowed(uid: int) -> bool:
     if uid == OWNER_ID or uid in ADMIN_IDS:
         return True
-    meta = EMPLOYEES.get(uid)
+    meta = DIRECTORY.get(uid)
     return bool(meta and meta.get("active", True))
 
 def ensure_allowed(message: Message) -> bool:
@@ -122,15 +363,45 @@ def ensure_allowed(message: Message) -> bool:
         return False
     return True
 
-def today_shift(uid: int) -> Dict[str, Any]:
-    return shifts_by_date[today_key()].setdefault(uid, {})
+def today_shift(uid: int, day: str | None = None) -> ShiftRecord:
+    """Смена за день (создаётся пустой, если её нет)."""
+    day = day or today_key()
+    load_month(month_of(day))
+    users = shifts_by_date[day]
+    shift = users.get(uid)
+    if shift is None:
+        shift = users[uid] = ShiftRecord()
+    return shift
 
 # -------- Безопасная запись/чтение JSON --------
-def atomic_write_text(path: Path, text: str):
+def atomic_write_text(path: Path, text: str, fsync: bool = PERSIST_FSYNC):
+    atomic_write_bytes(path, text.encode("utf-8"), fsync)
+
+def write_metric_label(path: Path) -> str:
+    # месячные партиции и отчёты — одной меткой, чтобы их число не росло со временем
+    if path.parent in (SHIFTS_DIR, JsonStore.staging_dir()):
+        return "shifts/partition"
+    if path.parent == REPORTS_DIR:
+        return "reports/prebuilt"
+    return path.name
+
+def atomic_write_bytes(path: Path, data: bytes, fsync: bool = PERSIST_FSYNC, backup: bool = True):
+    with WRITE_SECONDS.time(write_metric_label(path)):
+        _atomic_write_bytes(path, data, fsync, backup)
+
+def _atomic_write_bytes(path: Path, data: bytes, fsync: bool, backup: bool = True):
+    # backup=False — без .bak рядом: для больших файлов, которым прошлая версия не нужна
     path.parent.mkdir(parents=True, exist_ok=True)
     tmp = path.with_suffix(path.suffix + ".tmp")
     bak = path.with_suffix(path.suffix + ".bak")
-    tmp.write_text(text, encoding="utf-8")
+    with tmp.open("wb") as f:
+        f.write(data)
+        if fsync:
+            f.flush()
+            os.fsync(f.fileno())
+    if not backup:
+        os.replace(tmp, path)
+        return
     try:
         if path.exists():
             if bak.exists():
@@ -158,9 +429,21 @@ def safe_load_json(path: Path, default):
         logging.exception("Ошибка чтения %s: %s", path, e)
         return default
 
-# ---- I/O сотрудников и смен
-def load_employees() -> dict[int, Dict[str, Any]]:
-    raw = safe_load_json(EMP_FILE, DEFAULT_EMPLOYEES)
+def safe_load_snapshot(path: Path) -> dict[str, dict[int, ShiftRecord]]:
+    if not path.exists():
+        return {}
+    for candidate in (path, path.with_suffix(path.suffix + ".bak")):
+        try:
+            return unpack_month(candidate.read_bytes())
+        except FileNotFoundError:
+            continue
+        except (ValueError, struct.error, UnicodeDecodeError, IndexError, OverflowError) as e:
+            logging.error("Снимок %s повреждён: %r", candidate, e)
+    logging.error("Снимок %s не читается, месяц пропущен", path)
+    return {}
+
+# ---- Сериализация сотрудников и смен
+def employees_from_json(raw: Dict[str, Any]) -> dict[int, Dict[str, Any]]:
     result: dict[int, Dict[str, Any]] = {}
     for k, v in raw.items():
         uid = int(k)
@@ -170,13 +453,10 @@ def load_employees() -> dict[int, Dict[str, Any]]:
             name = str(v.get("name", f"ID {uid}"))
             active = bool(v.get("active", True))
             result[uid] = {"name": name, "active": active}
-    if not EMP_FILE.exists():
-        atomic_write_text(EMP_FILE, json.dumps({str(k): v for k, v in result.items()}, ensure_ascii=False, indent=2))
     return result
 
-def save_employees() -> None:
-    out = {str(k): {"name": v.get("name",""), "active": bool(v.get("active", True))} for k, v in EMPLOYEES.items()}
-    atomic_write_text(EMP_FILE, json.dumps(out, ensure_ascii=False, indent=2))
+def employees_to_json(employees: Dict[int, Dict[str, Any]]) -> dict[str, Dict[str, Any]]:
+    return {str(k): {"name": v.get("name",""), "active": bool(v.get("active", True))} for k, v in employees.items()}
 
 def dt_to_iso(dt: datetime.datetime | None) -> str | None:
     return dt.astimezone(MSK).isoformat() if dt else None
@@ -185,40 +465,1355 @@ def dt_from_iso(s: str | None) -> datetime.datetime | None:
     if not s: return None
     return datetime.datetime.fromisoformat(s)
 
+def shift_to_json(rec: ShiftRecord) -> Dict[str, Any]:
+    return {
+        "start": dt_to_iso(msk_datetime(rec.start)),
+        "end": dt_to_iso(msk_datetime(rec.end)),
+        "start_reason": rec.start_reason,
+        "end_reason": rec.end_reason,
+        "comment": rec.comment,
+        "comment_done": rec.comment_done,
+        **{k: getattr(rec, k) for k in METRIC_KEYS},
+    }
+
+def shift_from_json(d: Dict[str, Any], recompute: bool = False) -> ShiftRecord:
+    start, end = dt_from_iso(d.get("start")), dt_from_iso(d.get("end"))
+    done = d.get("comment_done")
+    rec = ShiftRecord(
+        None if start is None else int(start.timestamp()),
+        None if end is None else int(end.timestamp()),
+        intern_text(d.get("start_reason")),
+        intern_text(d.get("end_reason")),
+        intern_text(d.get("comment")),
+        None if done is None else bool(done),
+    )
+    # старые записи (и импорт) — без сохранённых метрик: считаем один раз здесь
+    if recompute or any(d.get(k) is None for k in METRIC_KEYS):
+        return materialize_metrics(rec)
+    rec.start_hm = sys.intern(d["start_hm"])
+    rec.end_hm = sys.intern(d["end_hm"])
+    rec.early_start, rec.late_start = d["early_start"], d["late_start"]
+    rec.early_end, rec.late_end, rec.work_min = d["early_end"], d["late_end"], d["work_min"]
+    return rec
+
+def shift_months(data: Dict[str, Dict[str, Any]], recompute: bool = False) -> list[tuple[str, dict[str, dict[int, ShiftRecord]]]]:
+    """Смены в формате shifts.json по месяцам (ym, day -> uid -> запись) — вход STORE.replace_shifts."""
+    by_month: dict[str, dict[str, dict[int, ShiftRecord]]] = defaultdict(dict)
+    for day, users in data.items():
+        by_month[month_of(day)][day] = {int(uid_str): shift_from_json(d, recompute) for uid_str, d in users.items()}
+    return sorted(by_month.items())
+
+# ---- Бинарный снимок месяца (shifts/YYYY-MM.bin)
+# Заголовок, таблица строк (причины, комментарии, "HH:MM" — каждая строка один раз)
+# и массив записей фиксированного размера: день — ordinal, время — epoch-секунды,
+# строки — индексы в таблице. Читается одним struct.iter_unpack прямо в ShiftRecord,
+# без разбора дат. DSB1 (микросекунды + неиспользуемое смещение пояса) ещё читается;
+# такой месяц переписывается в DSB2 при следующей записи.
+SNAPSHOT_MAGIC = b"DSB2"
+SNAPSHOT_MAGIC_V1 = b"DSB1"
+SNAPSHOT_HEADER = struct.Struct("<4sII")   # magic, строк, записей
+SNAPSHOT_RECORD = struct.Struct("<iqqqiiibiiiiiii")
+SNAPSHOT_RECORD_V1 = struct.Struct("<iqqqhhiiibiiiiiii")
+NO_TIME = -(2 ** 63)   # нет времени (None)
+NO_STR = -1            # нет строки (None)
+
+def pack_month(days: Dict[str, Dict[int, ShiftRecord]]) -> bytes:
+    """Смены месяца (day -> uid -> ShiftRecord) в бинарный снимок."""
+    strings: dict[str, int] = {}
+    def sid(value: str | None) -> int:
+        if value is None:
+            return NO_STR
+        return strings.setdefault(value, len(strings))
+
+    records = bytearray()
+    count = 0
+    for day in sorted(days):
+        ordinal = datetime.date.fromisoformat(day).toordinal()
+        for uid, rec in days[day].items():
+            done = rec.comment_done
+            records += SNAPSHOT_RECORD.pack(
+                ordinal, uid,
+                NO_TIME if rec.start is None else rec.start,
+                NO_TIME if rec.end is None else rec.end,
+                sid(rec.start_reason), sid(rec.end_reason), sid(rec.comment),
+                -1 if done is None else int(bool(done)),
+                sid(rec.start_hm), sid(rec.end_hm),
+                rec.early_start, rec.late_start, rec.early_end, rec.late_end, rec.work_min,
+            )
+            count += 1
+    encoded = [value.encode("utf-8") for value in strings]
+    lengths = struct.pack(f"<{len(encoded)}I", *map(len, encoded))
+    return b"".join([SNAPSHOT_HEADER.pack(SNAPSHOT_MAGIC, len(encoded), count), lengths, *encoded, records])
+
+def snapshot_rows_v1(view: memoryview) -> Iterable[tuple]:
+    """Записи DSB1 в раскладке DSB2: микросекунды → секунды, смещения пояса отброшены."""
+    for ordinal, uid, start_us, end_us, _, _, *rest in SNAPSHOT_RECORD_V1.iter_unpack(view):
+        yield (ordinal, uid,
+               start_us // 1_000_000 if start_us != NO_TIME else NO_TIME,
+               end_us // 1_000_000 if end_us != NO_TIME else NO_TIME, *rest)
+
+def unpack_month(buf: bytes) -> dict[str, dict[int, ShiftRecord]]:
+    magic, n_strings, n_records = SNAPSHOT_HEADER.unpack_from(buf)
+    if magic not in (SNAPSHOT_MAGIC, SNAPSHOT_MAGIC_V1):
+        raise ValueError(f"не снимок смен: {magic!r}")
+    record = SNAPSHOT_RECORD if magic == SNAPSHOT_MAGIC else SNAPSHOT_RECORD_V1
+    pos = SNAPSHOT_HEADER.size
+    lengths = struct.unpack_from(f"<{n_strings}I", buf, pos)
+    pos += 4 * n_strings
+    strings = []
+    for n in lengths:
+        strings.append(sys.intern(buf[pos:pos + n].decode("utf-8")))
+        pos += n
+    if len(buf) - pos != n_records * record.size:
+        raise ValueError("снимок смен обрезан")
+
+    strings.append(None)  # индекс NO_STR (-1) → None
+    view = memoryview(buf)[pos:]
+    rows = SNAPSHOT_RECORD.iter_unpack(view) if magic == SNAPSHOT_MAGIC else snapshot_rows_v1(view)
+    out: dict[str, dict[int, ShiftRecord]] = {}
+    day_keys: dict[int, dict[int, ShiftRecord]] = {}
+    for (ordinal, uid, start, end, start_reason, end_reason, comment, done,
+         start_hm, end_hm, early_start, late_start, early_end, late_end, work_min) in rows:
+        users = day_keys.get(ordinal)
+        if users is None:
+            users = day_keys[ordinal] = out[datetime.date.fromordinal(ordinal).isoformat()] = {}
+        # индекс строки за пределами таблицы — IndexError, его ловит safe_load_snapshot
+        users[uid] = ShiftRecord(
+            start if start != NO_TIME else None,
+            end if end != NO_TIME else None,
+            strings[start_reason], strings[end_reason], strings[comment],
+            None if done < 0 else bool(done),
+            strings[start_hm], strings[end_hm],
+            early_start, late_start, early_end, late_end, work_min,
+        )
+    return out
+
+def month_of(day: str) -> str:
+    return day[:7]
+
+def month_bounds(ym: str) -> tuple[str, str]:
+    y, m = int(ym[:4]), int(ym[5:7])
+    return f"{ym}-01", f"{ym}-{calendar.monthrange(y, m)[1]:02d}"
+
+def months_in_range(date_from: datetime.date, date_to: datetime.date) -> list[str]:
+    out = []
+    cur = date_from.replace(day=1)
+    while cur <= date_to:
+        out.append(cur.strftime("%Y-%m"))
+        cur = (cur + datetime.timedelta(days=32)).replace(day=1)
+    return out
+
+# ================== ХРАНИЛИЩЕ ==================
+# Кэш в памяти (shifts_by_date, EMPLOYEES) живёт отдельно от хранилища:
+# каждая мутация сразу уходит в STORE, а прошлые месяцы и диапазоны для
+# отчёта читаются из STORE по требованию.
+def locked(method):
+    # хранилище вызывается и из event loop (чтения), и из потока фоновой записи
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        with self.lock:
+            return method(self, *args, **kwargs)
+    return wrapper
+
+class ShiftStore(ABC):
+    """Интерфейс долговременного хранилища сотрудников и смен: бэкенд без любого
+    из абстрактных методов не создаётся."""
+    name = "base"
+
+    def __init__(self):
+        self.flush_needed = asyncio.Event()
+        self.loop: asyncio.AbstractEventLoop | None = None  # чей loop ждёт flush_needed (store_maintenance)
+        self.lock = threading.RLock()
+
+    def request_flush(self, needed: bool = True) -> None:
+        """Поднять/снять flush_needed. Хранилище пишет из потока, а asyncio.Event
+        не потокобезопасен — меняем его только внутри event loop."""
+        if self.loop is not None and not self.loop.is_closed():
+            self.loop.call_soon_threadsafe(self.flush_needed.set if needed else self.flush_needed.clear)
+
+    def open(self) -> None: ...
+    def close(self) -> None: ...
+
+    @abstractmethod
+    def load_employees(self) -> dict[int, Dict[str, Any]] | None:
+        """None — справочника ещё нет (первый запуск)."""
+
+    @abstractmethod
+    def save_employees(self, employees: Dict[int, Dict[str, Any]]) -> None: ...
+
+    @abstractmethod
+    def read_range(self, date_from: datetime.date, date_to: datetime.date) -> dict[str, dict[int, ShiftRecord]]: ...
+
+    def read_month(self, ym: str) -> dict[str, dict[int, ShiftRecord]]:
+        lo, hi = month_bounds(ym)
+        return self.read_range(datetime.date.fromisoformat(lo), datetime.date.fromisoformat(hi))
+
+    @abstractmethod
+    def write_shifts(self, batch: list[tuple[str, int, ShiftRecord]]) -> None:
+        """Пачка upsert'ов (day, uid, запись) — одна операция ввода-вывода."""
+
+    def pending(self) -> int:
+        """Сколько изменений ещё не свёрнуто в основное хранилище."""
+        return 0
+
+    def flush(self) -> None: ...
+
+    @abstractmethod
+    def replace_shifts(self, months: Iterable[tuple[str, dict[str, dict[int, ShiftRecord]]]]) -> None:
+        """Полная замена истории: смены приходят по месяцам (ym, day -> uid -> запись), месяц может
+        повториться. Итератор читается по одному месяцу; если он упал — прежняя история остаётся."""
+
+    @abstractmethod
+    def export_shifts(self) -> dict[str, dict[str, Dict[str, Any]]]:
+        """Вся история в формате shifts.json."""
+
+    @abstractmethod
+    def history_bounds(self) -> tuple[datetime.date, datetime.date] | None:
+        """Период, в который попадают все смены (можно шире); None — смен нет."""
+
+    def describe(self) -> list[str]:
+        return [f"backend: {self.name}"]
+
+    def describe_loads(self) -> str:
+        """Сколько и каких снимков прочитано (и за сколько) — для лога старта."""
+        return "—"
+
+class JsonStore(ShiftStore):
+    """employees.json + помесячные партиции shifts/YYYY-MM.(bin|json) + журнал shifts.journal.
+
+    Каждая мутация дописывает одну строку {"day", "uid", ...полная запись смены}
+    в журнал. Запись идемпотентна (upsert целиком), поэтому повторное применение
+    журнала поверх уже сжатых партиций безопасно.
+    """
+    name = "json"
+
+    def __init__(self):
+        super().__init__()
+        self.journal_records = 0
+        # day -> uid_str -> запись в JSON-виде: то, что есть в журнале, но ещё не в партициях
+        self.unfolded: dict[str, dict[str, Dict[str, Any]]] = defaultdict(dict)
+        # формат -> [файлов, записей, секунд] прочитано партиций
+        self.load_stats: dict[str, list] = {"binary": [0, 0, 0.0], "json": [0, 0, 0.0]}
+
+    def open(self) -> None:
+        self.recover_replace()
+        self.migrate_legacy()
+        SHIFTS_DIR.mkdir(parents=True, exist_ok=True)
+        self.convert_partitions()
+        self.replay_journal()
+
+    # ---- сотрудники
+    @locked
+    def load_employees(self) -> dict[int, Dict[str, Any]] | None:
+        if not EMP_FILE.exists():
+            return None
+        return employees_from_json(safe_load_json(EMP_FILE, DEFAULT_EMPLOYEES))
+
+    @locked
+    def save_employees(self, employees: Dict[int, Dict[str, Any]]) -> None:
+        atomic_write_text(EMP_FILE, json.dumps(employees_to_json(employees), ensure_ascii=False, indent=2))
+
+    # ---- партиции
+    @staticmethod
+    def partition_file(ym: str, fmt: str | None = None, root: Path | None = None) -> Path:
+        return (root or SHIFTS_DIR) / f"{ym}.{'bin' if (fmt or SNAPSHOT_FORMAT) == 'binary' else 'json'}"
+
+    @staticmethod
+    def staging_dir() -> Path:
+        # новая история при замене собирается рядом и подменяет shifts/ целиком
+        return SHIFTS_DIR.with_name(SHIFTS_DIR.name + ".new")
+
+    @staticmethod
+    def partition_months() -> list[str]:
+        if not SHIFTS_DIR.exists():
+            return []
+        return sorted({p.stem for pattern in ("????-??.bin", "????-??.json") for p in SHIFTS_DIR.glob(pattern)})
+
+    def partition_format(self, ym: str, root: Path | None = None) -> str | None:
+        # оба файла бывают только после падения посреди перезаписи — новее тот, что записан последним
+        found = [(p.stat().st_mtime, fmt) for fmt in ("binary", "json") if (p := self.partition_file(ym, fmt, root)).exists()]
+        return max(found)[1] if found else None
+
+    def read_partition(self, ym: str, root: Path | None = None) -> dict[str, dict[int, ShiftRecord]]:
+        fmt = self.partition_format(ym, root)
+        if fmt is None:
+            return {}
+        t0 = time.perf_counter()
+        if fmt == "binary":
+            data = safe_load_snapshot(self.partition_file(ym, fmt, root))
+        else:
+            raw = safe_load_json(self.partition_file(ym, fmt, root), {})
+            data = {day: {int(uid_str): shift_from_json(d) for uid_str, d in users.items()} for day, users in raw.items()}
+        stats = self.load_stats[fmt]
+        stats[0] += 1
+        stats[1] += sum(len(users) for users in data.values())
+        stats[2] += time.perf_counter() - t0
+        return data
+
+    def read_month_records(self, ym: str) -> dict[str, dict[int, ShiftRecord]]:
+        data = self.read_partition(ym)
+        for day, users in self.unfolded.items():
+            if month_of(day) == ym:
+                data.setdefault(day, {}).update({int(uid_str): shift_from_json(d) for uid_str, d in users.items()})
+        return data
+
+    @locked
+    def read_range(self, date_from, date_to):
+        lo, hi = date_from.isoformat(), date_to.isoformat()
+        out: dict[str, dict[int, ShiftRecord]] = {}
+        for ym in months_in_range(date_from, date_to):
+            for day, users in self.read_month_records(ym).items():
+                if lo <= day <= hi:
+                    out[day] = users
+        return out
+
+    def write_partition(self, ym: str, days: Dict[str, Dict[int, ShiftRecord]], root: Path | None = None) -> None:
+        path = self.partition_file(ym, root=root)
+        if SNAPSHOT_FORMAT == "binary":
+            atomic_write_bytes(path, pack_month(days))
+        else:
+            data = {day: {str(uid): shift_to_json(rec) for uid, rec in days[day].items()} for day in sorted(days)}
+            atomic_write_text(path, json.dumps(data, ensure_ascii=False, indent=2))
+        # партиция другого формата за этот месяц теперь устарела
+        other = self.partition_file(ym, "json" if SNAPSHOT_FORMAT == "binary" else "binary", root)
+        for stale in (other, other.with_suffix(other.suffix + ".bak")):
+            stale.unlink(missing_ok=True)
+
+    def write_partitions(self, data: Dict[str, Dict[str, Any]]) -> None:
+        for ym, days in shift_months(data):
+            self.write_partition(ym, days)
+
+    def convert_partitions(self) -> None:
+        # смена SNAPSHOT_FORMAT: переписываем всю историю в выбранный формат (и обратно — для отката)
+        months = [ym for ym in self.partition_months() if self.partition_format(ym) != SNAPSHOT_FORMAT]
+        if not months:
+            return
+        t0 = time.perf_counter()
+        for ym in months:
+            self.write_partition(ym, self.read_partition(ym))
+        logging.info("Партиции смен переписаны в формат %s: %s мес. за %.0f мс", SNAPSHOT_FORMAT, len(months), (time.perf_counter() - t0) * 1000)
+
+    def describe_loads(self) -> str:
+        return ", ".join(
+            f"{fmt}: файлов={files} записей={records} за {seconds * 1000:.0f} мс"
+            for fmt, (files, records, seconds) in self.load_stats.items() if files
+        ) or "—"
+
+    def migrate_legacy(self) -> None:
+        # однократно режем старый единый shifts.json на месячные партиции
+        if SHIFTS_DIR.exists() or not SHIFT_FILE.exists():
+            return
+        data_in = safe_load_json(SHIFT_FILE, {})
+        SHIFTS_DIR.mkdir(parents=True, exist_ok=True)
+        self.write_partitions(data_in)
+        os.replace(SHIFT_FILE, SHIFT_FILE.with_suffix(".json.migrated"))
+        logging.info("shifts.json разложен по месяцам в %s (%s дней)", SHIFTS_DIR, len(data_in))
+
+    # ---- журнал
+    @locked
+    def write_shifts(self, batch):
+        lines = []
+        for day, uid, rec in batch:
+            j = shift_to_json(rec)
+            lines.append(json.dumps({"day": day, "uid": uid, **j}, ensure_ascii=False, separators=(",", ":")) + "\n")
+            self.unfolded[day][str(uid)] = j
+        JOURNAL_FILE.parent.mkdir(parents=True, exist_ok=True)
+        with JOURNAL_FILE.open("a", encoding="utf-8") as f:
+            f.writelines(lines)
+            if PERSIST_FSYNC:
+                f.flush()
+                os.fsync(f.fileno())
+        self.journal_records += len(lines)
+        if self.journal_records >= JOURNAL_COMPACT_EVERY:
+            self.request_flush()
+
+    def replay_journal(self) -> None:
+        self.unfolded.clear()
+        self.journal_records = 0
+        if not JOURNAL_FILE.exists():
+            return
+        with JOURNAL_FILE.open("r", encoding="utf-8") as f:
+            for lineno, line in enumerate(f, 1):
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    rec = json.loads(line)
+                    day, uid = rec.pop("day"), int(rec.pop("uid"))
+                except (json.JSONDecodeError, KeyError, TypeError, ValueError):
+                    # оборванная последняя строка после падения — пропускаем
+                    logging.warning("Журнал %s: пропущена повреждённая строка %s", JOURNAL_FILE, lineno)
+                    continue
+                self.unfolded[day][str(uid)] = rec
+                self.journal_records += 1
+
+    def reset_journal(self) -> None:
+        JOURNAL_FILE.parent.mkdir(parents=True, exist_ok=True)
+        JOURNAL_FILE.write_text("", encoding="utf-8")
+        self.unfolded.clear()
+        self.journal_records = 0
+        self.request_flush(False)
+
+    def pending(self) -> int:
+        return self.journal_records
+
+    @locked
+    def flush(self) -> None:
+        # сначала партиции (только затронутые месяцы), потом обнуление журнала:
+        # падение между шагами лишь повторит upsert'ы
+        if not self.journal_records:
+            return
+        for ym in sorted({month_of(day) for day in self.unfolded}):
+            self.write_partition(ym, self.read_month_records(ym))
+        self.reset_journal()
+
+    # ---- импорт/экспорт
+    @locked
+    def replace_shifts(self, months):
+        staging = self.staging_dir()
+        shutil.rmtree(staging, ignore_errors=True)
+        staging.mkdir(parents=True)
+        try:
+            for ym, days in months:
+                if self.partition_format(ym, staging):  # месяц встретился ещё раз — дописываем к уже собранному
+                    merged = self.read_partition(ym, staging)
+                    for day, users in days.items():
+                        merged.setdefault(day, {}).update(users)
+                    days = merged
+                self.write_partition(ym, days, staging)
+        except BaseException:
+            shutil.rmtree(staging, ignore_errors=True)  # прежние партиции не тронуты
+            raise
+        old = SHIFTS_DIR.with_name(SHIFTS_DIR.name + ".old")
+        shutil.rmtree(old, ignore_errors=True)
+        if SHIFTS_DIR.exists():
+            os.replace(SHIFTS_DIR, old)
+        os.replace(staging, SHIFTS_DIR)
+        shutil.rmtree(old, ignore_errors=True)
+        self.reset_journal()
+
+    def recover_replace(self) -> None:
+        # падение посреди replace_shifts: shifts/ уже убран — собранная история готова, доводим подмену;
+        # иначе импорт не дописан — выбрасываем
+        staging = self.staging_dir()
+        if staging.exists():
+            if SHIFTS_DIR.exists():
+                shutil.rmtree(staging)
+            else:
+                os.replace(staging, SHIFTS_DIR)
+                logging.warning("Замена истории доведена после перезапуска: %s", SHIFTS_DIR)
+        shutil.rmtree(SHIFTS_DIR.with_name(SHIFTS_DIR.name + ".old"), ignore_errors=True)
+
+    @locked
+    def export_shifts(self):
+        self.flush()
+        data_out: dict[str, dict[str, Dict[str, Any]]] = {}
+        for ym in self.partition_months():
+            for day, users in sorted(self.read_partition(ym).items()):
+                data_out[day] = {str(uid): shift_to_json(rec) for uid, rec in users.items()}
+        return data_out
+
+    @locked
+    def history_bounds(self):
+        # с точностью до месяца: партиции и журнал без чтения самих смен
+        months = set(self.partition_months()) | {month_of(day) for day in self.unfolded}
+        if not months:
+            return None
+        return datetime.date.fromisoformat(month_bounds(min(months))[0]), datetime.date.fromisoformat(month_bounds(max(months))[1])
+
+    @locked
+    def describe(self) -> list[str]:
+        months = self.partition_months()
+        parts_size = sum(p.stat().st_size for ym in months for fmt in ("binary", "json") if (p := self.partition_file(ym, fmt)).exists())
+        e, j = EMP_FILE, JOURNAL_FILE
+        return [
+            f"backend: {self.name}",
+            f"{e.name}: exists={e.exists()} size={(e.stat().st_size if e.exists() else 0)} path={e}",
+            f"shifts/: months={len(months)} format={SNAPSHOT_FORMAT} size={parts_size} path={SHIFTS_DIR}",
+            f"чтение партиций: {self.describe_loads()}",
+            f"{j.name}: records={self.journal_records} size={(j.stat().st_size if j.exists() else 0)}",
+        ]
+
+SQLITE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS shifts (
+    day          TEXT    NOT NULL,
+    uid          INTEGER NOT NULL,
+    start        TEXT,
+    "end"        TEXT,
+    start_reason TEXT,
+    end_reason   TEXT,
+    comment      TEXT,
+    comment_done INTEGER,
+    start_hm     TEXT,
+    end_hm       TEXT,
+    early_start  INTEGER,
+    late_start   INTEGER,
+    early_end    INTEGER,
+    late_end     INTEGER,
+    work_min     INTEGER,
+    PRIMARY KEY (day, uid)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS shifts_uid ON shifts (uid, day);
+CREATE TABLE IF NOT EXISTS employees (
+    uid    INTEGER PRIMARY KEY,
+    name   TEXT    NOT NULL,
+    active INTEGER NOT NULL DEFAULT 1
+);
+CREATE TABLE IF NOT EXISTS meta (
+    key   TEXT PRIMARY KEY,
+    value TEXT
+);
+"""
+
+SHIFT_COLUMNS = ("start", "end", "start_reason", "end_reason", "comment", "comment_done", *METRIC_KEYS)
+SHIFT_SQL_COLUMNS = ", ".join(f'"{c}"' for c in ("day", "uid", *SHIFT_COLUMNS))
+SQL_SELECT_SHIFTS = f"SELECT {SHIFT_SQL_COLUMNS} FROM shifts"
+SQL_INSERT_SHIFT = f"INSERT INTO shifts ({SHIFT_SQL_COLUMNS}) VALUES ({', '.join('?' * (len(SHIFT_COLUMNS) + 2))})"
+SQL_UPSERT_SHIFT = SQL_INSERT_SHIFT + " ON CONFLICT(day, uid) DO UPDATE SET " + ", ".join(
+    f'"{c}" = excluded."{c}"' for c in SHIFT_COLUMNS
+)
+
+class SqliteStore(ShiftStore):
+    """Одна SQLite-база в режиме WAL: смены с индексами (day, uid) и (uid, day), справочник сотрудников."""
+    name = "sqlite"
+
+    def __init__(self, path: Path):
+        super().__init__()
+        self.path = path
+        self.db: sqlite3.Connection | None = None
+
+    def open(self) -> None:
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        # isolation_level=None — автокоммит; пакеты оборачиваем в BEGIN/COMMIT сами
+        # check_same_thread=False: пишет фоновый поток, доступ сериализован self.lock
+        self.db = sqlite3.connect(self.path, isolation_level=None, check_same_thread=False)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=FULL" if PERSIST_FSYNC else "PRAGMA synchronous=NORMAL")
+        self.db.executescript(SQLITE_SCHEMA)
+        # базы, созданные до появления колонок метрик
+        existing = {row[1] for row in self.db.execute("PRAGMA table_info(shifts)")}
+        for col in METRIC_KEYS:
+            if col not in existing:
+                col_type = "TEXT" if col.endswith("_hm") else "INTEGER"
+                self.db.execute(f"ALTER TABLE shifts ADD COLUMN {col} {col_type}")
+        if self.get_meta("migrated_from_json") is None:
+            self.migrate_from_json()
+
+    @locked
+    def close(self) -> None:
+        if self.db is not None:
+            self.db.close()
+            self.db = None
+
+    def get_meta(self, key: str) -> str | None:
+        row = self.db.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else None
+
+    def set_meta(self, key: str, value: str) -> None:
+        self.db.execute("INSERT INTO meta (key, value) VALUES (?, ?) ON CONFLICT(key) DO UPDATE SET value = excluded.value", (key, value))
+
+    def migrate_from_json(self) -> None:
+        # однократный перенос employees.json / shifts.json (или партиций) в базу
+        legacy = JsonStore()
+        legacy.open()
+        emps = legacy.load_employees()
+        shifts = legacy.export_shifts()
+        if emps is not None:
+            self.save_employees(emps)
+        self.replace_shifts(shift_months(shifts))
+        self.set_meta("migrated_from_json", msk_now().isoformat())
+        logging.info("SQLite: перенесено из JSON сотрудников=%s, дней=%s", len(emps or {}), len(shifts))
+
+    # ---- сотрудники
+    @locked
+    def load_employees(self):
+        rows = self.db.execute("SELECT uid, name, active FROM employees").fetchall()
+        if not rows:
+            return None
+        return {uid: {"name": name, "active": bool(active)} for uid, name, active in rows}
+
+    @locked
+    def save_employees(self, employees):
+        rows = [(uid, v.get("name",""), int(bool(v.get("active", True)))) for uid, v in employees.items()]
+        with self.transaction():
+            self.db.execute("DELETE FROM employees")
+            self.db.executemany("INSERT INTO employees (uid, name, active) VALUES (?, ?, ?)", rows)
+
+    # ---- смены
+    @contextlib.contextmanager
+    def transaction(self):
+        self.db.execute("BEGIN")
+        try:
+            yield
+        except BaseException:
+            self.db.execute("ROLLBACK")
+            raise
+        self.db.execute("COMMIT")
+
+    @staticmethod
+    def row_to_json(row) -> Dict[str, Any]:
+        d = dict(zip(SHIFT_COLUMNS, row))
+        d["comment_done"] = None if d["comment_done"] is None else bool(d["comment_done"])
+        return d
+
+    @staticmethod
+    def json_to_row(day: str, uid: int, j: Dict[str, Any]) -> tuple:
+        row = {c: j.get(c) for c in SHIFT_COLUMNS}
+        done = row["comment_done"]
+        row["comment_done"] = None if done is None else int(bool(done))
+        return (day, uid, *row.values())
+
+    @locked
+    def read_range(self, date_from, date_to):
+        out: dict[str, dict[int, ShiftRecord]] = defaultdict(dict)
+        cur = self.db.execute(
+            SQL_SELECT_SHIFTS + " WHERE day BETWEEN ? AND ? ORDER BY day",
+            (date_from.isoformat(), date_to.isoformat()),
+        )
+        for day, uid, *rest in cur:
+            out[day][uid] = shift_from_json(self.row_to_json(rest))
+        return dict(out)
+
+    @locked
+    def write_shifts(self, batch):
+        rows = [self.json_to_row(day, uid, shift_to_json(rec)) for day, uid, rec in batch]
+        with self.transaction():
+            self.db.executemany(SQL_UPSERT_SHIFT, rows)
+
+    @locked
+    def replace_shifts(self, months):
+        # одна транзакция: оборвался итератор — ROLLBACK, история прежняя
+        with self.transaction():
+            self.db.execute("DELETE FROM shifts")
+            for ym, days in months:
+                rows = [self.json_to_row(day, uid, shift_to_json(rec)) for day, users in days.items() for uid, rec in users.items()]
+                self.db.executemany(SQL_UPSERT_SHIFT, rows)
+
+    @locked
+    def export_shifts(self):
+        data_out: dict[str, dict[str, Dict[str, Any]]] = defaultdict(dict)
+        cur = self.db.execute(SQL_SELECT_SHIFTS + " ORDER BY day, uid")
+        for day, uid, *rest in cur:
+            data_out[day][str(uid)] = self.row_to_json(rest)
+        return dict(data_out)
+
+    @locked
+    def history_bounds(self):
+        lo, hi = self.db.execute("SELECT MIN(day), MAX(day) FROM shifts").fetchone()
+        return (datetime.date.fromisoformat(lo), datetime.date.fromisoformat(hi)) if lo else None
+
+    @locked
+    def describe(self) -> list[str]:
+        n_shifts = self.db.execute("SELECT COUNT(*) FROM shifts").fetchone()[0]
+        n_emps = self.db.execute("SELECT COUNT(*) FROM employees").fetchone()[0]
+        size = self.path.stat().st_size if self.path.exists() else 0
+        return [
+            f"backend: {self.name}",
+            f"{self.path.name}: size={size} path={self.path}",
+            f"shifts: rows={n_shifts}; employees: rows={n_emps}",
+        ]
+
+def make_store() -> ShiftStore:
+    if STORAGE_BACKEND == "sqlite":
+        return SqliteStore(DB_FILE)
+    if STORAGE_BACKEND != "json":
+        logging.warning("Неизвестный STORAGE_BACKEND=%r, использую json", STORAGE_BACKEND)
+    return JsonStore()
+
+STORE = make_store()
+
+# ---- Сотрудники
+def load_employees() -> dict[int, Dict[str, Any]]:
+    result = STORE.load_employees()
+    if result is None:
+        result = employees_from_json(DEFAULT_EMPLOYEES)
+        STORE.save_employees(result)
+    return result
+
+def save_employees() -> None:
+    mark_employees_dirty()
+
+class EmployeeDirectory:
+    """Справочник поверх EMPLOYEES с готовым порядком по ФИО (затем по ID).
+
+    Порядок всех, активных и неактивных хранится отсортированными списками
+    ключей (имя в нижнем регистре, uid); правки владельца — точечные вставки и
+    удаления через bisect, полная пересортировка — только при импорте.
+    """
+
+    def __init__(self, employees: Dict[int, Dict[str, Any]]):
+        self.employees = employees  # тот же dict, что EMPLOYEES: его пишет save_employees()
+        self.rebuild()
+
+    @staticmethod
+    def key(uid: int, meta: Dict[str, Any]) -> tuple[str, int]:
+        return meta.get("name", "").lower(), uid
+
+    def rebuild(self) -> None:
+        self.names: dict[int, str] = {uid: meta.get("name", "") for uid, meta in self.employees.items()}
+        self.order = sorted(self.key(uid, meta) for uid, meta in self.employees.items())
+        self.active = [k for k in self.order if self.employees[k[1]].get("active", True)]
+        self.inactive = [k for k in self.order if not self.employees[k[1]].get("active", True)]
+
+    def subset(self, meta: Dict[str, Any]) -> list[tuple[str, int]]:
+        return self.active if meta.get("active", True) else self.inactive
+
+    def index(self, uid: int) -> None:
+        meta = self.employees[uid]
+        key = self.key(uid, meta)
+        bisect.insort(self.order, key)
+        bisect.insort(self.subset(meta), key)
+        self.names[uid] = meta.get("name", "")
+
+    def unindex(self, uid: int) -> None:
+        meta = self.employees[uid]
+        key = self.key(uid, meta)
+        for keys in (self.order, self.subset(meta)):
+            del keys[bisect.bisect_left(keys, key)]
+        del self.names[uid]
+
+    # ---- правки (запись на диск — save_employees() у вызывающего)
+    def add(self, uid: int, name: str, active: bool = True) -> None:
+        if uid in self.employees:
+            self.unindex(uid)
+        self.employees[uid] = {"name": name, "active": active}
+        self.index(uid)
+
+    def set_active(self, uid: int, active: bool) -> Dict[str, Any] | None:
+        meta = self.employees.get(uid)
+        if meta is None:
+            return None
+        self.unindex(uid)
+        meta["active"] = active
+        self.index(uid)
+        return meta
+
+    def remove(self, uid: int) -> bool:
+        if uid not in self.employees:
+            return False
+        self.unindex(uid)
+        del self.employees[uid]
+        return True
+
+    def replace(self, employees: Dict[int, Dict[str, Any]]) -> None:
+        self.employees.clear()
+        self.employees.update(employees)
+        self.rebuild()
+
+    # ---- чтение
+    def get(self, uid: int) -> Dict[str, Any] | None:
+        return self.employees.get(uid)
+
+    def name(self, uid: int) -> str | None:
+        return self.names.get(uid)
+
+    def uids(self, active: bool | None = None) -> list[int]:
+        """uid по ФИО: все, только активные (True) или только неактивные (False)."""
+        keys = self.order if active is None else (self.active if active else self.inactive)
+        return [uid for _, uid in keys]
+
+    def ordered(self) -> Iterable[tuple[int, Dict[str, Any]]]:
+        employees = self.employees
+        return ((uid, employees[uid]) for _, uid in self.order)
+
+    def snapshot(self) -> dict[int, Dict[str, Any]]:
+        """Копия в порядке ФИО — для отчётов в пуле потоков (порядок dict сохраняется)."""
+        return {uid: dict(meta) for uid, meta in self.ordered()}
+
+    def __len__(self) -> int:
+        return len(self.employees)
+
+# ---- Смены: кэш загруженных месяцев поверх STORE
+# Текущий месяц резидентен всегда, прошлые подгружаются по требованию и выгружаются.
+loaded_months: set[str] = set()
+
+def load_month(ym: str) -> None:
+    if ym in loaded_months:
+        return
+    for day, users in STORE.read_month(ym).items():
+        # то, что уже в памяти (свежие мутации), главнее хранилища
+        users.update(shifts_by_date.get(day, {}))
+        shifts_by_date[day] = users
+    loaded_months.add(ym)
+
+def day_shifts(day: str) -> Dict[int, ShiftRecord]:
+    load_month(month_of(day))
+    return shifts_by_date.get(day, {})
+
+def resident_days(date_from: datetime.date, date_to: datetime.date) -> dict[str, dict[int, ShiftRecord]]:
+    """Копия резидентных дней периода (в т.ч. ещё не записанные правки) — безопасна для другого потока."""
+    lo, hi = date_from.isoformat(), date_to.isoformat()
+    return {
+        day: {uid: replace(rec) for uid, rec in users.items()}
+        for day, users in shifts_by_date.items() if lo <= day <= hi and users
+    }
+
+def load_range(
+    date_from: datetime.date,
+    date_to: datetime.date,
+    resident: dict[str, dict[int, ShiftRecord]] | None = None,
+) -> dict[str, dict[int, ShiftRecord]]:
+    """Смены за период: одним чтением из хранилища, резидентные дни — из памяти. Кэш не засоряется."""
+    data = STORE.read_range(date_from, date_to)
+    data.update(resident_days(date_from, date_to) if resident is None else resident)
+    return data
+
+def evict_months() -> None:
+    # месяцы с ещё не записанными изменениями не трогаем
+    keep = {month_of(today_key())} | {month_of(day) for day, _ in dirty_shifts}
+    for ym in list(loaded_months - keep):
+        for day in [d for d in shifts_by_date if month_of(d) == ym]:
+            del shifts_by_date[day]
+        loaded_months.discard(ym)
+
+def save_shift(uid: int, day: str | None = None) -> None:
+    mark_shift_dirty(day or today_key(), uid)
+
 def save_shifts() -> None:
-    data_out: dict[str, dict[str, dict[str, Any]]] = {}
-    for day, users in shifts_by_date.items():
-        data_out[day] = {}
-        for uid, d in users.items():
-            data_out[day][str(uid)] = {
-                "start": dt_to_iso(d.get("start")),
-                "end": dt_to_iso(d.get("end")),
-                "start_reason": d.get("start_reason"),
-                "end_reason": d.get("end_reason"),
-                "comment": d.get("comment"),
-                "comment_done": d.get("comment_done"),
-            }
-    atomic_write_text(SHIFT_FILE, json.dumps(data_out, ensure_ascii=False, indent=2))
+    # синхронно: записать грязное и свернуть журнал в основное хранилище
+    batch, emps = take_dirty()
+    write_batch(batch, emps)
+    STORE.flush()
 
 def load_shifts() -> None:
-    data_in = safe_load_json(SHIFT_FILE, {})
     shifts_by_date.clear()
-    for day, users in data_in.items():
-        shifts_by_date[day] = {}
-        for uid_str, d in users.items():
-            uid = int(uid_str)
-            shifts_by_date[day][uid] = {
-                "start": dt_from_iso(d.get("start")),
-                "end": dt_from_iso(d.get("end")),
-                "start_reason": d.get("start_reason"),
-                "end_reason": d.get("end_reason"),
-                "comment": d.get("comment"),
-                "comment_done": d.get("comment_done"),
-            }
+    loaded_months.clear()
+    load_month(month_of(today_key()))
+
+async def replace_all_shifts(months: Iterable[tuple[str, dict[str, dict[int, ShiftRecord]]]]) -> None:
+    """Полная замена истории (импорт shifts.json заменой) — лента изменений начинается заново.
+    months — уже проверенные записи с посчитанными метриками, читаются по месяцу в потоке хранилища."""
+    await flush_now()  # иначе отложенные записи старых смен лягут поверх импорта
+    await asyncio.to_thread(STORE.replace_shifts, months)
+    FEED.reset(EMPLOYEES)
+    bump_data_generation()
+    load_shifts()
+
+# ---- Лента изменений
+# Каждое записанное изменение смены или сотрудника получает следующий номер seq
+# и дописывается строкой в CHANGES_FILE (полное состояние записи, как в импорте).
+# «Всё после N» читается с ближайшей точки разреженного индекса (seq -> смещение),
+# поэтому синхронизация стоит пропорционально изменениям, а не истории.
+# Правки одной записи внутри окна фоновой записи склеиваются в одну строку.
+CHANGES_INDEX_EVERY = 1024  # строк между точками индекса
+
+class ChangeFeed:
+    def __init__(self, path: Path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.seq = 0
+        self.floor = 0          # «после N» отдаётся для N >= floor, старше — только полная выгрузка
+        self.size = 0
+        self.lines = 0
+        self.index: list[tuple[int, int]] = []  # (seq первой строки блока, смещение)
+        self.employees: dict[str, Dict[str, Any]] = {}  # последнее записанное состояние справочника
+        # поколение ленты: меняется только при замене истории импортом — тогда клиентам нужна полная выгрузка
+        self.generation_path = path.with_suffix(".generation")
+        self.generation = ""
+
+    @staticmethod
+    def line_seq(line: bytes) -> int:
+        # строка всегда начинается с {"seq":N, — без разбора всего JSON
+        return int(line[7:line.index(b",")])
+
+    def new_generation(self) -> None:
+        self.generation = secrets.token_hex(8)
+        atomic_write_bytes(self.generation_path, self.generation.encode())
+
+    def open(self, employees: Dict[int, Dict[str, Any]]) -> None:
+        self.employees = employees_to_json(employees)
+        if self.generation_path.exists():
+            self.generation = self.generation_path.read_text().strip()
+        if not self.generation:
+            self.new_generation()
+        # .bak от прежних версий, которые переписывали ленту с резервной копией
+        self.path.with_suffix(self.path.suffix + ".bak").unlink(missing_ok=True)
+        self.seq = self.floor = self.size = self.lines = 0
+        self.index = []
+        if not self.path.exists():
+            return
+        good = 0
+        with self.path.open("rb") as f:
+            for line in f:
+                try:
+                    seq = self.line_seq(line)
+                    if not line.endswith(b"\n"):
+                        raise ValueError("оборванная строка")
+                except ValueError:
+                    logging.warning("Лента %s: отрезана повреждённая строка после %s байт", self.path, good)
+                    break
+                if self.lines == 0:
+                    self.floor = seq if b'"kind":"reset"' in line else seq - 1
+                if self.lines % CHANGES_INDEX_EVERY == 0:
+                    self.index.append((seq, good))
+                self.seq = seq
+                self.lines += 1
+                good += len(line)
+        if good != self.path.stat().st_size:
+            with self.path.open("r+b") as f:
+                f.truncate(good)
+        self.size = good
+
+    def append(self, entries: list[Dict[str, Any]]) -> None:
+        if not entries:
+            return
+        at = msk_now().isoformat(timespec="seconds")
+        with self.lock:
+            chunks = []
+            for entry in entries:
+                self.seq += 1
+                if self.lines % CHANGES_INDEX_EVERY == 0:
+                    self.index.append((self.seq, self.size + sum(map(len, chunks))))
+                self.lines += 1
+                chunks.append((json.dumps({"seq": self.seq, "at": at, **entry}, ensure_ascii=False, separators=(",", ":")) + "\n").encode("utf-8"))
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            with self.path.open("ab") as f:
+                f.writelines(chunks)
+                if PERSIST_FSYNC:
+                    f.flush()
+                    os.fsync(f.fileno())
+            self.size += sum(map(len, chunks))
+            if self.size > CHANGES_MAX_MB * 1024 * 1024:
+                self.trim()
+
+    def trim(self) -> None:
+        # оставить младшую половину, начиная с точки индекса; floor сдвигается следом
+        cut_at = next((i for i, (_, offset) in enumerate(self.index) if offset >= self.size // 2), None)
+        if not cut_at:
+            return
+        first_seq, base = self.index[cut_at]
+        with self.path.open("rb") as f:
+            f.seek(base)
+            tail = f.read()
+        atomic_write_bytes(self.path, tail, backup=False)  # без .bak: копия ленты — до CHANGES_MAX_MB на диске
+        self.index = [(seq, offset - base) for seq, offset in self.index[cut_at:]]
+        self.lines -= cut_at * CHANGES_INDEX_EVERY
+        self.size = len(tail)
+        self.floor = first_seq - 1
+        logging.info("Лента изменений обрезана: доступна после seq %s", self.floor)
+
+    def record_shifts(self, batch: list[tuple[str, int, ShiftRecord]]) -> None:
+        self.append([{"kind": "shift", "day": day, "uid": uid, "data": shift_to_json(rec)} for day, uid, rec in batch])
+
+    def record_employees(self, employees: Dict[int, Dict[str, Any]]) -> None:
+        """Разница со справочником из прошлой записи: добавленные, изменённые, удалённые (data=null)."""
+        new = employees_to_json(employees)
+        entries = [{"kind": "employee", "uid": int(key), "data": meta} for key, meta in new.items() if self.employees.get(key) != meta]
+        entries += [{"kind": "employee", "uid": int(key), "data": None} for key in self.employees.keys() - new.keys()]
+        self.append(entries)
+        self.employees = new
+
+    def reset(self, employees: Dict[int, Dict[str, Any]]) -> None:
+        """История заменена импортом: старые номера больше ничего не значат, поколение — новое."""
+        with self.lock:
+            self.new_generation()
+            atomic_write_bytes(self.path, b"", backup=False)
+            self.size = self.lines = 0
+            self.index = []
+        self.append([{"kind": "reset", "generation": self.generation}])
+        with self.lock:
+            self.floor = self.seq
+            self.employees = employees_to_json(employees)
+
+    def write_since(self, path: Path, after: int) -> Dict[str, Any]:
+        """Изменения с seq > after в gzip-JSONL: заголовок, затем по строке на запись (последнее состояние)."""
+        with self.lock:
+            if after < self.floor or after > self.seq:
+                raise ValueError(f"номер {after} вне ленты: доступно после {self.floor} до {self.seq}")
+            last, size = self.seq, self.size
+            points = [seq for seq, _ in self.index]
+            i = bisect.bisect_right(points, after + 1) - 1
+            offset = self.index[i][1] if i >= 0 else 0
+            f = self.path.open("rb") if self.path.exists() else io.BytesIO()
+        latest: dict[tuple, Dict[str, Any]] = {}
+        with f:
+            f.seek(offset)
+            remaining = size - offset  # строки, дописанные после снимка, — в следующий раз
+            for line in f:
+                remaining -= len(line)
+                if remaining < 0:
+                    break
+                if self.line_seq(line) <= after:
+                    continue
+                entry = json.loads(line)
+                if entry["kind"] == "reset":
+                    continue
+                latest.pop((entry["kind"], entry.get("day"), entry["uid"]), None)  # порядок — по последней правке
+                latest[(entry["kind"], entry.get("day"), entry["uid"])] = entry
+        header = {"format": "dusberg-changes", "generation": self.generation, "after": after, "seq": last, "count": len(latest)}
+        with gzip.open(path, "wt", encoding="utf-8") as out:
+            out.write(json.dumps(header) + "\n")
+            for entry in latest.values():
+                out.write(json.dumps(entry, ensure_ascii=False, separators=(",", ":")) + "\n")
+        return header
+
+    def describe(self) -> str:
+        return f"поколение={self.generation} seq={self.seq} доступно после {self.floor} строк={self.lines} размер={self.size / 1024:.0f} КБ"
+
+FEED = ChangeFeed(CHANGES_FILE)
+
+# ---- Фоновая запись
+# Хендлеры только помечают изменения; persistence_writer() собирает всплеск
+# изменений за PERSIST_WINDOW сек и пишет одной пачкой в отдельном потоке.
+dirty_shifts: dict[tuple[str, int], None] = {}   # упорядоченное множество (day, uid)
+employees_dirty = False
+dirty_since: float | None = None                 # monotonic самой старой незаписанной правки
+persist_wakeup = asyncio.Event()
+persist_io_lock = asyncio.Lock()
+persist_stats: Dict[str, float] = {"writes": 0, "records": 0, "errors": 0, "last_write_ms": 0.0, "last_batch": 0}
+
+def mark_shift_dirty(day: str, uid: int) -> None:
+    global dirty_since
+    bump_day_version(day)
+    dirty_shifts[(day, uid)] = None
+    if dirty_since is None:
+        dirty_since = time.monotonic()
+    persist_wakeup.set()
+
+def mark_employees_dirty() -> None:
+    global employees_dirty, dirty_since
+    bump_employees_version()
+    employees_dirty = True
+    if dirty_since is None:
+        dirty_since = time.monotonic()
+    persist_wakeup.set()
+
+def take_dirty() -> tuple[list[tuple[str, int, ShiftRecord]], Dict[int, Dict[str, Any]] | None]:
+    """Снимок грязных данных (копии, чтобы хендлеры могли менять оригиналы во время записи)."""
+    global employees_dirty, dirty_since
+    batch = [(day, uid, replace(shifts_by_date[day][uid])) for day, uid in dirty_shifts if uid in shifts_by_date.get(day, {})]
+    emps = {uid: dict(meta) for uid, meta in EMPLOYEES.items()} if employees_dirty else None
+    dirty_shifts.clear()
+    employees_dirty = False
+    dirty_since = None
+    return batch, emps
+
+def write_batch(batch: list[tuple[str, int, ShiftRecord]], emps: Dict[int, Dict[str, Any]] | None) -> None:
+    # в ленту — только то, что уже легло в хранилище
+    if batch:
+        STORE.write_shifts(batch)
+        FEED.record_shifts(batch)
+    if emps is not None:
+        STORE.save_employees(emps)
+        FEED.record_employees(emps)
+
+async def flush_now() -> None:
+    """Записать всё грязное немедленно, не дожидаясь окна (импорт, экспорт, остановка)."""
+    global employees_dirty, dirty_since
+    async with persist_io_lock:
+        since = dirty_since
+        batch, emps = take_dirty()
+        if not batch and emps is None:
+            return
+        t0 = time.perf_counter()
+        try:
+            await asyncio.to_thread(write_batch, batch, emps)
+        except Exception:
+            # вернуть в грязные — повторим на следующем пробуждении
+            persist_stats["errors"] += 1
+            for day, uid, _ in batch:
+                dirty_shifts.setdefault((day, uid), None)
+            employees_dirty = employees_dirty or emps is not None
+            dirty_since = since if dirty_since is None else min(dirty_since, since)
+            persist_wakeup.set()
+            raise
+        persist_stats["writes"] += 1
+        persist_stats["records"] += len(batch)
+        persist_stats["last_batch"] = len(batch)
+        persist_stats["last_write_ms"] = round((time.perf_counter() - t0) * 1000, 2)
+
+async def persistence_writer():
+    while True:
+        await persist_wakeup.wait()
+        await asyncio.sleep(PERSIST_WINDOW)  # окно склейки всплеска
+        persist_wakeup.clear()
+        try:
+            await flush_now()
+        except Exception as e:
+            logging.exception("Фоновая запись не удалась: %s", e)
+            await asyncio.sleep(1)
+
+def persistence_metrics() -> Dict[str, float]:
+    return {
+        "dirty_shifts": len(dirty_shifts),
+        "employees_dirty": int(employees_dirty),
+        "dirty_age_sec": round(time.monotonic() - dirty_since, 3) if dirty_since is not None else 0.0,
+        **persist_stats,
+    }
+
+async def store_maintenance():
+    # плановое сворачивание журнала и выгрузка прошлых месяцев из памяти
+    STORE.loop = asyncio.get_running_loop()
+    while True:
+        try:
+            await asyncio.wait_for(STORE.flush_needed.wait(), timeout=JOURNAL_COMPACT_INTERVAL)
+        except asyncio.TimeoutError:
+            pass
+        STORE.flush_needed.clear()
+        try:
+            if STORE.pending():
+                await asyncio.to_thread(STORE.flush)
+                logging.info("Журнал смен свёрнут в хранилище (%s)", STORE.name)
+            evict_months()
+        except Exception as e:
+            logging.exception("Обслуживание хранилища не удалось: %s", e)
 
 # загрузка при старте
+startup_t0 = time.perf_counter()
+STORE.open()
 EMPLOYEES = load_employees()
+DIRECTORY = EmployeeDirectory(EMPLOYEES)
+FEED.open(EMPLOYEES)
 load_shifts()
+logging.info(
+    "Данные загружены за %.0f мс (backend=%s, партиции: %s)",
+    (time.perf_counter() - startup_t0) * 1000, STORE.name, STORE.describe_loads(),
+)
+
+# ================== ПОРЯДОК ОБРАБОТКИ АПДЕЙТОВ ==================
+# Polling и webhook запускают каждый апдейт отдельной задачей, поэтому разные
+# сотрудники обрабатываются параллельно. Апдейты одного пользователя идут строго
+# по очереди (смена, ожидаемая причина и FSM-состояние — его личные), а хендлеры
+# с флагом exclusive (правки справочника, импорт) выполняются, когда никто другой
+# не работает, и на это время никого не пускают.
+class SharedLock:
+    """Читатели — параллельно, писатель — один; ждущий писатель не пропускает новых читателей."""
+
+    def __init__(self):
+        self.cond = asyncio.Condition()
+        self.readers = 0
+        self.writer = False
+        self.writers_waiting = 0
+
+    @contextlib.asynccontextmanager
+    async def shared(self):
+        async with self.cond:
+            await self.cond.wait_for(lambda: not self.writer and not self.writers_waiting)
+            self.readers += 1
+        try:
+            yield
+        finally:
+            async with self.cond:
+                self.readers -= 1
+                self.cond.notify_all()
+
+    @contextlib.asynccontextmanager
+    async def exclusive(self):
+        async with self.cond:
+            self.writers_waiting += 1
+            try:
+                await self.cond.wait_for(lambda: not self.writer and not self.readers)
+            finally:
+                self.writers_waiting -= 1
+                self.cond.notify_all()  # если ожидание отменили — читатели не должны зависнуть
+            self.writer = True
+        try:
+            yield
+        finally:
+            async with self.cond:
+                self.writer = False
+                self.cond.notify_all()
+
+class UserOrderMiddleware(BaseMiddleware):
+    """Outer-middleware апдейтов: по замку на пользователя, пока у него есть апдейты в работе."""
+
+    def __init__(self):
+        self.locks: Dict[int, list] = {}  # uid -> [asyncio.Lock, апдейтов в работе и в очереди]
+
+    async def __call__(self, handler, event, data):
+        user = data.get("event_from_user")
+        if user is None:
+            return await handler(event, data)
+        entry = self.locks.setdefault(user.id, [asyncio.Lock(), 0])
+        entry[1] += 1
+        try:
+            async with entry[0]:  # asyncio.Lock будит ожидающих в порядке прихода
+                return await handler(event, data)
+        finally:
+            entry[1] -= 1
+            if not entry[1]:
+                del self.locks[user.id]
+
+class HandlerTimingMiddleware(BaseMiddleware):
+    """Inner-middleware: время хендлера (вместе с ожиданием exclusive-замка) — по имени хендлера."""
+
+    async def __call__(self, handler, event, data):
+        handler_obj = data.get("handler")
+        name = handler_obj.callback.__name__ if handler_obj is not None else "unknown"
+        with HANDLER_SECONDS.time(name):
+            return await handler(event, data)
+
+class ExclusiveMiddleware(BaseMiddleware):
+    """Inner-middleware сообщений и кнопок: exclusive-хендлеры — под замком на запись, остальные — на чтение."""
+
+    async def __call__(self, handler, event, data):
+        if get_flag(data, "exclusive"):
+            async with UPDATE_LOCK.exclusive():
+                return await handler(event, data)
+        async with UPDATE_LOCK.shared():
+            return await handler(event, data)
+
+UPDATE_LOCK = SharedLock()
+USER_ORDER = UserOrderMiddleware()
+# встаём перед FSM-middleware: состояние пользователя должно читаться уже под его замком,
+# иначе следующий апдейт увидит состояние до того, как предыдущий его сменит
+dp.update.outer_middleware.unregister(dp.fsm)
+dp.update.outer_middleware(USER_ORDER)
+dp.update.outer_middleware(dp.fsm)
+router.message.middleware(HandlerTimingMiddleware())
+router.callback_query.middleware(HandlerTimingMiddleware())
+router.message.middleware(ExclusiveMiddleware())
+router.callback_query.middleware(ExclusiveMiddleware())
+
+# ================== ИСХОДЯЩИЕ СООБЩЕНИЯ ==================
+# Все вызовы API с chat_id (ответы, документы, правки сообщений) проходят через
+# планировщик сессии бота: общий token bucket на бота и по bucket'у на чат.
+# Ждущие отправки стоят в полосах: interactive (ответы на кнопки, по умолчанию)
+# всегда обгоняет bulk — её включает bulk_sends() вокруг массового вывода.
+# На 429 чат ставится на паузу retry_after, запрос повторяется.
+SEND_LANES = ("interactive", "bulk")
+SEND_LANE: contextvars.ContextVar[str] = contextvars.ContextVar("SEND_LANE", default="interactive")
+
+@contextlib.contextmanager
+def bulk_sends():
+    """Отправки внутри блока — в полосе bulk: не задерживают ответы на кнопки."""
+    token = SEND_LANE.set("bulk")
+    try:
+        yield
+    finally:
+        SEND_LANE.reset(token)
+
+class TokenBucket:
+    """rate токенов в секунду, запас не больше burst; paused_until — пауза после 429."""
+
+    __slots__ = ("rate", "burst", "tokens", "stamp", "paused_until")
+
+    def __init__(self, rate: float, burst: float, now: float):
+        self.rate, self.burst = rate, burst
+        self.tokens, self.stamp = burst, now
+        self.paused_until = 0.0
+
+    def wait(self, now: float) -> float:
+        """Через сколько секунд будет токен (0 — есть сейчас)."""
+        self.tokens = min(self.burst, self.tokens + (now - self.stamp) * self.rate)
+        self.stamp = now
+        short = (1 - self.tokens) / self.rate if self.tokens < 1 else 0.0
+        return max(short, self.paused_until - now, 0.0)
+
+    def idle(self, now: float) -> bool:
+        return self.wait(now) == 0 and self.tokens >= self.burst
+
+class OutboundScheduler(BaseRequestMiddleware):
+    """Middleware сессии: выдаёт отправкам токены по приоритету полос."""
+
+    def __init__(self, rate: float, chat_rate: float, chat_burst: int, retries: int):
+        self.chat_rate, self.chat_burst, self.retries = chat_rate, chat_burst, retries
+        self.bucket = TokenBucket(rate, max(1.0, rate), time.monotonic())  # запас — секунда отправок
+        self.chats: Dict[int | str, TokenBucket] = {}
+        self.lanes: Dict[str, deque] = {lane: deque() for lane in SEND_LANES}  # (chat_id, future)
+        self.wakeup: asyncio.Event | None = None
+        self.task: asyncio.Task | None = None
+        self.sent = 0
+        self.queued = {lane: 0 for lane in SEND_LANES}     # сколько отправок ждали токен
+        self.wait_sec = {lane: 0.0 for lane in SEND_LANES}
+        self.max_depth = {lane: 0 for lane in SEND_LANES}
+        self.retry_after = 0
+
+    def chat(self, chat_id: int | str, now: float) -> TokenBucket:
+        bucket = self.chats.get(chat_id)
+        if bucket is None:
+            bucket = self.chats[chat_id] = TokenBucket(self.chat_rate, self.chat_burst, now)
+        return bucket
+
+    def take(self, chat: TokenBucket) -> None:
+        self.bucket.tokens -= 1
+        chat.tokens -= 1
+        self.sent += 1
+
+    async def __call__(self, make_request, bot, method):
+        chat_id = getattr(method, "chat_id", None)
+        if chat_id is None:  # getUpdates, setWebhook, answerCallbackQuery — без лимита
+            return await make_request(bot, method)
+        lane = SEND_LANE.get()
+        for attempt in range(self.retries + 1):
+            await self.acquire(chat_id, lane)
+            try:
+                return await make_request(bot, method)
+            except TelegramRetryAfter as ex:
+                self.retry_after += 1
+                if attempt == self.retries:
+                    raise
+                logging.warning("429 для чата %s: пауза %s с (%s)", chat_id, ex.retry_after, type(method).__name__)
+                now = time.monotonic()
+                self.chat(chat_id, now).paused_until = now + ex.retry_after
+
+    async def acquire(self, chat_id: int | str, lane: str) -> None:
+        now = time.monotonic()
+        chat = self.chat(chat_id, now)
+        # очереди пусты и токены есть — отправляем сразу, без переключения задач
+        if not any(self.lanes.values()) and self.bucket.wait(now) == 0 and chat.wait(now) == 0:
+            self.take(chat)
+            return
+        if self.task is None or self.task.done():
+            self.wakeup = asyncio.Event()
+            self.task = asyncio.create_task(self.run())
+        fut = asyncio.get_running_loop().create_future()
+        queue = self.lanes[lane]
+        queue.append((chat_id, fut))
+        self.queued[lane] += 1
+        self.max_depth[lane] = max(self.max_depth[lane], len(queue))
+        self.wakeup.set()
+        try:
+            await fut  # отмена задачи отменит и fut — раздатчик его пропустит
+        finally:
+            self.wait_sec[lane] += time.monotonic() - now
+
+    def grant(self, now: float) -> float | None:
+        """Раздаёт токены ждущим, полосы — по приоритету; порядок внутри чата сохраняется.
+        Возвращает, через сколько секунд пробовать снова (None — ждущих нет)."""
+        nearest = None
+        for queue in self.lanes.values():
+            for _ in range(len(queue)):
+                chat_id, fut = queue.popleft()
+                if fut.done():
+                    continue
+                chat = self.chat(chat_id, now)
+                wait = max(self.bucket.wait(now), chat.wait(now))
+                if wait == 0:
+                    self.take(chat)
+                    fut.set_result(None)
+                    continue
+                queue.append((chat_id, fut))
+                nearest = wait if nearest is None else min(nearest, wait)
+        return nearest
+
+    async def run(self) -> None:
+        while True:
+            self.wakeup.clear()
+            now = time.monotonic()
+            wait = self.grant(now)
+            if wait is None:
+                # бездействие: забываем чаты с полным запасом, чтобы словарь не рос
+                for chat_id in [c for c, b in self.chats.items() if b.idle(now)]:
+                    del self.chats[chat_id]
+                await self.wakeup.wait()
+            else:
+                with contextlib.suppress(asyncio.TimeoutError):
+                    await asyncio.wait_for(self.wakeup.wait(), wait)
+
+    def depth(self) -> Dict[str, int]:
+        return {lane: sum(not fut.done() for _, fut in queue) for lane, queue in self.lanes.items()}
+
+    def describe(self) -> str:
+        depth = self.depth()
+        lanes = ", ".join(
+            f"{lane}: в очереди {depth[lane]} (макс {self.max_depth[lane]}), ждали {self.queued[lane]} раз / {self.wait_sec[lane]:.1f} с"
+            for lane in SEND_LANES
+        )
+        return f"отправлено {self.sent}, 429: {self.retry_after}, чатов {len(self.chats)}; {lanes}"
+
+OUTBOUND = OutboundScheduler(SEND_RATE, SEND_CHAT_RATE, SEND_CHAT_BURST, SEND_RETRIES)
+bot.session.middleware(OUTBOUND)
 
 # ================== КЛАВИАТУРЫ ==================
 user_buttons = [
@@ -255,7 +1850,7 @@ async def cmd_whoami(message: Message):
     if not ensure_allowed(message): return
     uid = message.from_user.id
     role = "OWNER" if uid == OWNER_ID else ("ADMIN" if is_admin(uid) else "USER")
-    meta = EMPLOYEES.get(uid, {})
+    meta = DIRECTORY.get(uid) or {}
     active_str = "активен" if meta.get("active", True) else "неактивен"
     await message.answer(
         f"Ты: <b>{role}</b> ({active_str})\n"
@@ -276,6 +1871,9 @@ class ImportStates(StatesGroup):
     wait_emp = State()
     wait_shift = State()
 
+class ExportStates(StatesGroup):
+    waiting_period = State()
+
 @router.message(F.text == "Сотрудники ⚙️")
 async def owner_menu(message: Message):
     if message.from_user.id != OWNER_ID: return
@@ -286,8 +1884,8 @@ async def owner_menu(message: Message):
         "• «🟢 Активировать» — пришлите: <code>123456789</code>\n"
         "• «🗑 Удалить сотрудника» — пришлите: <code>123456789</code>\n"
         "• «📋 Список сотрудников» — показать текущий справочник.\n"
-        "• «📤 Экспорт данных» — выгрузить employees.json и shifts.json.\n"
-        "• «📥 Импорт данных» — загрузить один из файлов обратно.",
+        "• «📤 Экспорт данных» — архив zip со сменами за период, справочником и манифестом.\n"
+        "• «📥 Импорт данных» — загрузить архив или один из файлов обратно.",
         reply_markup=owner_menu_kb
     )
 
@@ -300,21 +1898,20 @@ async def owner_back(message: Message, state: FSMContext):
 @router.message(F.text == "📋 Список сотрудников")
 async def owner_list(message: Message):
     if message.from_user.id != OWNER_ID: return
-    if not EMPLOYEES:
+    if not len(DIRECTORY):
         await message.answer("Справочник пуст.", reply_markup=owner_menu_kb); return
 
-    # сортировка по ФИО (name), затем по id для стабильности
-    items = sorted(EMPLOYEES.items(), key=lambda kv: (kv[1].get("name","").lower(), kv[0]))
-
+    # по ФИО (name), затем по id — порядок справочника; кусками в полосе bulk
     chunk = []
-    for uid, meta in items:
-        status = "🟢 активен" if meta.get("active", True) else "🔴 неактивен"
-        chunk.append(f"{uid}: {meta.get('name','')} — {status}")
-        if len(chunk) == 50:
+    with bulk_sends():
+        for uid, meta in DIRECTORY.ordered():
+            status = "🟢 активен" if meta.get("active", True) else "🔴 неактивен"
+            chunk.append(f"{uid}: {meta.get('name','')} — {status}")
+            if len(chunk) == 50:
+                await message.answer("\n".join(chunk), reply_markup=owner_menu_kb)
+                chunk = []
+        if chunk:
             await message.answer("\n".join(chunk), reply_markup=owner_menu_kb)
-            chunk = []
-    if chunk:
-        await message.answer("\n".join(chunk), reply_markup=owner_menu_kb)
 
 @router.message(F.text == "❇️ Добавить сотрудника")
 async def owner_add_start(message: Message, state: FSMContext):
@@ -322,7 +1919,7 @@ async def owner_add_start(message: Message, state: FSMContext):
     await state.set_state(EmpStates.wait_add)
     await message.answer("Пришлите строку: <code>123456789 Иванов И.И.</code>", reply_markup=owner_menu_kb)
 
-@router.message(EmpStates.wait_add, F.text)
+@router.message(EmpStates.wait_add, F.text, flags={"exclusive": True})
 async def owner_add_do(message: Message, state: FSMContext):
     if message.from_user.id != OWNER_ID: return
     text = (message.text or "").strip()
@@ -336,7 +1933,7 @@ async def owner_add_do(message: Message, state: FSMContext):
     name = parts[1].strip().strip('"').strip("'")
     if not name:
         return await message.answer("Пустое имя.", reply_markup=owner_menu_kb)
-    EMPLOYEES[new_id] = {"name": name, "active": True}
+    DIRECTORY.add(new_id, name)
     save_employees()
     await state.clear()
     await message.answer(f"Добавлен: {new_id} — {name} (🟢 активен)", reply_markup=owner_menu_kb)
@@ -347,7 +1944,7 @@ async def owner_del_start(message: Message, state: FSMContext):
     await state.set_state(EmpStates.wait_del)
     await message.answer("Пришлите ID сотрудника. Пример: <code>123456789</code>", reply_markup=owner_menu_kb)
 
-@router.message(EmpStates.wait_del, F.text)
+@router.message(EmpStates.wait_del, F.text, flags={"exclusive": True})
 async def owner_del_do(message: Message, state: FSMContext):
     if message.from_user.id != OWNER_ID: return
     text = (message.text or "").strip()
@@ -357,7 +1954,7 @@ async def owner_del_do(message: Message, state: FSMContext):
         return await message.answer("ID должен быть числом.", reply_markup=owner_menu_kb)
     if uid_del == OWNER_ID:
         return await message.answer("Нельзя удалить OWNER.", reply_markup=owner_menu_kb)
-    if EMPLOYEES.pop(uid_del, None) is None:
+    if not DIRECTORY.remove(uid_del):
         await state.clear()
         return await message.answer("Такого ID нет в справочнике.", reply_markup=owner_menu_kb)
     save_employees()
@@ -370,7 +1967,7 @@ async def owner_deactivate_start(message: Message, state: FSMContext):
     await state.set_state(EmpStates.wait_deactivate)
     await message.answer("Пришлите ID сотрудника для деактивации. Пример: <code>123456789</code>", reply_markup=owner_menu_kb)
 
-@router.message(EmpStates.wait_deactivate, F.text)
+@router.message(EmpStates.wait_deactivate, F.text, flags={"exclusive": True})
 async def owner_deactivate_do(message: Message, state: FSMContext):
     if message.from_user.id != OWNER_ID: return
     text = (message.text or "").strip()
@@ -380,11 +1977,10 @@ async def owner_deactivate_do(message: Message, state: FSMContext):
         return await message.answer("ID должен быть числом.", reply_markup=owner_menu_kb)
     if uid_deact == OWNER_ID:
         return await message.answer("Нельзя деактивировать OWNER.", reply_markup=owner_menu_kb)
-    meta = EMPLOYEES.get(uid_deact)
+    meta = DIRECTORY.set_active(uid_deact, False)
     if not meta:
         await state.clear()
         return await message.answer("Такого ID нет в справочнике.", reply_markup=owner_menu_kb)
-    meta["active"] = False
     save_employees()
     await state.clear()
     await message.answer(f"Деактивирован: {uid_deact} — {meta.get('name','')} (🔴 неактивен)", reply_markup=owner_menu_kb)
@@ -395,7 +1991,7 @@ async def owner_activate_start(message: Message, state: FSMContext):
     await state.set_state(EmpStates.wait_activate)
     await message.answer("Пришлите ID сотрудника для активации. Пример: <code>123456789</code>", reply_markup=owner_menu_kb)
 
-@router.message(EmpStates.wait_activate, F.text)
+@router.message(EmpStates.wait_activate, F.text, flags={"exclusive": True})
 async def owner_activate_do(message: Message, state: FSMContext):
     if message.from_user.id != OWNER_ID: return
     text = (message.text or "").strip()
@@ -403,26 +1999,188 @@ async def owner_activate_do(message: Message, state: FSMContext):
         uid_act = int(text)
     except ValueError:
         return await message.answer("ID должен быть числом.", reply_markup=owner_menu_kb)
-    meta = EMPLOYEES.get(uid_act)
+    meta = DIRECTORY.set_active(uid_act, True)
     if not meta:
         await state.clear()
         return await message.answer("Такого ID нет в справочнике.", reply_markup=owner_menu_kb)
-    meta["active"] = True
     save_employees()
     await state.clear()
     await message.answer(f"Активирован: {uid_act} — {meta.get('name','')} (🟢 активен)", reply_markup=owner_menu_kb)
 
 # ====== ЭКСПОРТ / ИМПОРТ ======
-@router.message(F.text == "📤 Экспорт данных")
-async def export_data(message: Message):
-    if message.from_user.id != OWNER_ID: return
+# ---- Архив экспорта
+# dusberg_<от>_<до>.zip: employees.json, shifts.json (только дни периода, формат
+# как у импорта) и manifest.json со счётчиками и sha256 каждого файла. Смены
+# читаются из хранилища помесячно и пишутся в архив по дню, поэтому память не
+# растёт с длиной истории.
+EXPORT_FORMAT = "dusberg-export"
+EXPORT_VERSION = 1
+EXPORT_ALL_WORDS = {"всё", "все", "all"}
+
+def write_export_zip(
+    path: Path,
+    date_from: datetime.date,
+    date_to: datetime.date,
+    employees: Dict[int, Dict[str, Any]],
+    resident: dict[str, dict[int, ShiftRecord]],
+    full: bool,
+    seq: int = 0,
+) -> Dict[str, Any]:
+    """Архив экспорта за период; возвращает манифест."""
+    files: Dict[str, Dict[str, Any]] = {}
+    with zipfile.ZipFile(path, "w", compression=zipfile.ZIP_DEFLATED, compresslevel=6) as zf:
+        emp_bytes = json.dumps(employees_to_json(employees), ensure_ascii=False, indent=2).encode("utf-8")
+        zf.writestr("employees.json", emp_bytes)
+        files["employees.json"] = {"records": len(employees), "bytes": len(emp_bytes), "sha256": hashlib.sha256(emp_bytes).hexdigest()}
+
+        digest, size, days, records = hashlib.sha256(), 0, 0, 0
+        with zf.open("shifts.json", "w", force_zip64=True) as raw:  # размер заранее неизвестен
+            def put(data: bytes) -> None:
+                nonlocal size
+                raw.write(data)
+                digest.update(data)
+                size += len(data)
+
+            put(b"{")
+            for lo, hi in month_spans(date_from, date_to):
+                chunk = STORE.read_range(lo, hi)
+                lo_s, hi_s = lo.isoformat(), hi.isoformat()
+                chunk.update({day: users for day, users in resident.items() if lo_s <= day <= hi_s})
+                for day in sorted(chunk):
+                    users = chunk[day]
+                    if not users:
+                        continue
+                    body = json.dumps({str(uid): shift_to_json(rec) for uid, rec in sorted(users.items())}, ensure_ascii=False)
+                    put(f'{"," if days else ""}\n{json.dumps(day)}: {body}'.encode("utf-8"))
+                    days += 1
+                    records += len(users)
+            put(b"\n}\n")
+        files["shifts.json"] = {"records": records, "days": days, "bytes": size, "sha256": digest.hexdigest()}
+
+        manifest = {
+            "format": EXPORT_FORMAT,
+            "version": EXPORT_VERSION,
+            "created": msk_now().isoformat(timespec="seconds"),
+            "from": date_from.isoformat(),
+            "to": date_to.isoformat(),
+            "full": full,  # вся история — такой архив можно импортировать заменой
+            "seq": seq,    # номер ленты изменений: всё до него уже в архиве, дальше — /changes seq
+            "generation": FEED.generation,  # другое поколение в /changes — архив устарел
+            "files": files,
+        }
+        zf.writestr("manifest.json", json.dumps(manifest, ensure_ascii=False, indent=2))
+    return manifest
+
+def verify_export_archive(path: Path) -> Dict[str, Any]:
+    """Манифест архива, если все файлы на месте и sha256 сошлись; иначе ImportFormatError."""
+    try:
+        with zipfile.ZipFile(path) as zf:
+            try:
+                manifest = json.loads(zf.read("manifest.json"))
+            except KeyError:
+                raise ImportFormatError("в архиве нет manifest.json") from None
+            if not isinstance(manifest, dict) or manifest.get("format") != EXPORT_FORMAT:
+                raise ImportFormatError("manifest.json — не от экспорта бота")
+            if manifest.get("version", 0) > EXPORT_VERSION:
+                raise ImportFormatError(f"архив версии {manifest.get('version')}, бот понимает до {EXPORT_VERSION}")
+            for name in ("employees.json", "shifts.json"):
+                meta = manifest.get("files", {}).get(name)
+                if meta is None:
+                    raise ImportFormatError(f"{name} нет в манифесте")
+                digest, size = hashlib.sha256(), 0
+                try:
+                    with zf.open(name) as f:
+                        while block := f.read(IMPORT_CHUNK):
+                            digest.update(block)
+                            size += len(block)
+                except KeyError:
+                    raise ImportFormatError(f"в архиве нет {name}") from None
+                if size != meta.get("bytes") or digest.hexdigest() != meta.get("sha256"):
+                    raise ImportFormatError(f"{name}: контрольная сумма не совпала с манифестом")
+    except zipfile.BadZipFile as ex:  # в т.ч. несовпадение CRC
+        raise ImportFormatError(f"битый архив: {ex}") from None
+    except json.JSONDecodeError as ex:
+        raise ImportFormatError(f"битый manifest.json: {ex.msg}") from None
+    return manifest
+
+export_task: asyncio.Task | None = None
+
+async def run_export(message: Message, d1: datetime.date | None, d2: datetime.date | None) -> None:
+    """Архив за период; без дат — вся история."""
+    full = d1 is None
     try:
-        emp_bytes = EMP_FILE.read_bytes() if EMP_FILE.exists() else json.dumps(DEFAULT_EMPLOYEES, ensure_ascii=False, indent=2).encode("utf-8")
-        shifts_bytes = SHIFT_FILE.read_bytes() if SHIFT_FILE.exists() else b"{}"
-        await message.answer_document(BufferedInputFile(emp_bytes, filename="employees.json"))
-        await message.answer_document(BufferedInputFile(shifts_bytes, filename="shifts.json"))
+        await flush_now()  # в хранилище — всё, что уже отмечено
+        if full:
+            bounds = await asyncio.to_thread(STORE.history_bounds)
+            d1, d2 = bounds or (msk_now().date(), msk_now().date())
+        employees = DIRECTORY.snapshot()
+        resident = resident_days(d1, d2)
+        seq = FEED.seq  # после flush_now: изменения до seq уже в хранилище
+        fd, tmp = tempfile.mkstemp(prefix="dusberg-export-", suffix=".zip")
+        os.close(fd)
+        try:
+            with REPORT_SECONDS.time("zip"):
+                manifest = await asyncio.get_running_loop().run_in_executor(
+                    REPORT_POOL, write_export_zip, Path(tmp), d1, d2, employees, resident, full, seq)
+            size = os.path.getsize(tmp)
+            REPORT_BYTES.observe(size, "zip")
+            if size > TELEGRAM_FILE_LIMIT:
+                await message.answer(
+                    f"Архив за {d1.isoformat()} — {d2.isoformat()} больше 50 МБ, Telegram его не примет. "
+                    "Выгрузите историю по частям (например, по году).",
+                    reply_markup=owner_menu_kb
+                )
+                return
+            shifts = manifest["files"]["shifts.json"]
+            await message.answer_document(
+                FSInputFile(tmp, filename=f"dusberg_{d1.isoformat()}_{d2.isoformat()}.zip"),
+                caption=(
+                    f"{'Вся история' if full else 'Данные'} за {d1.isoformat()} — {d2.isoformat()}: "
+                    f"смен {shifts['records']} за {shifts['days']} дн., сотрудников {manifest['files']['employees.json']['records']}. "
+                    f"Восстановить — «📥 Импорт данных», изменения после — <code>/changes {seq}</code>."
+                ),
+                reply_markup=owner_menu_kb
+            )
+        finally:
+            os.unlink(tmp)
     except Exception as ex:
-        await message.answer(f"Не удалось экспортировать: {ex!r}")
+        logging.exception("Экспорт не удался: %s", ex)
+        await message.answer(f"Не удалось экспортировать: {ex!r}", reply_markup=owner_menu_kb)
+
+@router.message(F.text == "📤 Экспорт данных")
+async def export_data(message: Message, state: FSMContext):
+    if message.from_user.id != OWNER_ID: return
+    await state.set_state(ExportStates.waiting_period)
+    await message.answer(
+        "За какой период выгрузить смены?\n"
+        "• Даты как для отчёта: <code>01.08.2025 31.08.2025</code> или <code>20.08.2025</code>\n"
+        "• <code>всё</code> — вся история\n"
+        "Справочник сотрудников кладётся в архив целиком. Для отмены: /cancel",
+        reply_markup=owner_menu_kb
+    )
+
+@router.message(ExportStates.waiting_period, F.text, ~F.text.startswith("/"))  # /cancel и прочие команды — мимо
+async def export_handle_period(message: Message, state: FSMContext):
+    global export_task
+    if message.from_user.id != OWNER_ID: return
+    text = (message.text or "").strip().lower()
+    if text in EXPORT_ALL_WORDS:
+        period = (None, None)
+    else:
+        period = parse_period(text.split())
+        if period is None and not any(ch.isdigit() for ch in text):
+            # кнопка меню или обычный текст, а не дата: выходим из ввода периода, апдейт — следующим хендлерам
+            await state.clear()
+            raise SkipHandler
+        if period is None:
+            await message.answer("Неверный формат. Пример: <code>01.08.2025 31.08.2025</code> или <code>всё</code>.")
+            return
+    if export_task is not None and not export_task.done():
+        await message.answer("Предыдущая выгрузка ещё идёт — дождись архива.", reply_markup=owner_menu_kb)
+        return
+    await state.clear()
+    export_task = asyncio.create_task(run_export(message, *period))
+    await message.answer("Собираю архив ⏳", reply_markup=owner_menu_kb)
 
 @router.message(F.text == "📥 Импорт данных")
 async def import_choose(message: Message, state: FSMContext):
@@ -430,54 +2188,376 @@ async def import_choose(message: Message, state: FSMContext):
     await state.set_state(ImportStates.choose)
     await message.answer(
         "Что импортируем?\n"
+        "• Отправь архив <b>.zip</b> из «📤 Экспорт данных» — проверю манифест и обновлю справочник и смены\n"
         "• Отправь <b>employees.json</b> — обновлю справочник сотрудников\n"
         "• Отправь <b>shifts.json</b> — обновлю смены\n"
+        "По умолчанию — слияние: обновятся только дни и сотрудники из файла. "
+        "Чтобы заменить всё целиком, подпиши файл словом <code>замена</code>.\n"
         "Или нажми «⬅️ Назад» для выхода.",
         reply_markup=owner_menu_kb
     )
 
-@router.message(ImportStates.choose, F.document)
-async def import_handle_doc(message: Message, state: FSMContext):
-    if message.from_user.id != OWNER_ID: return
-    doc: Document = message.document
-    filename = (doc.file_name or "").lower()
+# ---- Потоковый импорт
+# Файл скачивается во временный файл и разбирается в потоке по одному дню
+# (shifts.json — объект «день → смены», читается кусками). Каждая запись
+# проверяется; слияние пишет по месяцу за раз: резидентные месяцы — через
+# память и фоновую запись, остальные — прямо в хранилище. Замена тоже идёт
+# по месяцу — в новую историю рядом с текущей, которая подменяется, только
+# если файл разобран до конца. Итог — счётчики добавлено/изменено/пропущено по каждому дню.
+IMPORT_REPLACE_WORDS = {"замена", "заменить", "replace"}
+IMPORT_CHUNK = 1 << 20  # символов за одно чтение файла
+IMPORT_ERRORS_SHOWN = 10
+
+class ImportFormatError(ValueError):
+    pass
+
+def iter_json_object(f, chunk_size: int = IMPORT_CHUNK) -> Iterable[tuple[str, Any]]:
+    """Пары ключ/значение JSON-объекта верхнего уровня по одной; файл читается кусками."""
+    decoder = json.JSONDecoder()
+    buf, pos, eof = "", 0, False
+
+    def fill() -> None:
+        nonlocal buf, pos, eof
+        chunk = f.read(chunk_size)
+        eof = not chunk
+        buf, pos = buf[pos:] + chunk, 0
+
+    def peek() -> str:
+        nonlocal pos
+        while True:
+            while pos < len(buf) and buf[pos] in " \t\r\n":
+                pos += 1
+            if pos < len(buf) or eof:
+                return buf[pos] if pos < len(buf) else ""
+            fill()
+
+    def expect(ch: str) -> None:
+        nonlocal pos
+        if peek() != ch:
+            raise ImportFormatError(f"ожидался «{ch}», позиция {pos}")
+        pos += 1
+
+    def value() -> Any:
+        nonlocal pos
+        peek()
+        while True:
+            try:
+                obj, end = decoder.raw_decode(buf, pos)
+            except json.JSONDecodeError as ex:
+                if eof:
+                    raise ImportFormatError(f"битый JSON: {ex.msg}") from None
+                fill()
+                continue
+            if end == len(buf) and not eof:  # число или литерал могли оборваться на границе куска
+                fill()
+                continue
+            pos = end
+            return obj
+
+    def expect_end() -> None:
+        # после объекта — только пробелы: обрезанный или склеенный файл не принимаем
+        expect("}")
+        if peek():
+            raise ImportFormatError(f"лишние данные после объекта, позиция {pos}")
+
+    expect("{")
+    if peek() == "}":
+        expect_end()
+        return
+    while True:
+        key = value()
+        if not isinstance(key, str):
+            raise ImportFormatError("ключ верхнего уровня — не строка")
+        expect(":")
+        yield key, value()
+        if peek() == ",":
+            pos += 1
+            continue
+        expect_end()
+        return
+
+def validate_shift_json(uid_key: str, d: Any) -> str | None:
+    """Текст ошибки или None, если запись можно импортировать."""
     try:
-        file = await bot.get_file(doc.file_id)
-        buf = io.BytesIO()
-        await bot.download(file, destination=buf)
-        buf.seek(0)
-        content = buf.read().decode("utf-8")
-
-        if filename == "employees.json":
-            data = json.loads(content)
-            # в память → валидация → запись
-            new_map: dict[int, Dict[str, Any]] = {}
-            for k, v in data.items():
-                uid = int(k)
-                if isinstance(v, str):
-                    new_map[uid] = {"name": v, "active": True}
-                else:
-                    new_map[uid] = {"name": str(v.get("name","")), "active": bool(v.get("active", True))}
-            atomic_write_text(EMP_FILE, json.dumps({str(k): v for k, v in new_map.items()}, ensure_ascii=False, indent=2))
-            # перезагрузить в память
-            global EMPLOYEES
-            EMPLOYEES = load_employees()
-            await message.answer("Импорт сотрудников завершён ✅", reply_markup=owner_menu_kb)
-        elif filename == "shifts.json":
-            data = json.loads(content)
-            # простая проверка структуры
-            if not isinstance(data, dict):
-                return await message.answer("Файл shifts.json имеет неверный формат.")
-            atomic_write_text(SHIFT_FILE, json.dumps(data, ensure_ascii=False, indent=2))
-            load_shifts()
-            await message.answer("Импорт смен завершён ✅", reply_markup=owner_menu_kb)
+        int(uid_key)
+    except ValueError:
+        return f"uid «{uid_key}» — не число"
+    if not isinstance(d, dict):
+        return f"uid {uid_key}: запись — не объект"
+    times = []
+    for key in ("start", "end"):
+        value = d.get(key)
+        if value is None:
+            times.append(None)
+            continue
+        try:
+            times.append(datetime.datetime.fromisoformat(value) if isinstance(value, str) else None)
+        except ValueError:
+            times.append(None)
+        if times[-1] is None:
+            return f"uid {uid_key}: {key} — не дата ISO"
+        if times[-1].tzinfo is None:
+            return f"uid {uid_key}: {key} без часового пояса"
+    start, end = times
+    if start is None and end is not None:
+        return f"uid {uid_key}: конец смены без начала"
+    if start is not None and end is not None and end < start:
+        return f"uid {uid_key}: конец раньше начала"
+    for key in ("start_reason", "end_reason", "comment"):
+        if d.get(key) is not None and not isinstance(d[key], str):
+            return f"uid {uid_key}: {key} — не строка"
+    if d.get("comment_done") is not None and not isinstance(d["comment_done"], bool):
+        return f"uid {uid_key}: comment_done — не true/false"
+    return None
+
+@dataclass
+class ImportStats:
+    days: dict[str, list[int]] = field(default_factory=dict)  # день -> [добавлено, изменено, пропущено]
+    errors: list[str] = field(default_factory=list)
+    invalid: int = 0
+
+    def count(self, day: str, added: int = 0, changed: int = 0, skipped: int = 0) -> None:
+        row = self.days.setdefault(day, [0, 0, 0])
+        row[0] += added
+        row[1] += changed
+        row[2] += skipped
+
+    def error(self, where: str, text: str) -> None:
+        self.invalid += 1
+        if len(self.errors) < IMPORT_ERRORS_SHOWN:
+            self.errors.append(f"{where}: {text}")
+
+    def totals(self) -> list[int]:
+        return [sum(row[i] for row in self.days.values()) for i in range(3)]
+
+    def report_csv(self) -> bytes:
+        out = io.StringIO()
+        writer = csv.writer(out, delimiter=";")
+        writer.writerow(["День", "Добавлено", "Изменено", "Пропущено"])
+        writer.writerows([day, *row] for day, row in sorted(self.days.items()))
+        return out.getvalue().encode("utf-8-sig")
+
+@contextlib.contextmanager
+def open_import_text(path: Path, member: str | None = None):
+    """Текст импортируемого файла: сам файл или файл внутри архива экспорта (без распаковки на диск)."""
+    if member is None:
+        with open(path, encoding="utf-8-sig") as f:
+            yield f
+    else:
+        with zipfile.ZipFile(path) as zf, zf.open(member) as raw:
+            yield io.TextIOWrapper(raw, encoding="utf-8-sig")
+
+def iter_import_months(f, stats: ImportStats) -> Iterable[tuple[str, dict[str, dict[int, ShiftRecord]]]]:
+    """Проверенные смены файла, сгруппированные по месяцам подряд идущих дней."""
+    ym, days = None, {}
+    for day, users in iter_json_object(f):
+        try:
+            datetime.date.fromisoformat(day)
+        except ValueError:
+            stats.error(day, "ключ — не дата YYYY-MM-DD")
+            continue
+        if not isinstance(users, dict):
+            stats.error(day, "значение — не объект «uid → смена»")
+            continue
+        if month_of(day) != ym and days:
+            yield ym, days
+            days = {}
+        ym = month_of(day)
+        records = days.setdefault(day, {})
+        for uid_key, d in users.items():
+            problem = validate_shift_json(uid_key, d)
+            if problem:
+                stats.error(day, problem)
+                stats.count(day, skipped=1)
+                continue
+            records[int(uid_key)] = shift_from_json(d, recompute=True)
+    if days:
+        yield ym, days
+
+def classify_upserts(
+    days: dict[str, dict[int, ShiftRecord]],
+    existing: dict[str, dict[int, ShiftRecord]],
+    stats: ImportStats,
+) -> list[tuple[str, int, ShiftRecord]]:
+    """Что из файла действительно меняет данные; одинаковые записи — пропуск."""
+    batch = []
+    for day, records in days.items():
+        old_day = existing.get(day, {})
+        for uid, rec in records.items():
+            old = old_day.get(uid)
+            if old == rec:
+                stats.count(day, skipped=1)
+                continue
+            stats.count(day, added=old is None, changed=old is not None)
+            batch.append((day, uid, rec))
+    return batch
+
+async def upsert_month(ym: str, days: dict[str, dict[int, ShiftRecord]], stats: ImportStats) -> None:
+    """Записать отличающиеся от текущих смены одного месяца — тем же путём, что и правки из хендлеров (с лентой)."""
+    if ym in loaded_months:
+        # месяц в памяти — он главнее хранилища; запишет фоновая запись
+        batch = classify_upserts(days, {day: shifts_by_date.get(day, {}) for day in days}, stats)
+        for day, uid, rec in batch:
+            shifts_by_date[day][uid] = rec
+            mark_shift_dirty(day, uid)
+        return
+
+    def merge_stored() -> list[tuple[str, int, ShiftRecord]]:
+        batch = classify_upserts(days, STORE.read_month(ym), stats)
+        if batch:
+            STORE.write_shifts(batch)
+            FEED.record_shifts(batch)
+        return batch
+
+    batch = await asyncio.to_thread(merge_stored)
+    for day, _, _ in batch:
+        bump_day_version(day)
+    if ym in loaded_months:  # месяц подгрузили, пока писали, — подтянуть и память
+        for day, uid, rec in batch:
+            shifts_by_date[day][uid] = replace(rec)
+
+async def import_shifts_merge(path: Path, stats: ImportStats, member: str | None = None) -> None:
+    await flush_now()  # в хранилище — всё, что уже отмечено, сравниваем с ним
+    loop = asyncio.get_running_loop()
+    with open_import_text(path, member) as f:
+        months = iter_import_months(f, stats)
+        while True:
+            chunk = await loop.run_in_executor(None, next, months, None)
+            if chunk is None:
+                break
+            await upsert_month(*chunk, stats)
+    await flush_now()
+    await asyncio.to_thread(STORE.flush)
+
+async def import_shifts_replace(path: Path, stats: ImportStats, member: str | None = None) -> None:
+    def months() -> Iterable[tuple[str, dict[str, dict[int, ShiftRecord]]]]:
+        # разбор идёт прямо в потоке записи: в памяти — один месяц файла
+        with open_import_text(path, member) as f:
+            for ym, days in iter_import_months(f, stats):
+                for day, records in days.items():
+                    stats.count(day, added=len(records))
+                yield ym, days
+
+    # под замком на всё время разбора: правка, записанная посреди замены, легла бы поверх импорта
+    async with UPDATE_LOCK.exclusive():  # история в памяти перезагружается целиком
+        await replace_all_shifts(months())
+
+def parse_employees_file(path: Path, stats: ImportStats, member: str | None = None) -> dict[int, Dict[str, Any]]:
+    with open_import_text(path, member) as f:
+        raw = json.load(f)
+    if not isinstance(raw, dict):
+        raise ImportFormatError("employees.json — не объект «uid → сотрудник»")
+    result: dict[int, Dict[str, Any]] = {}
+    for key, value in raw.items():
+        try:
+            uid = int(key)
+        except ValueError:
+            stats.error(key, "uid — не число")
+            continue
+        if isinstance(value, str):  # обратная совместимость
+            value = {"name": value}
+        name = value.get("name") if isinstance(value, dict) else None
+        if not isinstance(name, str) or not name.strip():
+            stats.error(key, "нет имени")
+            continue
+        result[uid] = {"name": name.strip(), "active": bool(value.get("active", True))}
+    return result
+
+async def import_employees(path: Path, mode: str, stats: ImportStats, member: str | None = None) -> None:
+    new_map = await asyncio.to_thread(parse_employees_file, path, stats, member)
+    async with UPDATE_LOCK.exclusive():
+        if mode == "replace":
+            DIRECTORY.replace(new_map)  # тот же dict, индекс — заново
+            stats.count("employees", added=len(new_map), skipped=stats.invalid)
         else:
-            await message.answer("Ожидаю файл <b>employees.json</b> или <b>shifts.json</b>.", reply_markup=owner_menu_kb)
+            for uid, meta in new_map.items():
+                old = DIRECTORY.get(uid)
+                if old is not None and old.get("name") == meta["name"] and old.get("active", True) == meta["active"]:
+                    stats.count("employees", skipped=1)
+                    continue
+                stats.count("employees", added=old is None, changed=old is not None)
+                DIRECTORY.add(uid, meta["name"], meta["active"])
+            stats.count("employees", skipped=stats.invalid)
+        save_employees()
+    await flush_now()
+
+import_task: asyncio.Task | None = None
+
+async def run_import(message: Message, doc: Document, kind: str, mode: str) -> None:
+    fd, tmp = tempfile.mkstemp(prefix="dusberg-import-", suffix=".zip" if kind == "archive" else ".json")
+    os.close(fd)
+    stats = ImportStats()
+    emp_stats = ImportStats()  # для архива: справочник считается отдельно от дней
+    manifest = None
+    t0 = time.perf_counter()
+    try:
+        await bot.download(doc, destination=Path(tmp), timeout=300)  # на диск, не в память
+        shifts_member = None
+        if kind == "archive":
+            manifest = await asyncio.to_thread(verify_export_archive, Path(tmp))
+            if mode == "replace" and not manifest.get("full"):
+                raise ImportFormatError("архив за период можно только слить; для замены выгрузите «всё»")
+            await import_employees(Path(tmp), mode, emp_stats, "employees.json")
+            shifts_member = "shifts.json"
+        if kind == "employees.json":
+            await import_employees(Path(tmp), mode, stats)
+        elif mode == "replace":
+            await import_shifts_replace(Path(tmp), stats, shifts_member)
+        else:
+            await import_shifts_merge(Path(tmp), stats, shifts_member)
+            if any(row[0] or row[1] for row in stats.days.values()):
+                bump_data_generation()  # напоминания и готовые отчёты пересоберутся от новых данных
     except Exception as ex:
         logging.exception("Импорт не удался: %s", ex)
         await message.answer(f"Импорт не удался: {ex!r}", reply_markup=owner_menu_kb)
+        return
     finally:
-        await state.clear()
+        os.unlink(tmp)
+
+    added, changed, skipped = stats.totals()
+    lines = [
+        f"Импорт {doc.file_name or kind} ({'замена' if mode == 'replace' else 'слияние'}) завершён ✅ за {time.perf_counter() - t0:.1f} с",
+        f"добавлено {added}, изменено {changed}, пропущено {skipped} (из них с ошибками {stats.invalid})",
+    ]
+    if manifest is not None:
+        files = manifest["files"]
+        e_added, e_changed, e_skipped = emp_stats.totals()
+        lines[1] = "смены: " + lines[1]
+        lines += [
+            f"сотрудники: добавлено {e_added}, изменено {e_changed}, пропущено {e_skipped}",
+            f"архив {manifest['from']} — {manifest['to']}: контрольные суммы сошлись",
+        ]
+        for name, got in (("shifts.json", added + changed + skipped), ("employees.json", sum(emp_stats.totals()))):
+            if got != files[name]["records"]:
+                lines.append(f"⚠️ {name}: записей {got}, а в манифесте {files[name]['records']}")
+    errors = emp_stats.errors + stats.errors
+    if errors:
+        lines += ["Ошибки (первые):", *(f"• {e}" for e in errors[:IMPORT_ERRORS_SHOWN])]
+    await message.answer("\n".join(lines), reply_markup=owner_menu_kb)
+    if kind != "employees.json" and stats.days:
+        await message.answer_document(BufferedInputFile(stats.report_csv(), filename=f"import_{mode}_by_day.csv"))
+
+@router.message(ImportStates.choose, F.document)
+async def import_handle_doc(message: Message, state: FSMContext):
+    global import_task
+    if message.from_user.id != OWNER_ID: return
+    doc: Document = message.document
+    filename = (doc.file_name or "").lower()
+    kind = "archive" if filename.endswith(".zip") else filename
+    if kind not in ("archive", "employees.json", "shifts.json"):
+        await message.answer("Ожидаю архив <b>.zip</b> из экспорта, <b>employees.json</b> или <b>shifts.json</b>.", reply_markup=owner_menu_kb)
+        return
+    if import_task is not None and not import_task.done():
+        await message.answer("Предыдущий импорт ещё идёт — дождись итога.", reply_markup=owner_menu_kb)
+        return
+    await state.clear()
+    mode = "replace" if set((message.caption or "").lower().split()) & IMPORT_REPLACE_WORDS else "merge"
+    # отдельной задачей: хендлер не держит замок апдейтов, бот отвечает остальным
+    import_task = asyncio.create_task(run_import(message, doc, kind, mode))
+    await message.answer(
+        f"Импортирую {doc.file_name} ({'замена целиком' if mode == 'replace' else 'слияние'})… Пришлю итог.",
+        reply_markup=owner_menu_kb
+    )
 
 # ================== БИЗНЕС-ЛОГИКА СМЕН ==================
 @router.message(F.text == "Смену начал 🏭")
@@ -485,19 +2565,23 @@ async def handle_start(message: Message):
     if not ensure_allowed(message): return
     uid = message.from_user.id
     now = msk_now()
-    shift = today_shift(uid)
+    day = now.date().isoformat()
+    shift = today_shift(uid, day)
 
-    if shift.get("start") and shift.get("end") is None:
+    if shift.start is not None and shift.end is None:
         await message.answer("Смена уже начата. Сначала заверши текущую.", reply_markup=kb(uid))
         return
 
-    shift["start"] = now
-    shift["end"] = None
-    shift["start_reason"] = None
-    shift["end_reason"] = None
-    shift["comment"] = None
+    shift.start = epoch_seconds(now)
+    shift.end = None
+    shift.start_reason = None
+    shift.end_reason = None
+    shift.comment = None
+    materialize_metrics(shift)
     pending_reason.pop(uid, None)
-    save_shifts()
+    save_shift(uid, day)
+    ROSTER.started(uid, day)
+    BOARD.touch(uid, day)
 
     t = now.time()
     if is_weekend(now.date()):
@@ -517,18 +2601,22 @@ async def handle_end(message: Message):
     if not ensure_allowed(message): return
     uid = message.from_user.id
     now = msk_now()
-    shift = today_shift(uid)
+    day = now.date().isoformat()
+    shift = day_shifts(day).get(uid)
 
-    if not shift.get("start"):
+    if shift is None or shift.start is None:
         await message.answer("Смена ещё не начата.", reply_markup=kb(uid))
         return
-    if shift.get("end"):
+    if shift.end is not None:
         await message.answer("Смена уже завершена.", reply_markup=kb(uid))
         return
 
-    shift["end"] = now
+    shift.end = epoch_seconds(now)
+    materialize_metrics(shift)
     pending_reason.pop(uid, None)
-    save_shifts()
+    save_shift(uid, day)
+    ROSTER.ended(uid, day)
+    BOARD.touch(uid, day)
 
     t = now.time()
     if t < END_NORM:
@@ -545,21 +2633,21 @@ async def handle_end(message: Message):
 async def handle_status(message: Message):
     if not ensure_allowed(message): return
     uid = message.from_user.id
-    data = shifts_by_date.get(today_key(), {}).get(uid)
+    data = day_shifts(today_key()).get(uid)
     if not data:
         await message.answer("Смена не начата.", reply_markup=kb(uid))
         return
 
     lines = [
-        f"Смена начата в: {fmt_hm(data.get('start'))}",
-        f"Смена завершена в: {fmt_hm(data.get('end'))}",
+        f"Смена начата в: {data.start_hm}",
+        f"Смена завершена в: {data.end_hm}",
     ]
-    if data.get("start_reason"):
-        lines.append(f"Причина отклонения (начало): {data['start_reason']}")
-    if data.get("end_reason"):
-        lines.append(f"Причина отклонения (завершение): {data['end_reason']}")
-    if data.get("comment"):
-        lines.append(f"Комментарий: {data['comment']}")
+    if data.start_reason:
+        lines.append(f"Причина отклонения (начало): {data.start_reason}")
+    if data.end_reason:
+        lines.append(f"Причина отклонения (завершение): {data.end_reason}")
+    if data.comment:
+        lines.append(f"Комментарий: {data.comment}")
     await message.answer("\n".join(lines), reply_markup=kb(uid))
 
 @router.message(F.text.in_({"Инструкция", "Инструкция 📖"}))
@@ -573,43 +2661,173 @@ async def handle_help(message: Message):
         reply_markup=kb(message.from_user.id)
     )
 
+def shift_board(day: str) -> list[tuple[int, ShiftRecord]]:
+    """Отметившиеся за день в порядке справочника; удалённые из него — в конце."""
+    day_data = day_shifts(day)
+    uids = [uid for uid in DIRECTORY.uids() if uid in day_data]
+    uids += sorted(uid for uid in day_data if DIRECTORY.name(uid) is None)
+    return [(uid, day_data[uid]) for uid in uids]
+
+# ---- Доска «Статус смены»
+# Строка каждого отметившегося собирается один раз и пересобирается точечно
+# (BOARD.touch из handle_start/handle_end/причины); страницы фильтра режутся
+# заново, только если с прошлого показа что-то поменялось. Листание и фильтры —
+# inline-кнопки, сообщение редактируется на месте.
+BOARD_PAGE_CHARS = 3500  # предел Telegram — 4096 символов, остальное — заголовок
+BOARD_FIELD_CHARS = 400  # ФИО и каждая причина на доске — не длиннее (после экранирования), иначе «…»
+BOARD_FILTERS = {"all": "Все", "open": "Открыты", "late": "Опоздали", "missing": "Не отметились"}
+
+def clip_html(text: str, limit: int = BOARD_FIELD_CHARS) -> str:
+    """html.escape(text), обрезанный до limit символов с «…» — не посреди сущности."""
+    escaped = html.escape(text)
+    if len(escaped) <= limit:
+        return escaped
+    out, size = [], 0
+    for ch in text:
+        part = html.escape(ch)
+        if size + len(part) > limit - 1:
+            break
+        out.append(part)
+        size += len(part)
+    return "".join(out) + "…"
+
+class TodayBoard:
+    def __init__(self):
+        self.key: tuple | None = None  # (день, версия справочника, поколение данных)
+        self.day = ""
+        self.order: list[int] = []     # отметившиеся в порядке справочника
+        self.keys: list[tuple] = []     # их ключи сортировки — для bisect
+        self.lines: dict[int, str] = {}
+        self.version = 0
+        self.pages: dict[str, tuple[int, list[int], list[str]]] = {}  # фильтр -> (версия, uid'ы, страницы)
+
+    def for_day(self, day: str) -> "TodayBoard":
+        key = (day, employees_version, data_generation)
+        if key != self.key:
+            self.day = day
+            shifts = day_shifts(day)
+            self.keys = sorted(self.sort_key(uid) for uid in shifts)
+            self.order = [key[-1] for key in self.keys]
+            self.lines = {uid: self.render(uid, rec) for uid, rec in shifts.items()}
+            self.key = key
+            self.version += 1
+        return self
+
+    def touch(self, uid: int, day: str) -> None:
+        if self.key is None or self.key[0] != day:
+            return
+        rec = day_shifts(day).get(uid)
+        if rec is None:
+            return
+        if uid not in self.lines:  # новый отметившийся — на своё место, без пересортировки
+            i = bisect.bisect_left(self.keys, self.sort_key(uid))
+            self.keys.insert(i, self.sort_key(uid))
+            self.order.insert(i, uid)
+        self.lines[uid] = self.render(uid, rec)
+        self.version += 1
+
+    @staticmethod
+    def sort_key(uid: int) -> tuple:
+        # как shift_board(): порядок справочника, удалённые из него — в конце по uid
+        meta = DIRECTORY.get(uid)
+        return (0, *EmployeeDirectory.key(uid, meta)) if meta is not None else (1, "", uid)
+
+    @staticmethod
+    def render(uid: int, rec: ShiftRecord) -> str:
+        # поля обрезаны, чтобы один сотрудник всегда помещался на страницу BOARD_PAGE_CHARS
+        row = [f"{clip_html(fio(uid))}: начата в {rec.start_hm}, завершена в {rec.end_hm}"]
+        reasons = []
+        if rec.start_reason:
+            reasons.append(f"начало — {clip_html(rec.start_reason)}")
+        if rec.end_reason:
+            reasons.append(f"завершение — {clip_html(rec.end_reason)}")
+        if reasons:
+            row.append("⚠️ Причина отклонения: " + "; ".join(reasons))
+        return "\n".join(row)
+
+    def members(self, flt: str) -> list[int]:
+        shifts = day_shifts(self.day)
+        if flt == "open":
+            return [uid for uid in self.order if shifts[uid].start is not None and shifts[uid].end is None]
+        if flt == "late":
+            return [uid for uid in self.order if shifts[uid].late_start]
+        if flt == "missing":
+            pending = ROSTER.for_day(self.day).not_started
+            return [uid for uid in DIRECTORY.uids(active=True) if uid in pending]
+        return self.order
+
+    def paginate(self, flt: str) -> tuple[list[int], list[str]]:
+        cached = self.pages.get(flt)
+        if cached is not None and cached[0] == self.version:
+            return cached[1], cached[2]
+        uids = self.members(flt)
+        if flt == "missing":
+            blocks, sep = [clip_html(fio(uid)) for uid in uids], "\n"
+        else:
+            blocks, sep = [self.lines[uid] for uid in uids], "\n\n"
+        pages, cur, size = [], [], 0
+        for block in blocks:
+            if cur and size + len(sep) + len(block) > BOARD_PAGE_CHARS:
+                pages.append(sep.join(cur))
+                cur, size = [], 0
+            size += len(block) + (len(sep) if cur else 0)
+            cur.append(block)
+        if cur:
+            pages.append(sep.join(cur))
+        self.pages[flt] = (self.version, uids, pages)
+        return uids, pages
+
+    def view(self, flt: str, page: int) -> tuple[str, InlineKeyboardMarkup]:
+        uids, pages = self.paginate(flt)
+        total = max(len(pages), 1)
+        page = min(max(page, 0), total - 1)
+        body = pages[page] if pages else ("Сегодня смен нет." if flt == "all" else "Никого.")
+        text = f"<b>Смены {self.day}</b> · {BOARD_FILTERS[flt]}: {len(uids)} · стр. {page + 1}/{total}\n\n{body}"
+        nav = [
+            InlineKeyboardButton(text="◀️", callback_data=f"board:{flt}:{page - 1}") if page > 0 else None,
+            InlineKeyboardButton(text=f"🔄 {page + 1}/{total}", callback_data=f"board:{flt}:{page}"),
+            InlineKeyboardButton(text="▶️", callback_data=f"board:{flt}:{page + 1}") if page + 1 < total else None,
+        ]
+        filters = [
+            InlineKeyboardButton(text=("• " if key == flt else "") + f"{title} ({len(self.paginate(key)[0])})",
+                                 callback_data=f"board:{key}:0")
+            for key, title in BOARD_FILTERS.items()
+        ]
+        return text, InlineKeyboardMarkup(inline_keyboard=[[b for b in nav if b], filters[:2], filters[2:]])
+
+    def describe(self) -> str:
+        return f"{self.day or '—'}: отметившихся {len(self.order)}, версия {self.version}, страниц в кэше {len(self.pages)}"
+
+BOARD = TodayBoard()
+
 @router.message(F.text.in_({"Статус смены", "Статус смены 🛠"}))
 async def handle_shift_status(message: Message):
     if not ensure_allowed(message): return
     if not is_admin(message.from_user.id):
         await message.answer("Нет доступа.", reply_markup=kb(message.from_user.id))
         return
+    text, markup = BOARD.for_day(today_key()).view("all", 0)
+    await message.answer(text, reply_markup=markup)
 
-    day = today_key()
-    day_data = shifts_by_date.get(day, {})
-    if not day_data:
-        await message.answer("Сегодня смен нет.", reply_markup=kb(message.from_user.id))
+@router.callback_query(F.data.startswith("board:"))
+async def board_navigate(callback: CallbackQuery):
+    if not is_admin(callback.from_user.id):
+        await callback.answer("Нет доступа.", show_alert=True)
         return
-
-    # список uid сегодняшних отметившихся, отсортированный по ФИО
-    sorted_uids = sorted(day_data.keys(), key=lambda u: fio(u).lower())
-
-    lines = []
-    for uid in sorted_uids:
-        data = day_data[uid]
-        s = fmt_hm(data.get("start"))
-        e = fmt_hm(data.get("end"))
-        who = fio(uid)
-
-        row = [f"{who}: начата в {s}, завершена в {e}"]
-
-        reasons = []
-        if data.get("start_reason"):
-            reasons.append(f"начало — {data['start_reason']}")
-        if data.get("end_reason"):
-            reasons.append(f"завершение — {data['end_reason']}")
-
-        if reasons:
-            row.append("⚠️ Причина отклонения: " + "; ".join(reasons))
-
-        lines.append("\n".join(row))
-
-    await message.answer("\n\n".join(lines), reply_markup=kb(message.from_user.id))
+    _, flt, page = callback.data.split(":")
+    if flt not in BOARD_FILTERS or not page.lstrip("-").isdigit():
+        await callback.answer()
+        return
+    if not isinstance(callback.message, Message):  # сообщение слишком старое — Telegram его уже не отдаёт
+        await callback.answer("Сообщение устарело — откройте «Статус смены» заново.", show_alert=True)
+        return
+    text, markup = BOARD.for_day(today_key()).view(flt, int(page))
+    try:
+        await callback.message.edit_text(text, reply_markup=markup)
+    except TelegramBadRequest as ex:
+        if "message is not modified" not in str(ex):  # «обновить» без изменений — не ошибка
+            raise
+    await callback.answer()
 
 # ================== ОТЧЁТ ПО ДИАПАЗОНУ (XLSX) ==================
 class ReportStates(StatesGroup):
@@ -642,121 +2860,154 @@ def parse_date(s: str) -> datetime.date | None:
     except Exception:
         return None
 
-def calc_minutes(a: datetime.time, b: datetime.time) -> int:
-    dt_a = datetime.datetime.combine(datetime.date.today(), a)
-    dt_b = datetime.datetime.combine(datetime.date.today(), b)
-    return int((dt_b - dt_a).total_seconds() // 60)
-
-def deviation_columns(start_dt: datetime.datetime | None, end_dt: datetime.datetime | None) -> tuple[int,int,int,int]:
-    """(раньше_начало, позже_начало, раньше_конец, позже_конец) в минутах (>=0) — для ОТЧЁТА"""
-    early_start = late_start = early_end = late_end = 0
-    if start_dt:
-        st_local = start_dt.astimezone(MSK).time()
-        if st_local < START_NORM:
-            early_start = calc_minutes(st_local, START_NORM)
-        if st_local > START_OK_TILL:
-            late_start = calc_minutes(START_OK_TILL, st_local)
-    if end_dt:
-        en_local = end_dt.astimezone(MSK).time()
-        if en_local < END_NORM:
-            early_end = calc_minutes(en_local, END_NORM)
-        if en_local > END_OK_TILL:
-            late_end = calc_minutes(END_OK_TILL, en_local)
-    return early_start, late_start, early_end, late_end
-
-def minutes_between(start_dt: datetime.datetime | None, end_dt: datetime.datetime | None) -> int:
-    if not start_dt or not end_dt: return 0
-    a = start_dt.astimezone(MSK); b = end_dt.astimezone(MSK)
-    if b < a: return 0
-    return int((b - a).total_seconds() // 60)
-
-def build_xlsx_bytes(date_from: datetime.date, date_to: datetime.date) -> bytes:
-    wb = Workbook()
-    ws_shifts = wb.active; ws_shifts.title = "Смены"
-    ws_daily = wb.create_sheet("Свод по дням")
-    ws_emps  = wb.create_sheet("Сотрудники")
-    ws_params= wb.create_sheet("Параметры")
-
-    # Заголовки
-    ws_shifts.append([
-        "Дата","Сотрудник","ID","Начало","Конец",
-        "Раннее начало, мин","Позднее начало, мин","Раннее завершение, мин","Позднее завершение, мин",
-        "Длительность, мин","Длительность, ч","Выходной",
-        "Причина отклонения начала смены","Причина отклонения завершения смены","Комментарий"
-    ])
-    ws_daily.append([
-        "Дата","Сотрудник","ID","Начало","Конец",
-        "Раннее начало, мин","Позднее начало, мин","Раннее завершение, мин","Позднее завершение, мин",
-        "Длительность, мин","Длительность, ч","Выходной"
-    ])
+def parse_period(parts: list[str]) -> tuple[datetime.date, datetime.date] | None:
+    """Одна или две даты (в любом порядке) → (от, до)."""
+    if len(parts) not in (1, 2):
+        return None
+    dates = [parse_date(p) for p in parts]
+    if None in dates:
+        return None
+    return min(dates), max(dates)
 
-    # Сотрудники — по алфавиту
-    ws_emps.append(["ID","Сотрудник","Статус"])
-    for uid, meta in sorted(EMPLOYEES.items(), key=lambda kv: (kv[1].get("name","").lower(), kv[0])):
-        ws_emps.append([uid, meta.get("name",""), "активен" if meta.get("active", True) else "неактивен"])
-
-    ws_params.append(["Параметр","Значение"])
-    ws_params.append(["Часовой пояс","Europe/Moscow"])
-    ws_params.append(["Норма начала","08:00"])
-    ws_params.append(["Допустимо до (начало)","08:10"])
-    ws_params.append(["Норма конца","17:30"])
-    ws_params.append(["Допустимо до (конец)","17:40"])
-    ws_params.append(["Период отчёта", f"{date_from.isoformat()} — {date_to.isoformat()}"])
-    ws_params.append(["В отчёт включены все сотрудники, в том числе неактивные.", "Да"])
-
-    # Данные: по каждому дню включаем ВСЕХ сотрудников (сортировка по имени)
+SHIFTS_HEADER = [
+    "Дата","Сотрудник","ID","Начало","Конец",
+    "Раннее начало, мин","Позднее начало, мин","Раннее завершение, мин","Позднее завершение, мин",
+    "Длительность, мин","Длительность, ч","Выходной",
+    "Причина отклонения начала смены","Причина отклонения завершения смены","Комментарий"
+]
+DAILY_COLUMNS = 12  # «Свод по дням» — первые 12 колонок «Смен»
+
+def report_rows(
+    date_from: datetime.date,
+    date_to: datetime.date,
+    employees: Dict[int, Dict[str, Any]],
+    range_data: dict[str, dict[int, ShiftRecord]],
+) -> Iterable[list]:
+    """Строки листа «Смены»: по каждому дню ВСЕ сотрудники (по имени), по одной строке за раз."""
+    ordered = list(employees.items())  # уже по ФИО: DIRECTORY.snapshot()
     for day in daterange_inclusive(date_from, date_to):
-        key = day.isoformat()
-        day_data = shifts_by_date.get(key, {})
+        day_data = range_data.get(day.isoformat(), {})
         weekend = "Да" if is_weekend(day) else "Нет"
 
-        for uid, meta in sorted(EMPLOYEES.items(), key=lambda kv: (kv[1].get("name","").lower(), kv[0])):
+        for uid, meta in ordered:
             name = meta.get("name","")
             data = day_data.get(uid, None)
 
-            if data:
-                start_dt = data.get("start"); end_dt = data.get("end")
-                start_str = fmt_hm(start_dt); end_str = fmt_hm(end_dt)
-                early_start, late_start, early_end, late_end = deviation_columns(start_dt, end_dt)
-                work_min = minutes_between(start_dt, end_dt)
+            if data is not None:
+                # метрики уже посчитаны при записи смены
+                start_str = data.start_hm; end_str = data.end_hm
+                early_start = data.early_start; late_start = data.late_start
+                early_end = data.early_end; late_end = data.late_end
+                work_min = data.work_min
                 work_hours = round(work_min/60, 2)
-                start_reason = data.get("start_reason") or ""
-                end_reason   = data.get("end_reason") or ""
-                comment      = data.get("comment") or ""
+                start_reason = data.start_reason or ""
+                end_reason   = data.end_reason or ""
+                comment      = data.comment or ""
             else:
                 start_str = end_str = "—"
                 early_start = late_start = early_end = late_end = 0
                 work_min = 0; work_hours = 0
                 start_reason = end_reason = comment = ""
 
-            ws_shifts.append([
+            yield [
                 day, name, uid, start_str, end_str,
                 early_start, late_start, early_end, late_end,
                 work_min, work_hours, weekend,
                 start_reason, end_reason, comment
-            ])
+            ]
+
+class ColumnWidths:
+    """Ширина колонки = самое длинное значение + 2, в пределах [10, 40] (как прежний fit_columns)."""
+
+    def __init__(self, header: list):
+        self.lengths = [len(str(h)) for h in header]
+
+    def feed(self, col: int, value) -> None:
+        n = len("" if value is None else str(value))
+        if n > self.lengths[col]:
+            self.lengths[col] = n
+
+    def feed_row(self, row: list) -> None:
+        for i, value in enumerate(row):
+            self.feed(i, value)
+
+    def apply(self, ws) -> None:
+        for i, n in enumerate(self.lengths, 1):
+            ws.column_dimensions[get_column_letter(i)].width = min(max(10, n + 2), 40)
+
+def styled_header(ws, header: list) -> list:
+    cells = []
+    for value in header:
+        cell = WriteOnlyCell(ws, value=value)
+        cell.font = Font(bold=True)
+        cell.alignment = Alignment(horizontal="center")
+        cells.append(cell)
+    return cells
+
+def build_xlsx_bytes(
+    date_from: datetime.date,
+    date_to: datetime.date,
+    employees: Dict[int, Dict[str, Any]] | None = None,
+    resident: dict[str, dict[int, ShiftRecord]] | None = None,
+) -> bytes:
+    # employees/resident — снимки, сделанные в event loop, когда строим в пуле потоков
+    if employees is None:
+        employees = DIRECTORY.snapshot()
+    range_data = load_range(date_from, date_to, resident)  # один запрос к хранилищу на весь период
+
+    # Потоковый write-only режим: ячейки не копятся в памяти. openpyxl пишет <cols>
+    # до первой строки, поэтому ширины считаем заранее за один проход по исходным
+    # данным: время/минуты/флаги всегда короче заголовков, длину задают только
+    # дата, имя, ID и тексты причин/комментариев.
+    widths = ColumnWidths(SHIFTS_HEADER)
+    widths.feed(0, date_from)
+    for uid, meta in employees.items():
+        widths.feed(1, meta.get("name","")); widths.feed(2, uid)
+    for users in range_data.values():
+        for data in users.values():
+            widths.feed(12, data.start_reason); widths.feed(13, data.end_reason); widths.feed(14, data.comment)
+
+    wb = Workbook(write_only=True)
+    ws_shifts = wb.create_sheet("Смены")
+    ws_daily  = wb.create_sheet("Свод по дням")
+    ws_emps   = wb.create_sheet("Сотрудники")
+    ws_params = wb.create_sheet("Параметры")
+
+    widths.apply(ws_shifts)
+    daily_widths = ColumnWidths(SHIFTS_HEADER[:DAILY_COLUMNS])
+    daily_widths.lengths = widths.lengths[:DAILY_COLUMNS]
+    daily_widths.apply(ws_daily)
 
-            ws_daily.append([
-                day, name, uid, start_str, end_str,
-                early_start, late_start, early_end, late_end,
-                work_min, work_hours, weekend
-            ])
-
-    # Оформление
-    def fit_columns(ws):
-        widths = {}
-        for row in ws.iter_rows(values_only=True):
-            for i, cell in enumerate(row, 1):
-                s = "" if cell is None else str(cell)
-                widths[i] = max(widths.get(i, 0), len(s))
-        for i, w in widths.items():
-            ws.column_dimensions[get_column_letter(i)].width = min(max(10, w + 2), 40)
-
-    for ws in (ws_shifts, ws_daily, ws_emps, ws_params):
-        fit_columns(ws)
-        for cell in next(ws.iter_rows(min_row=1, max_row=1)):
-            cell.font = Font(bold=True)
-            cell.alignment = Alignment(horizontal="center")
+    # Сотрудники — по алфавиту
+    emp_header = ["ID","Сотрудник","Статус"]
+    emp_rows = [
+        [uid, meta.get("name",""), "активен" if meta.get("active", True) else "неактивен"]
+        for uid, meta in employees.items()  # порядок снимка справочника — по ФИО
+    ]
+    params_header = ["Параметр","Значение"]
+    params_rows = [
+        ["Часовой пояс","Europe/Moscow"],
+        ["Норма начала","08:00"],
+        ["Допустимо до (начало)","08:10"],
+        ["Норма конца","17:30"],
+        ["Допустимо до (конец)","17:40"],
+        ["Период отчёта", f"{date_from.isoformat()} — {date_to.isoformat()}"],
+        ["В отчёт включены все сотрудники, в том числе неактивные.", "Да"],
+    ]
+    for ws, header, rows in ((ws_emps, emp_header, emp_rows), (ws_params, params_header, params_rows)):
+        w = ColumnWidths(header)
+        for row in rows:
+            w.feed_row(row)
+        w.apply(ws)
+        ws.append(styled_header(ws, header))
+        for row in rows:
+            ws.append(row)
+
+    ws_shifts.append(styled_header(ws_shifts, SHIFTS_HEADER))
+    ws_daily.append(styled_header(ws_daily, SHIFTS_HEADER[:DAILY_COLUMNS]))
+    for row in report_rows(date_from, date_to, employees, range_data):
+        ws_shifts.append(row)
+        ws_daily.append(row[:DAILY_COLUMNS])
 
     bio = io.BytesIO()
     wb.save(bio)
@@ -777,6 +3028,9 @@ async def ask_report_period(message: Message, state: FSMContext):
         "Введите период дат (включительно):\n"
         "• Один день: <code>20.08.2025</code> или <code>20.08.25</code>\n"
         "• Диапазон: <code>01.08.2025 20.08.2025</code> (или ISO: <code>2025-08-01 2025-08-20</code>)\n"
+        f"XLSX — до {XLSX_MAX_DAYS} дней. Для длинных периодов допишите <code>csv</code> (или <code>tsv</code>), "
+        "а чтобы разбить по месяцам — ещё и <code>помесячно</code>:\n"
+        "<code>01.01.2025 31.12.2025 csv помесячно</code>\n"
         "Для отмены: /cancel"
     )
 
@@ -792,14 +3046,14 @@ async def handle_report_period(message: Message, state: FSMContext):
         await state.clear(); return
 
     parts = (message.text or "").strip().split()
-    if len(parts) == 1:
-        d1 = parse_date(parts[0]); d2 = d1
-    elif len(parts) == 2:
-        d1 = parse_date(parts[0]); d2 = parse_date(parts[1])
-    else:
-        d1 = d2 = None
-
-    if not d1 or not d2:
+    # флаги выгрузки в конце строки: csv|tsv [помесячно]
+    flags = set()
+    while parts and parts[-1].lower() in EXPORT_FLAGS:
+        flags.add(EXPORT_FLAGS[parts.pop().lower()])
+    if "monthly" in flags and not flags & {"csv", "tsv"}:
+        flags.add("csv")
+    period = parse_period(parts)
+    if period is None:
         await message.answer(
             "Неверный формат. Примеры:\n"
             "• <code>20.08.2025</code> или <code>20.08.25</code>\n"
@@ -807,50 +3061,509 @@ async def handle_report_period(message: Message, state: FSMContext):
         )
         return
 
-    if d2 < d1:
-        d1, d2 = d2, d1
-
-    if (d2 - d1).days > 92:
-        await message.answer("Слишком длинный период (>92 дней). Сократите интервал.")
+    d1, d2 = period
+    days = (d2 - d1).days
+    if not flags and days > XLSX_MAX_DAYS:
+        await message.answer(
+            f"Слишком длинный период для XLSX (>{XLSX_MAX_DAYS} дней). Сократите интервал "
+            "или выгрузите CSV: допишите <code>csv</code> после дат."
+        )
         await state.clear(); return
+    if days > CSV_MAX_DAYS:
+        await message.answer(f"Слишком длинный период (>{CSV_MAX_DAYS} дней). Сократите интервал.")
+        await state.clear(); return
+
+    await state.clear()
+    uid = message.from_user.id
+    prebuilt = PREBUILT.lookup(d1, d2) if not flags else None
+    if prebuilt is not None:
+        # собран ночью и с тех пор в периоде ничего не менялось — без очереди
+        await PREBUILT.send(message, d1, d2, prebuilt)
+        return
+    if len(report_tasks) >= REPORT_QUEUE_MAX:
+        await message.answer("Сейчас формируется много отчётов. Попробуйте через минуту.", reply_markup=kb(uid))
+        return
+    if report_inflight[uid] >= REPORT_PER_ADMIN:
+        await message.answer("Предыдущий отчёт ещё готовится — пришлю его, как только будет готов.", reply_markup=kb(uid))
+        return
 
+    report_inflight[uid] += 1
+    if flags:
+        delimiter = "\t" if "tsv" in flags else ";"
+        job = run_csv_job(message, d1, d2, delimiter, "monthly" in flags)
+    else:
+        job = run_report_job(message, d1, d2)
+    task = asyncio.create_task(job)
+    report_tasks.add(task)
+    task.add_done_callback(report_tasks.discard)
+    await message.answer("Отчёт готовится ⏳ Пришлю файл, как только он будет готов.", reply_markup=kb(uid))
+
+# ---- Версии данных и кэш готовых отчётов
+# Версия периода = (поколение данных, версия справочника, сумма счётчиков изменений
+# по дням периода). Счётчики только растут, поэтому любая правка внутри периода
+# меняет версию, а правки вне его — нет.
+day_versions: Dict[str, int] = defaultdict(int)
+employees_version = 0
+data_generation = 0
+
+def bump_day_version(day: str) -> None:
+    day_versions[day] += 1
+    REPORT_CACHE.invalidate_day(day)
+
+def bump_employees_version() -> None:
+    global employees_version
+    employees_version += 1
+    REPORT_CACHE.clear()  # список сотрудников есть в каждом отчёте
+
+def bump_data_generation() -> None:
+    global data_generation
+    data_generation += 1
+    REPORT_CACHE.clear()
+
+def range_version(d1: datetime.date, d2: datetime.date) -> tuple[int, int, int]:
+    changes = sum(day_versions.get(day.isoformat(), 0) for day in daterange_inclusive(d1, d2))
+    return data_generation, employees_version, changes
+
+class ReportCache:
+    """LRU готовых XLSX, ограниченный суммарным размером в байтах."""
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.items: OrderedDict[tuple[datetime.date, datetime.date], tuple[tuple, bytes]] = OrderedDict()
+        self.size = 0
+        self.hits = self.misses = 0
+
+    def get(self, key: tuple[datetime.date, datetime.date], version: tuple) -> bytes | None:
+        item = self.items.get(key)
+        if item is None or item[0] != version:
+            self.misses += 1
+            return None
+        self.items.move_to_end(key)
+        self.hits += 1
+        return item[1]
+
+    def put(self, key: tuple[datetime.date, datetime.date], version: tuple, data: bytes) -> None:
+        if len(data) > self.max_bytes:
+            return
+        self.pop(key)
+        self.items[key] = (version, data)
+        self.size += len(data)
+        while self.size > self.max_bytes:
+            self.pop(next(iter(self.items)))
+
+    def pop(self, key) -> None:
+        item = self.items.pop(key, None)
+        if item is not None:
+            self.size -= len(item[1])
+
+    def invalidate_day(self, day: str) -> None:
+        d = datetime.date.fromisoformat(day)
+        for key in [k for k in self.items if k[0] <= d <= k[1]]:
+            self.pop(key)
+
+    def clear(self) -> None:
+        self.items.clear()
+        self.size = 0
+
+    def describe(self) -> str:
+        return f"отчётов={len(self.items)} size={self.size} hits={self.hits} misses={self.misses}"
+
+REPORT_CACHE = ReportCache(int(REPORT_CACHE_MB * 1024 * 1024))
+
+# ---- Очередь отчётов
+REPORT_POOL = ThreadPoolExecutor(max_workers=REPORT_WORKERS, thread_name_prefix="report")
+report_tasks: set[asyncio.Task] = set()
+report_inflight: Dict[int, int] = defaultdict(int)
+report_builds: Dict[tuple, asyncio.Future] = {}   # (период, версия) -> идущая сборка
+
+async def build_report(d1: datetime.date, d2: datetime.date, version: tuple) -> bytes:
+    # снимки берём здесь, в event loop: пул потоков не должен читать изменяемые dict'ы
+    employees = DIRECTORY.snapshot()
+    resident = resident_days(d1, d2)
+    loop = asyncio.get_running_loop()
+    with REPORT_SECONDS.time("xlsx"):
+        xlsx = await loop.run_in_executor(REPORT_POOL, build_xlsx_bytes, d1, d2, employees, resident)
+    REPORT_BYTES.observe(len(xlsx), "xlsx")
+    REPORT_CACHE.put((d1, d2), version, xlsx)
+    return xlsx
+
+async def get_report(d1: datetime.date, d2: datetime.date) -> bytes:
+    """Готовый отчёт из кэша, либо общая на всех сборка (single-flight) для одинаковых запросов."""
+    version = range_version(d1, d2)
+    cached = REPORT_CACHE.get((d1, d2), version)
+    if cached is not None:
+        return cached
+    flight_key = (d1, d2, version)
+    build = report_builds.get(flight_key)
+    if build is None:
+        build = asyncio.ensure_future(build_report(d1, d2, version))
+        report_builds[flight_key] = build
+        build.add_done_callback(lambda _: report_builds.pop(flight_key, None))
+    # shield: отмена одного ожидающего не должна отменять сборку для остальных
+    return await asyncio.shield(build)
+
+async def run_report_job(message: Message, d1: datetime.date, d2: datetime.date):
+    uid = message.from_user.id
     try:
-        xlsx = build_xlsx_bytes(d1, d2)
-        fname = f"Отчёт_{d1.isoformat()}_{d2.isoformat()}.xlsx" if d1 != d2 else f"Отчёт_{d1.isoformat()}.xlsx"
-        await message.answer_document(
-            BufferedInputFile(xlsx, filename=fname),
-            caption=f"Отчёт за период {d1.isoformat()} — {d2.isoformat()} (МСК).",
-            reply_markup=kb(message.from_user.id)
-        )
+        xlsx = await get_report(d1, d2)
+        fname, caption = report_file_caption(d1, d2)
+        await message.answer_document(BufferedInputFile(xlsx, filename=fname), caption=caption, reply_markup=kb(uid))
     except Exception as e:
         logging.exception("Ошибка формирования отчёта: %s", e)
         await message.answer("Не удалось сформировать отчёт. Проверьте данные и попробуйте ещё раз.")
     finally:
-        await state.clear()
+        release_report_slot(uid)
+
+def release_report_slot(uid: int) -> None:
+    report_inflight[uid] -= 1
+    if report_inflight[uid] <= 0:
+        report_inflight.pop(uid, None)
+
+def report_file_caption(d1: datetime.date, d2: datetime.date) -> tuple[str, str]:
+    fname = f"Отчёт_{d1.isoformat()}_{d2.isoformat()}.xlsx" if d1 != d2 else f"Отчёт_{d1.isoformat()}.xlsx"
+    return fname, f"Отчёт за период {d1.isoformat()} — {d2.isoformat()} (МСК)."
+
+# ---- Ночные отчёты: собраны заранее и лежат в /data/reports
+# Файл отдаётся сразу, пока версия периода та же, что при сборке. Версии живут
+# только в памяти, поэтому рядом с файлом хранится отпечаток данных периода:
+# после рестарта он пересчитывается (это дешевле сборки XLSX) и, если совпал,
+# файл снова считается актуальным. Иначе — обычная сборка через get_report().
+def report_digest(
+    date_from: datetime.date,
+    date_to: datetime.date,
+    employees: Dict[int, Dict[str, Any]],
+    resident: dict[str, dict[int, ShiftRecord]] | None = None,
+) -> str:
+    """Отпечаток того, из чего строится отчёт: справочник и строки «Смен»."""
+    h = hashlib.blake2b(digest_size=16)
+    h.update(repr(list(employees.items())).encode("utf-8"))
+    for row in report_rows(date_from, date_to, employees, load_range(date_from, date_to, resident)):
+        h.update(repr(row).encode("utf-8"))
+    return h.hexdigest()
+
+def build_prebuilt(
+    date_from: datetime.date,
+    date_to: datetime.date,
+    employees: Dict[int, Dict[str, Any]],
+    resident: dict[str, dict[int, ShiftRecord]],
+) -> tuple[bytes, str]:
+    return build_xlsx_bytes(date_from, date_to, employees, resident), report_digest(date_from, date_to, employees, resident)
+
+def standard_periods(today: datetime.date) -> list[tuple[datetime.date, datetime.date]]:
+    """Вчера, прошлая неделя (пн—вс) и прошлый месяц.
+    Текущую неделю не собираем: первая же отметка за сегодня сделала бы файл неактуальным."""
+    yesterday = today - datetime.timedelta(days=1)
+    last_monday = today - datetime.timedelta(days=today.weekday() + 7)
+    last_month_end = today.replace(day=1) - datetime.timedelta(days=1)
+    return [
+        (yesterday, yesterday),
+        (last_monday, last_monday + datetime.timedelta(days=6)),
+        (last_month_end.replace(day=1), last_month_end),
+    ]
+
+class PrebuiltReports:
+    """{d1}_{d2}.xlsx + {d1}_{d2}.json (отпечаток) в REPORTS_DIR и их версии в памяти."""
+
+    def __init__(self, root: Path):
+        self.root = root
+        # период -> {"digest", "version" (None — не проверен после старта), "file_id"}
+        self.entries: dict[tuple[datetime.date, datetime.date], Dict[str, Any]] = {}
+        self.served = 0
+
+    def path(self, key: tuple[datetime.date, datetime.date], suffix: str) -> Path:
+        return self.root / f"{key[0].isoformat()}_{key[1].isoformat()}{suffix}"
+
+    def load(self) -> None:
+        for meta_path in self.root.glob("*.json"):
+            try:
+                meta = json.loads(meta_path.read_text("utf-8"))
+                key = (datetime.date.fromisoformat(meta["from"]), datetime.date.fromisoformat(meta["to"]))
+            except Exception as e:
+                logging.warning("Пропускаю %s: %r", meta_path, e)
+                continue
+            if self.path(key, ".xlsx").exists():
+                self.entries[key] = {"digest": meta["digest"], "version": None, "file_id": None}
+
+    async def verify(self) -> None:
+        """После старта: файлы, чей отпечаток совпал с текущими данными, снова годны."""
+        loop = asyncio.get_running_loop()
+        for key, entry in list(self.entries.items()):
+            if entry["version"] is not None:
+                continue
+            # версия и снимки — без await между ними, иначе правка проскочит незамеченной
+            version = range_version(*key)
+            employees, resident = DIRECTORY.snapshot(), resident_days(*key)
+            digest = await loop.run_in_executor(REPORT_POOL, report_digest, *key, employees, resident)
+            if digest == entry["digest"] and self.entries.get(key) is entry:
+                entry["version"] = version
+        logging.info("Ночные отчёты: актуальны %s из %s", sum(e["version"] is not None for e in self.entries.values()), len(self.entries))
+
+    def lookup(self, d1: datetime.date, d2: datetime.date) -> Dict[str, Any] | None:
+        entry = self.entries.get((d1, d2))
+        if entry is None or entry["version"] is None or entry["version"] != range_version(d1, d2):
+            return None
+        return entry
+
+    async def build(self, key: tuple[datetime.date, datetime.date]) -> None:
+        version = range_version(*key)
+        employees, resident = DIRECTORY.snapshot(), resident_days(*key)
+        loop = asyncio.get_running_loop()
+        with REPORT_SECONDS.time("prebuilt"):
+            xlsx, digest = await loop.run_in_executor(REPORT_POOL, build_prebuilt, *key, employees, resident)
+        REPORT_BYTES.observe(len(xlsx), "prebuilt")
+        meta = {"from": key[0].isoformat(), "to": key[1].isoformat(), "digest": digest, "built_at": msk_now().isoformat()}
+        await asyncio.to_thread(atomic_write_bytes, self.path(key, ".xlsx"), xlsx)
+        await asyncio.to_thread(atomic_write_text, self.path(key, ".json"), json.dumps(meta, ensure_ascii=False))
+        self.entries[key] = {"digest": digest, "version": version, "file_id": None}
+        REPORT_CACHE.put(key, version, xlsx)
+
+    def prune(self, keep: list[tuple[datetime.date, datetime.date]]) -> None:
+        stems = {self.path(key, "").name for key in keep}
+        for key in [k for k in self.entries if k not in keep]:
+            del self.entries[key]
+        for p in self.root.iterdir():
+            if p.name.split(".", 1)[0] not in stems or p.suffix in (".bak", ".tmp"):
+                p.unlink(missing_ok=True)
+
+    async def nightly(self) -> None:
+        periods = standard_periods(msk_now().date())
+        t0 = time.perf_counter()
+        for key in periods:
+            try:
+                await self.build(key)
+            except Exception as e:
+                logging.exception("Ночной отчёт %s — %s не собран: %s", key[0], key[1], e)
+        await asyncio.to_thread(self.prune, periods)
+        logging.info("Ночные отчёты собраны за %.1f с", time.perf_counter() - t0)
+
+    async def send(self, message: Message, d1: datetime.date, d2: datetime.date, entry: Dict[str, Any]) -> None:
+        fname, caption = report_file_caption(d1, d2)
+        # после первой отправки файл уже у Telegram — дальше только его file_id
+        document = entry["file_id"] or FSInputFile(self.path((d1, d2), ".xlsx"), filename=fname)
+        sent = await message.answer_document(document, caption=caption, reply_markup=kb(message.from_user.id))
+        if sent is not None and sent.document is not None:
+            entry["file_id"] = sent.document.file_id
+        self.served += 1
+
+    def describe(self) -> str:
+        fresh = [k for k in self.entries if self.lookup(*k)]
+        return f"готово={len(fresh)}/{len(self.entries)} выдано={self.served}"
+
+REPORTS_DIR.mkdir(parents=True, exist_ok=True)
+PREBUILT = PrebuiltReports(REPORTS_DIR)
+PREBUILT.load()
+
+# ---- Потоковая выгрузка CSV (gzip) для длинных периодов
+# Те же строки, что на листе «Смены», но без XLSX: хранилище читается помесячно,
+# строки уходят в gzip по одной, поэтому память не растёт с длиной периода.
+EXPORT_FLAGS = {"csv": "csv", "tsv": "tsv", "помесячно": "monthly", "по-месяцам": "monthly", "monthly": "monthly"}
+
+def month_spans(date_from: datetime.date, date_to: datetime.date) -> list[tuple[datetime.date, datetime.date]]:
+    """Период, разрезанный по календарным месяцам (крайние месяцы — неполные)."""
+    spans = []
+    for ym in months_in_range(date_from, date_to):
+        lo, hi = (datetime.date.fromisoformat(d) for d in month_bounds(ym))
+        spans.append((max(lo, date_from), min(hi, date_to)))
+    return spans
+
+def write_csv_gz(
+    path: Path,
+    date_from: datetime.date,
+    date_to: datetime.date,
+    employees: Dict[int, Dict[str, Any]],
+    resident: dict[str, dict[int, ShiftRecord]],
+    delimiter: str = ";",
+) -> int:
+    """Строки «Смен» за период в gzip-CSV; в памяти не больше одного месяца смен. Возвращает число строк."""
+    rows = 0
+    # utf-8-sig: Excel без BOM открывает кириллицу кракозябрами
+    with gzip.open(path, "wt", encoding="utf-8-sig", newline="") as f:
+        writer = csv.writer(f, delimiter=delimiter)
+        writer.writerow(SHIFTS_HEADER)
+        for lo, hi in month_spans(date_from, date_to):
+            chunk = STORE.read_range(lo, hi)
+            lo_s, hi_s = lo.isoformat(), hi.isoformat()
+            chunk.update({day: users for day, users in resident.items() if lo_s <= day <= hi_s})
+            for row in report_rows(lo, hi, employees, chunk):
+                writer.writerow(row)
+                rows += 1
+    return rows
+
+async def run_csv_job(message: Message, d1: datetime.date, d2: datetime.date, delimiter: str, monthly: bool):
+    uid = message.from_user.id
+    ext = "tsv" if delimiter == "\t" else "csv"
+    # снимки — в event loop, как и для XLSX
+    employees = DIRECTORY.snapshot()
+    resident = resident_days(d1, d2)
+    loop = asyncio.get_running_loop()
+    try:
+        # помесячно: файлы собираются и отправляются по одному, на диске — не больше одного
+        for lo, hi in (month_spans(d1, d2) if monthly else [(d1, d2)]):
+            fd, tmp = tempfile.mkstemp(prefix="dusberg-export-", suffix=f".{ext}.gz")
+            os.close(fd)
+            try:
+                with REPORT_SECONDS.time(ext):
+                    rows = await loop.run_in_executor(REPORT_POOL, write_csv_gz, Path(tmp), lo, hi, employees, resident, delimiter)
+                REPORT_BYTES.observe(os.path.getsize(tmp), ext)
+                if os.path.getsize(tmp) > TELEGRAM_FILE_LIMIT:
+                    await message.answer(
+                        f"Файл за {lo.isoformat()} — {hi.isoformat()} больше 50 МБ, Telegram его не примет. "
+                        "Допишите <code>помесячно</code> или сократите период.",
+                        reply_markup=kb(uid)
+                    )
+                    return
+                fname = f"Смены_{lo.isoformat()}_{hi.isoformat()}.{ext}.gz"
+                await message.answer_document(
+                    FSInputFile(tmp, filename=fname),
+                    caption=f"Смены за период {lo.isoformat()} — {hi.isoformat()} (МСК), строк: {rows}.",
+                    reply_markup=kb(uid)
+                )
+            finally:
+                os.unlink(tmp)
+    except Exception as e:
+        logging.exception("Ошибка выгрузки CSV: %s", e)
+        await message.answer("Не удалось выгрузить CSV. Проверьте данные и попробуйте ещё раз.")
+    finally:
+        release_report_slot(uid)
 
 # ================== DEBUG (безопасные) ==================
 @router.message(Command("debug_files"))
 async def debug_files(message: Message):
     if message.from_user.id != OWNER_ID:
         return await message.answer("Нет доступа.")
-    e, s = EMP_FILE, SHIFT_FILE
-    await message.answer(
-        f"/data exists: {DATA_DIR.exists()}\n"
-        f"{e.name}: exists={e.exists()} size={(e.stat().st_size if e.exists() else 0)} path={e}\n"
-        f"{s.name}: exists={s.exists()} size={(s.stat().st_size if s.exists() else 0)} path={s}\n"
-    )
+    lines = [
+        f"/data exists: {DATA_DIR.exists()}",
+        *STORE.describe(),
+        "запись: " + ", ".join(f"{k}={v}" for k, v in persistence_metrics().items()),
+        "кэш отчётов: " + REPORT_CACHE.describe(),
+        "ночные отчёты: " + PREBUILT.describe(),
+        "доска дня: " + BOARD.describe(),
+        f"апдейты: пользователей в работе={len(USER_ORDER.locks)} параллельно={UPDATE_LOCK.readers}",
+        "исходящие: " + OUTBOUND.describe(),
+        "лента изменений: " + FEED.describe(),
+        f"в памяти: {', '.join(sorted(loaded_months)) or '—'}",
+    ]
+    await message.answer("\n".join(lines))
+
+def updates_backlog() -> int:
+    """Апдейты в работе и в очереди к своим пользователям."""
+    return sum(entry[1] for entry in USER_ORDER.locks.values())
+
+def metrics_text() -> str:
+    lines = []
+    for hist in HISTOGRAMS:
+        lines += hist.render()
+
+    def metric(name: str, kind: str, help_text: str, samples: Iterable[tuple[str, float]]):
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} {kind}")
+        lines.extend(f"{name}{labels} {value}" for labels, value in samples)
+
+    depth = OUTBOUND.depth()
+    metric("dusberg_updates_backlog", "gauge", "Апдейты в работе и в очереди", [("", updates_backlog())])
+    metric("dusberg_updates_users", "gauge", "Пользователи с апдейтами в работе", [("", len(USER_ORDER.locks))])
+    metric("dusberg_shifts_days", "gauge", "Дней в shifts_by_date", [("", len(shifts_by_date))])
+    metric("dusberg_shifts_records", "gauge", "Смен в shifts_by_date", [("", sum(len(u) for u in shifts_by_date.values()))])
+    metric("dusberg_loaded_months", "gauge", "Месяцев в памяти", [("", len(loaded_months))])
+    metric("dusberg_pending_reasons", "gauge", "Ждут ввода причины (pending_reason)", [("", len(pending_reason))])
+    metric("dusberg_employees", "gauge", "Сотрудников в справочнике", [("", len(DIRECTORY))])
+    metric("dusberg_persist_dirty", "gauge", "Незаписанных смен", [("", len(dirty_shifts))])
+    metric("dusberg_persist_writes_total", "counter", "Пачек записано", [("", persist_stats["writes"])])
+    metric("dusberg_persist_errors_total", "counter", "Ошибок фоновой записи", [("", persist_stats["errors"])])
+    metric("dusberg_changes_seq", "counter", "Последний номер ленты изменений", [("", FEED.seq)])
+    metric("dusberg_report_cache_bytes", "gauge", "Размер кэша отчётов", [("", REPORT_CACHE.size)])
+    metric("dusberg_report_queue", "gauge", "Отчётов в работе и в очереди", [("", len(report_tasks))])
+    metric("dusberg_outbound_queue", "gauge", "Отправок ждут токен", [(f'{{lane="{lane}"}}', n) for lane, n in depth.items()])
+    metric("dusberg_outbound_sent_total", "counter", "Отправлено вызовов API с chat_id", [("", OUTBOUND.sent)])
+    metric("dusberg_outbound_retry_after_total", "counter", "Ответов 429", [("", OUTBOUND.retry_after)])
+    return "\n".join(lines) + "\n"
+
+def histogram_summary(hist: Histogram, fmt=lambda v: f"{v * 1000:.0f} мс") -> list[str]:
+    rows = sorted(hist.snapshot().items(), key=lambda kv: -sum(kv[1][0]))
+    return [
+        f"• {value}: {sum(counts)} · p50 {fmt(hist.quantile(counts, 0.5))} · p95 {fmt(hist.quantile(counts, 0.95))} · ср. {fmt(total / sum(counts))}"
+        for value, (counts, total) in rows
+    ] or ["• —"]
+
+@router.message(Command("metrics"))
+async def cmd_metrics(message: Message):
+    if message.from_user.id != OWNER_ID:
+        return await message.answer("Нет доступа.")
+    lines = [
+        f"апдейтов в работе/в очереди: {updates_backlog()} (пользователей {len(USER_ORDER.locks)})",
+        f"в памяти: дней {len(shifts_by_date)}, смен {sum(len(u) for u in shifts_by_date.values())}, "
+        f"ждут причину {len(pending_reason)}",
+        "<b>хендлеры</b>", *histogram_summary(HANDLER_SECONDS),
+        "<b>запись файлов</b>", *histogram_summary(WRITE_SECONDS),
+        "<b>отчёты</b>", *histogram_summary(REPORT_SECONDS),
+        "<b>размер отчётов</b>", *histogram_summary(REPORT_BYTES, fmt=lambda v: f"{v / 1024:.0f} КБ"),
+    ]
+    await message.answer("\n".join(lines))
+
+@router.message(Command("changes"))
+async def cmd_changes(message: Message, command: CommandObject):
+    # дельта для синхронизации: /changes N — всё, что записано после seq N
+    if message.from_user.id != OWNER_ID:
+        return await message.answer("Нет доступа.")
+    arg = (command.args or "").strip()
+    if not arg:
+        return await message.answer(
+            f"Лента изменений: {FEED.describe()}.\n"
+            "<code>/changes N</code> — изменения после номера N (N — из манифеста экспорта или заголовка прошлой выгрузки)."
+        )
+    if not arg.isdigit():
+        return await message.answer("Номер — целое число: <code>/changes 1200</code>.")
+    await flush_now()
+    fd, tmp = tempfile.mkstemp(prefix="dusberg-changes-", suffix=".jsonl.gz")
+    os.close(fd)
+    try:
+        try:
+            header = await asyncio.to_thread(FEED.write_since, Path(tmp), int(arg))
+        except ValueError as ex:
+            return await message.answer(f"{ex}. Нужна полная выгрузка — «📤 Экспорт данных» → <code>всё</code>.")
+        await message.answer_document(
+            FSInputFile(tmp, filename=f"changes_{header['after']}_{header['seq']}.jsonl.gz"),
+            caption=f"Изменений: {header['count']} (seq {header['after']} → {header['seq']}). Следующий раз: <code>/changes {header['seq']}</code>."
+        )
+    finally:
+        os.unlink(tmp)
 
 @router.message(Command("debug_dump"))
 async def debug_dump(message: Message):
+    if message.from_user.id != OWNER_ID:
+        return await message.answer("Нет доступа.")
+    await run_export(message, None, None)  # тот же архив, что «📤 Экспорт данных» → «всё»
+
+async def recompute_all_metrics() -> ImportStats:
+    """Пересчитать метрики всей истории по месяцу; записываются только изменившиеся смены (и попадают в ленту)."""
+    stats = ImportStats()
+    await flush_now()
+    bounds = await asyncio.to_thread(STORE.history_bounds)
+    for ym in months_in_range(*bounds) if bounds else []:
+        if ym in loaded_months:
+            source = {day: users for day, users in shifts_by_date.items() if month_of(day) == ym}
+        else:
+            source = await asyncio.to_thread(STORE.read_month, ym)
+        days = {day: {uid: materialize_metrics(replace(rec)) for uid, rec in users.items()} for day, users in source.items()}
+        await upsert_month(ym, days, stats)
+    await flush_now()
+    await asyncio.to_thread(STORE.flush)
+    return stats
+
+@router.message(Command("recompute_metrics"))
+async def recompute_metrics(message: Message):
+    # после изменения START_NORM/END_NORM и т.п. — пересчитать сохранённые метрики всей истории;
+    # без замка на запись: это обычные upsert'ы, как при импорте слиянием
     if message.from_user.id != OWNER_ID:
         return await message.answer("Нет доступа.")
     try:
-        await message.answer_document(
-            BufferedInputFile(EMP_FILE.read_bytes() if EMP_FILE.exists() else b"{}", filename="employees.json"))
-        await message.answer_document(
-            BufferedInputFile(SHIFT_FILE.read_bytes() if SHIFT_FILE.exists() else b"{}", filename="shifts.json"))
+        await message.answer("Пересчитываю метрики смен…")
+        stats = await recompute_all_metrics()
+        added, changed, skipped = stats.totals()
+        await message.answer(f"Готово: проверено смен {added + changed + skipped} за {len(stats.days)} дней, изменено {changed}.")
     except Exception as ex:
-        await message.answer(f"dump error: {ex!r}")
+        logging.exception("Пересчёт метрик не удался: %s", ex)
+        await message.answer(f"recompute error: {ex!r}")
 
 # ================== СВОБОДНЫЙ ТЕКСТ (причины/комментарии) ==================
 @router.message(F.text & ~F.text.startswith("/"))
@@ -862,41 +3575,371 @@ async def handle_comment_or_reason(message: Message):
         return
 
     # если ждём причину — сохраняем и добавляем хвостовую фразу
+    day = today_key()
     reason_flag = pending_reason.get(uid)
     if reason_flag:
-        shift = shifts_by_date.get(today_key(), {}).get(uid)
+        shift = day_shifts(day).get(uid)
         if not shift:
             pending_reason.pop(uid, None)
             return
 
         if reason_flag in ("start_early", "start_late"):
-            shift["start_reason"] = txt
+            shift.start_reason = intern_text(txt)
             tail = " Продуктивного дня!"
         elif reason_flag in ("end_early", "end_late"):
-            shift["end_reason"] = txt
+            shift.end_reason = intern_text(txt)
             tail = " Хорошего отдыха!"
         else:
             tail = ""
 
         pending_reason.pop(uid, None)
-        save_shifts()
+        save_shift(uid, day)
+        BOARD.touch(uid, day)
         await message.answer("Спасибо! Причина зафиксирована." + tail, reply_markup=kb(uid))
         return
 
     # иначе — это общий комментарий к смене
-    shift = shifts_by_date.get(today_key(), {}).get(uid)
+    shift = day_shifts(day).get(uid)
     if not shift:
         return
-    if shift.get("start") and not shift.get("end") and not shift.get("comment"):
-        shift["comment"] = txt
-        save_shifts()
+    if shift.start is not None and shift.end is None and not shift.comment:
+        shift.comment = txt
+        save_shift(uid, day)
         await message.answer("Комментарий сохранён. Продуктивного дня!", reply_markup=kb(uid))
-    elif shift.get("end") and not shift.get("comment_done"):
-        shift["comment_done"] = True
-        save_shifts()
+    elif shift.end is not None and not shift.comment_done:
+        shift.comment_done = True
+        save_shift(uid, day)
         await message.answer("Комментарий сохранен. Хорошего отдыха!", reply_markup=kb(uid))
 
+# ================== HTTP API (только чтение) ==================
+# GET /api/today, /api/employees/{uid}/shifts, /api/days — JSON из тех же данных,
+# что видит бот: доска дня — из shifts_by_date, история и сводка — резидентные
+# дни из памяти, остальное из хранилища (в потоке). ETag = запрос + итоговый период
+# (без from/to он зависит от сегодняшней даты) + версия его данных (range_version):
+# пока в периоде ничего не менялось, опрос с If-None-Match получает 304 без чтения
+# данных, а без него — готовое тело из кэша.
+API_BOOT = secrets.token_hex(4)  # версии в памяти после рестарта начинаются заново
+API_CACHE_ENTRIES = 128
+API_PAGE_DEFAULT = 100
+API_PAGE_MAX = 1000
+API_DEFAULT_DAYS = 31
+api_cache: OrderedDict[tuple, tuple[str, bytes, bytes]] = OrderedDict()  # (path_qs, период) -> (etag, json, gzip)
+
+def api_error(exc: type[web.HTTPException], text: str) -> web.HTTPException:
+    return exc(text=json.dumps({"error": text}, ensure_ascii=False), content_type="application/json")
+
+def api_period(request: web.Request) -> tuple[datetime.date, datetime.date]:
+    """?from=&to= (ISO или ДД.ММ.ГГГГ); по умолчанию — последние API_DEFAULT_DAYS дней."""
+    q = request.query
+    d2 = parse_date(q["to"]) if "to" in q else msk_now().date()
+    d1 = parse_date(q["from"]) if "from" in q else (d2 and d2 - datetime.timedelta(days=API_DEFAULT_DAYS - 1))
+    if d1 is None or d2 is None:
+        raise api_error(web.HTTPBadRequest, "from/to — даты YYYY-MM-DD")
+    if d2 < d1:
+        raise api_error(web.HTTPBadRequest, "from позже to")
+    if (d2 - d1).days > CSV_MAX_DAYS:
+        raise api_error(web.HTTPBadRequest, f"период длиннее {CSV_MAX_DAYS} дней")
+    return d1, d2
+
+def api_page(request: web.Request) -> tuple[int, int]:
+    try:
+        offset = int(request.query.get("offset", 0))
+        limit = int(request.query.get("limit", API_PAGE_DEFAULT))
+    except ValueError:
+        raise api_error(web.HTTPBadRequest, "offset/limit — целые числа") from None
+    if offset < 0 or not 1 <= limit <= API_PAGE_MAX:
+        raise api_error(web.HTTPBadRequest, f"offset >= 0, limit от 1 до {API_PAGE_MAX}")
+    return offset, limit
+
+def api_page_body(total: int, offset: int, limit: int, items: list) -> Dict[str, Any]:
+    return {"total": total, "offset": offset, "limit": limit, "next": offset + limit if offset + limit < total else None, "items": items}
+
+def api_shift(day: str, uid: int, rec: ShiftRecord) -> Dict[str, Any]:
+    return {"day": day, "uid": uid, "name": DIRECTORY.name(uid), **shift_to_json(rec)}
+
+async def api_respond(request: web.Request, period: tuple, version: tuple, build) -> web.Response:
+    """304 по If-None-Match, иначе тело из кэша или build() — JSON, gzip по Accept-Encoding.
+    period — даты, которые запрос покрывает на самом деле: один и тот же URL после полуночи — другой ответ."""
+    key = (request.path_qs, period)
+    etag = '"' + hashlib.blake2b(repr((API_BOOT, key, version)).encode(), digest_size=12).hexdigest() + '"'
+    headers = {"ETag": etag, "Cache-Control": "no-cache", "Vary": "Accept-Encoding"}
+    tags = {tag.strip().removeprefix("W/") for tag in request.headers.get("If-None-Match", "").split(",")}
+    if etag in tags or "*" in tags:
+        return web.Response(status=304, headers=headers)
+    cached = api_cache.get(key)
+    if cached is not None and cached[0] == etag:
+        api_cache.move_to_end(key)
+        body, gz = cached[1], cached[2]
+    else:
+        body = json.dumps(await build(), ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+        gz = gzip.compress(body, compresslevel=6)
+        api_cache[key] = (etag, body, gz)
+        while len(api_cache) > API_CACHE_ENTRIES:
+            api_cache.popitem(last=False)
+    if "gzip" in request.headers.get("Accept-Encoding", ""):
+        return web.Response(body=gz, content_type="application/json", headers={**headers, "Content-Encoding": "gzip"})
+    return web.Response(body=body, content_type="application/json", headers=headers)
+
+@web.middleware
+async def api_middleware(request: web.Request, handler):
+    expected = f"Bearer {API_TOKEN}".encode()
+    if not secrets.compare_digest(request.headers.get("Authorization", "").encode(), expected):
+        return web.json_response({"error": "нужен заголовок Authorization: Bearer <API_TOKEN>"}, status=401)
+    with API_SECONDS.time(request.match_info.route.name or "unknown"):
+        return await handler(request)
+
+async def api_today(request: web.Request) -> web.Response:
+    """Доска дня: то же, что «Статус смен»."""
+    offset, limit = api_page(request)
+    day = today_key()
+    d = datetime.date.fromisoformat(day)
+
+    async def build():
+        board = shift_board(day)
+        items = [api_shift(day, uid, rec) for uid, rec in board[offset:offset + limit]]
+        return {"day": day, **api_page_body(len(board), offset, limit, items)}
+
+    return await api_respond(request, (d, d), range_version(d, d), build)
+
+async def api_employee_shifts(request: web.Request) -> web.Response:
+    """Смены одного сотрудника за период, по дням."""
+    try:
+        uid = int(request.match_info["uid"])
+    except ValueError:
+        raise api_error(web.HTTPBadRequest, "uid — число") from None
+    d1, d2 = api_period(request)
+    offset, limit = api_page(request)
+
+    async def build():
+        data = await asyncio.to_thread(load_range, d1, d2, resident_days(d1, d2))
+        days = [(day, data[day][uid]) for day in sorted(data) if uid in data[day]]
+        items = [api_shift(day, uid, rec) for day, rec in days[offset:offset + limit]]
+        return {"uid": uid, "name": DIRECTORY.name(uid), "from": d1.isoformat(), "to": d2.isoformat(),
+                **api_page_body(len(days), offset, limit, items)}
+
+    return await api_respond(request, (d1, d2), range_version(d1, d2), build)
+
+async def api_days(request: web.Request) -> web.Response:
+    """Итоги по дням периода (включая дни без смен); читается только страница."""
+    d1, d2 = api_period(request)
+    offset, limit = api_page(request)
+    total = (d2 - d1).days + 1
+
+    async def build():
+        page = [d1 + datetime.timedelta(days=i) for i in range(offset, min(offset + limit, total))]
+        data = await asyncio.to_thread(load_range, page[0], page[-1], resident_days(page[0], page[-1])) if page else {}
+        items = []
+        for date in page:
+            records = data.get(date.isoformat(), {}).values()
+            items.append({
+                "day": date.isoformat(),
+                "weekend": is_weekend(date),
+                "shifts": len(records),
+                "open": sum(1 for r in records if r.start is not None and r.end is None),
+                "late_start": sum(1 for r in records if r.late_start),
+                "early_end": sum(1 for r in records if r.early_end),
+                "with_reasons": sum(1 for r in records if r.start_reason or r.end_reason),
+                "work_min": sum(r.work_min for r in records),
+            })
+        return {"from": d1.isoformat(), "to": d2.isoformat(), **api_page_body(total, offset, limit, items)}
+
+    return await api_respond(request, (d1, d2), range_version(d1, d2), build)
+
+# ================== НАПОМИНАНИЯ ==================
+# Кто сегодня ещё не начал смену и у кого она открыта — живые множества:
+# строятся один раз на день (и заново после правок справочника или импорта),
+# дальше их ведут handle_start/handle_end. Задачи apscheduler только читают их.
+class ShiftRoster:
+    """Сегодняшние not_started / open по активным сотрудникам справочника."""
+
+    def __init__(self):
+        self.key: tuple | None = None  # (день, версия справочника, поколение данных)
+        self.not_started: set[int] = set()
+        self.open: set[int] = set()
+
+    def for_day(self, day: str) -> "ShiftRoster":
+        key = (day, employees_version, data_generation)
+        if key != self.key:
+            active = set(DIRECTORY.uids(active=True))
+            shifts = day_shifts(day)
+            self.not_started = {uid for uid in active if uid not in shifts or shifts[uid].start is None}
+            self.open = {uid for uid, rec in shifts.items() if uid in active and rec.start is not None and rec.end is None}
+            self.key = key
+        return self
+
+    def current(self, day: str) -> bool:
+        return self.key is not None and self.key[0] == day
+
+    def started(self, uid: int, day: str) -> None:
+        if self.current(day):
+            self.not_started.discard(uid)
+            meta = DIRECTORY.get(uid)
+            if meta and meta.get("active", True):
+                self.open.add(uid)
+
+    def ended(self, uid: int, day: str) -> None:
+        if self.current(day):
+            self.open.discard(uid)
+
+ROSTER = ShiftRoster()
+
+async def send_reminders(uids: list[int], pending: set[int], text: str) -> int:
+    """Пачками по REMIND_BATCH в полосе bulk; кто успел отметиться, пока шла рассылка, — пропускается."""
+    sent = 0
+    with bulk_sends():
+        for i in range(0, len(uids), REMIND_BATCH):
+            batch = [uid for uid in uids[i:i + REMIND_BATCH] if uid in pending]
+            results = await asyncio.gather(
+                *(bot.send_message(uid, text, reply_markup=kb(uid)) for uid in batch), return_exceptions=True
+            )
+            for uid, res in zip(batch, results):
+                if isinstance(res, TelegramForbiddenError):
+                    logging.info("Напоминание не доставлено: %s заблокировал бота", uid)
+                elif isinstance(res, Exception):
+                    logging.warning("Напоминание для %s не отправлено: %r", uid, res)
+                else:
+                    sent += 1
+    return sent
+
+async def remind_not_started() -> None:
+    today = msk_now().date()
+    if is_weekend(today):
+        return
+    roster = ROSTER.for_day(today.isoformat())
+    uids = sorted(roster.not_started)
+    sent = await send_reminders(
+        uids, roster.not_started,
+        "Ты ещё не отметил начало смены. Если ты на работе — нажми «Смену начал 🏭»."
+    )
+    logging.info("Напоминание о начале смены: %s из %s", sent, len(uids))
+
+async def remind_open_shifts() -> None:
+    today = msk_now().date()
+    if is_weekend(today):
+        return
+    roster = ROSTER.for_day(today.isoformat())
+    uids = sorted(roster.open)
+    sent = await send_reminders(
+        uids, roster.open,
+        "Смена всё ещё открыта. Не забудь нажать «Смену закончил 🏡»."
+    )
+    logging.info("Напоминание о незакрытой смене: %s из %s", sent, len(uids))
+
+def remind_time(t: datetime.time, delay_min: int) -> datetime.time:
+    return (datetime.datetime.combine(datetime.date.min, t) + datetime.timedelta(minutes=delay_min)).time()
+
 # ================== ЗАПУСК ==================
+async def start_metrics_server() -> web.AppRunner:
+    async def handle_metrics(request: web.Request) -> web.Response:
+        return web.Response(text=metrics_text(), content_type="text/plain", charset="utf-8")
+
+    app = web.Application()
+    app.router.add_get("/metrics", handle_metrics)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, METRICS_HOST, METRICS_PORT).start()
+    logging.info("Метрики: http://%s:%s/metrics", METRICS_HOST, METRICS_PORT)
+    return runner
+
+def api_app() -> web.Application:
+    app = web.Application(middlewares=[api_middleware])
+    app.router.add_get("/api/today", api_today, name="today")
+    app.router.add_get("/api/employees/{uid}/shifts", api_employee_shifts, name="employee")
+    app.router.add_get("/api/days", api_days, name="days")
+    return app
+
+async def start_api_server() -> web.AppRunner | None:
+    if not API_TOKEN:
+        logging.error("API_PORT задан, а API_TOKEN пуст — HTTP API не запущен")
+        return None
+    runner = web.AppRunner(api_app(), access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, API_HOST, API_PORT).start()
+    logging.info("HTTP API: http://%s:%s/api/", API_HOST, API_PORT)
+    return runner
+
+def start_scheduler() -> AsyncIOScheduler:
+    scheduler = AsyncIOScheduler(timezone=MSK)
+    jobs = []
+    if REMINDERS:
+        # выходные отсекает is_weekend() внутри задачи — как и вопросы о причинах
+        jobs += [
+            (remind_not_started, remind_time(PROMPT_START_OK_TILL, REMIND_START_DELAY)),
+            (remind_open_shifts, remind_time(PROMPT_END_OK_TILL, REMIND_END_DELAY)),
+        ]
+    if REPORT_NIGHTLY:
+        jobs.append((PREBUILT.nightly, REPORT_NIGHTLY_AT))
+    for job, at in jobs:
+        scheduler.add_job(job, CronTrigger(hour=at.hour, minute=at.minute, timezone=MSK),
+                          coalesce=True, misfire_grace_time=600)
+        logging.info("Задача %s: ежедневно в %s МСК", job.__name__, at.strftime("%H:%M"))
+    scheduler.start()
+    return scheduler
+
+class BackgroundRequestHandler(SimpleRequestHandler):
+    """Webhook-хендлер: сразу отвечает Telegram 200, апдейт обрабатывает в фоновой задаче.
+    Задачи учитываем сами, чтобы при остановке дождаться уже принятых апдейтов."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.tasks: set[asyncio.Task] = set()
+
+    async def process(self, bot: Bot, update: Dict[str, Any]) -> None:
+        result = await self.dispatcher.feed_raw_update(bot=bot, update=update, **self.data)
+        if isinstance(result, TelegramMethod):
+            await self.dispatcher.silent_call_request(bot=bot, result=result)
+
+    async def handle(self, request: web.Request) -> web.Response:
+        bot = await self.resolve_bot(request)
+        if not self.verify_secret(request.headers.get("X-Telegram-Bot-Api-Secret-Token", ""), bot):
+            return web.Response(body="Unauthorized", status=401)
+        update = await request.json(loads=bot.session.json_loads)
+        task = asyncio.create_task(self.process(bot, update))
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+        return web.json_response({}, dumps=bot.session.json_dumps)
+
+    async def drain(self, timeout: float) -> None:
+        if self.tasks:
+            await asyncio.wait(set(self.tasks), timeout=timeout)
+
+async def run_webhook(stop: asyncio.Event | None = None) -> None:
+    """Webhook: aiohttp-сервер сразу отвечает Telegram 200, апдейты обрабатываются в фоне.
+    Работает до SIGINT/SIGTERM или до stop.set()."""
+    secret = WEBHOOK_SECRET or secrets.token_urlsafe(32)
+    app = web.Application()
+    handler = BackgroundRequestHandler(dispatcher=dp, bot=bot, secret_token=secret)
+    handler.register(app, path=WEBHOOK_PATH)
+    setup_application(app, dp, bot=bot)
+
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, WEBHOOK_HOST, WEBHOOK_PORT)
+    await site.start()
+    await bot.set_webhook(
+        WEBHOOK_URL + WEBHOOK_PATH,
+        secret_token=secret,
+        allowed_updates=dp.resolve_used_update_types(),
+    )
+    logging.info("Webhook: слушаю %s:%s%s -> %s", WEBHOOK_HOST, WEBHOOK_PORT, WEBHOOK_PATH, WEBHOOK_URL)
+
+    stop = stop or asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        with contextlib.suppress(NotImplementedError):
+            loop.add_signal_handler(sig, stop.set)
+    try:
+        await stop.wait()
+    finally:
+        logging.info("Webhook: останавливаюсь")
+        await site.stop()  # новые апдейты не принимаем — Telegram придержит их до рестарта
+        # уже принятые дорабатываем: им ещё нужна сессия бота, которую закроет cleanup()
+        await handler.drain(WEBHOOK_DRAIN_TIMEOUT)
+        await runner.cleanup()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            with contextlib.suppress(NotImplementedError):
+                loop.remove_signal_handler(sig)
+
 async def main():
     try:
         me = await bot.get_me()
@@ -911,12 +3954,36 @@ async def main():
         await bot.set_my_commands(base_cmds, scope=BotCommandScopeDefault())
         await bot.set_my_commands(base_cmds, scope=BotCommandScopeChat(chat_id=OWNER_ID))
 
-        await dp.start_polling(bot)
+        background = [
+            asyncio.create_task(persistence_writer()),
+            asyncio.create_task(store_maintenance()),
+            asyncio.create_task(PREBUILT.verify()),
+        ]
+        scheduler = start_scheduler()
+        metrics_runner = await start_metrics_server() if METRICS_PORT else None
+        api_runner = await start_api_server() if API_PORT else None
+        try:
+            if WEBHOOK_URL:
+                await run_webhook()
+            else:
+                await bot.delete_webhook()  # после работы webhook'ом getUpdates иначе вернёт конфликт
+                await dp.start_polling(bot, handle_as_tasks=True)
+        finally:
+            if metrics_runner:
+                await metrics_runner.cleanup()
+            if api_runner:
+                await api_runner.cleanup()
+            scheduler.shutdown(wait=False)
+            for task in background:
+                task.cancel()
+            REPORT_POOL.shutdown(wait=False, cancel_futures=True)
     except Exception as e:
         logging.exception("Старт не удался: %s", e)
     finally:
         try:
+            await flush_now()
             save_shifts()
+            STORE.close()
         finally:
             await bot.session.close()
 
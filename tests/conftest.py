@@ -0,0 +1,40 @@
+# Тесты гоняют бота без сети: main импортируется с фиктивным токеном и временным
+# DATA_DIR (как в bench.py), ответы Telegram подменяет bench.FakeSession.
+import os
+import sys
+import tempfile
+from pathlib import Path
+
+os.environ.setdefault("BOT_TOKEN", "0:test")
+os.environ.setdefault("DATA_DIR", tempfile.mkdtemp(prefix="dusberg-test-"))
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import itertools  # noqa: E402
+
+import pytest  # noqa: E402
+
+import bench  # noqa: E402
+import main  # noqa: E402
+
+UPDATE_IDS = itertools.count(1)
+
+@pytest.fixture
+def session():
+    """FakeSession вместо сети; main.bot возвращается к прежней сессии после теста."""
+    old = main.bot.session
+    main.bot.session = bench.FakeSession(latency=0)
+    yield main.bot.session
+    main.bot.session = old
+
+@pytest.fixture
+def directory():
+    """Справочник (общий с main.EMPLOYEES dict) возвращается к прежнему после теста."""
+    saved = {uid: dict(meta) for uid, meta in main.EMPLOYEES.items()}
+    yield main.DIRECTORY
+    main.DIRECTORY.replace(saved)
+
+async def feed(uid: int, text: str) -> None:
+    await main.dp.feed_update(main.bot, bench.message_update(next(UPDATE_IDS), uid, text))
+
+async def fsm_state(uid: int) -> str | None:
+    return await main.dp.fsm.get_context(main.bot, chat_id=uid, user_id=uid).get_state()
@@ -0,0 +1,43 @@
+import asyncio
+import datetime
+
+from aiohttp.test_utils import TestClient, TestServer
+
+import main
+
+TOKEN = "test-token"
+
+def at(day: int, hour: int, minute: int) -> datetime.datetime:
+    return datetime.datetime(2025, 3, day, hour, minute, tzinfo=main.MSK)
+
+def test_default_window_moves_past_midnight(monkeypatch):
+    monkeypatch.setattr(main, "API_TOKEN", TOKEN)
+    main.api_cache.clear()
+    clock = [at(5, 23, 59)]
+    monkeypatch.setattr(main, "msk_now", lambda: clock[0])
+    auth = {"Authorization": f"Bearer {TOKEN}"}
+
+    async def run():
+        async with TestClient(TestServer(main.api_app())) as client:
+            answers = {}
+            for path in ("/api/days", "/api/today"):
+                resp = await client.get(path, headers=auth)
+                assert resp.status == 200
+                answers[path] = (resp.headers["ETag"], await resp.json())
+            assert answers["/api/days"][1]["to"] == "2025-03-05"
+            assert answers["/api/today"][1]["day"] == "2025-03-05"
+
+            clock[0] = at(6, 0, 5)
+            for path, (etag, _) in answers.items():
+                # тот же URL и старый ETag после полуночи — не 304
+                resp = await client.get(path, headers={**auth, "If-None-Match": etag})
+                assert resp.status == 200
+                assert resp.headers["ETag"] != etag
+                # и не старое тело из кэша
+                resp = await client.get(path, headers=auth)
+                body = await resp.json()
+                assert body.get("to", body.get("day")) == "2025-03-06"
+            resp = await client.get("/api/days", headers=auth)
+            assert (await resp.json())["from"] == "2025-02-04"
+
+    asyncio.run(run())
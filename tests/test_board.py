@@ -0,0 +1,51 @@
+import asyncio
+import datetime
+import re
+
+from aiogram.types import InaccessibleMessage, Update
+
+import main
+from conftest import UPDATE_IDS
+
+OWNER = main.OWNER_ID
+
+def test_long_reasons_fit_one_page(monkeypatch):
+    day = "2025-03-05"
+    start = main.epoch_seconds(datetime.datetime(2025, 3, 5, 9, 30, tzinfo=main.MSK))
+    shifts = {
+        uid: main.materialize_metrics(main.ShiftRecord(start=start, end=start + 8 * 3600))
+        for uid in range(1, 301)
+    }
+    # экранирование удлиняет текст: «&» → «&amp;»
+    shifts[7].start_reason = "&" * 3000
+    shifts[7].end_reason = "опоздал " * 400
+    monkeypatch.setattr(main, "day_shifts", lambda d: shifts)
+    board = main.TodayBoard().for_day(day)
+
+    block = board.lines[7]
+    assert len(block) <= main.BOARD_PAGE_CHARS
+    assert block.count("…") == 2 and not re.search(r"&\w*…", block)  # сущность не разрезана
+    _, pages = board.paginate("all")
+    assert sum(page.count(": начата в") for page in pages) == 300
+    for page in range(len(pages)):
+        text, _ = board.view("all", page)
+        assert len(text) <= 4096
+
+def test_board_callback_on_inaccessible_message(session):
+    update = Update.model_validate({
+        "update_id": next(UPDATE_IDS),
+        "callback_query": {
+            "id": "1", "chat_instance": "1", "data": "board:all:1",
+            "from": {"id": OWNER, "is_bot": False, "first_name": "owner"},
+            # date = 0 — Telegram так отдаёт сообщение, которое уже нельзя править
+            "message": {"message_id": 1, "date": 0, "chat": {"id": OWNER, "type": "private"}},
+        },
+    })
+    assert isinstance(update.callback_query.message, InaccessibleMessage)
+
+    async def run():
+        await main.dp.feed_update(main.bot, update)
+
+    asyncio.run(run())
+    assert OWNER not in session.sent  # не пытались править, только ответ на кнопку
+    assert session.requests == 1
@@ -0,0 +1,81 @@
+import asyncio
+import datetime
+import gzip
+import json
+
+import bench
+import main
+
+def changes_since(tmp_path, after: int) -> tuple[dict, list[dict]]:
+    path = tmp_path / "changes.jsonl.gz"
+    main.FEED.write_since(path, after)
+    with gzip.open(path, "rt", encoding="utf-8") as f:
+        header, *entries = [json.loads(line) for line in f]
+    return header, entries
+
+def seed_history(directory) -> None:
+    employees = bench.synth_employees(20)
+    directory.replace(employees)
+    data = bench.synth_shifts(employees, datetime.date(2025, 1, 1), 60)
+    main.STORE.replace_shifts(main.shift_months({day: {str(uid): main.shift_to_json(rec) for uid, rec in users.items()} for day, users in data.items()}))
+    main.load_shifts()
+
+def test_recompute_keeps_feed(tmp_path, monkeypatch, directory):
+    async def run():
+        seed_history(directory)
+        await main.replace_all_shifts(main.shift_months(main.STORE.export_shifts()))
+        generation, floor, seq = main.FEED.generation, main.FEED.floor, main.FEED.seq
+
+        # ничего не поменялось — ничего не пишется
+        stats = await main.recompute_all_metrics()
+        assert stats.totals()[1] == 0 and main.FEED.seq == seq
+
+        monkeypatch.setattr(main, "START_NORM", datetime.time(8, 30))
+        stats = await main.recompute_all_metrics()
+        changed = stats.totals()[1]
+        assert changed > 0
+        assert (main.FEED.generation, main.FEED.floor) == (generation, floor)
+        assert main.FEED.seq == seq + changed
+
+        header, entries = changes_since(tmp_path, seq)
+        assert header["generation"] == generation and header["count"] == changed
+        stored = main.STORE.export_shifts()
+        assert all(stored[e["day"]][str(e["uid"])] == e["data"] for e in entries)
+
+    asyncio.run(run())
+
+def test_replace_starts_new_generation(tmp_path, directory):
+    async def run():
+        seed_history(directory)
+        generation, seq = main.FEED.generation, main.FEED.seq
+        await main.replace_all_shifts(main.shift_months(main.STORE.export_shifts()))
+        assert main.FEED.generation != generation
+        assert main.FEED.floor == main.FEED.seq > seq
+        header, entries = changes_since(tmp_path, main.FEED.seq)
+        assert header["generation"] == main.FEED.generation and entries == []
+        try:
+            main.FEED.write_since(tmp_path / "old.gz", seq)
+        except ValueError:
+            pass
+        else:
+            raise AssertionError("номер из прошлого поколения принят")
+
+        reopened = main.ChangeFeed(main.CHANGES_FILE)
+        reopened.open(main.EMPLOYEES)
+        assert (reopened.generation, reopened.floor, reopened.seq) == (main.FEED.generation, main.FEED.floor, main.FEED.seq)
+
+    asyncio.run(run())
+
+def test_rewrites_leave_no_backup(tmp_path, monkeypatch):
+    feed = main.ChangeFeed(tmp_path / "changes.log")
+    feed.path.with_suffix(".log.bak").write_bytes(b"old")  # от прежней версии
+    feed.open(main.EMPLOYEES)
+    assert not feed.path.with_suffix(".log.bak").exists()
+    monkeypatch.setattr(main, "CHANGES_INDEX_EVERY", 4)
+    rec = main.ShiftRecord(start=1717394400)
+    for uid in range(1, 41):
+        feed.record_shifts([("2024-06-03", uid, rec)])
+    feed.trim()
+    assert feed.floor > 0
+    feed.reset(main.EMPLOYEES)
+    assert not [p.name for p in tmp_path.glob("changes.log.*")]  # ни .bak, ни .tmp
@@ -0,0 +1,36 @@
+import asyncio
+
+import main
+from conftest import feed, fsm_state
+
+OWNER = main.OWNER_ID
+
+def test_cancel_leaves_export_prompt(session):
+    async def run():
+        await feed(OWNER, "📤 Экспорт данных")
+        assert await fsm_state(OWNER) == main.ExportStates.waiting_period.state
+        await feed(OWNER, "/cancel")
+        assert await fsm_state(OWNER) is None
+        assert session.sent[OWNER][-1] == "Отменено."
+
+    asyncio.run(run())
+
+def test_menu_button_falls_through(session):
+    async def run():
+        await feed(OWNER, "📤 Экспорт данных")
+        await feed(OWNER, "Смену начал 🏭")
+        assert await fsm_state(OWNER) is None
+        assert main.day_shifts(main.today_key())[OWNER].start is not None
+        assert not any("Неверный формат" in text for text in session.sent[OWNER])
+
+    asyncio.run(run())
+
+def test_bad_date_keeps_prompt(session):
+    async def run():
+        await feed(OWNER, "📤 Экспорт данных")
+        await feed(OWNER, "32.13.2025")
+        assert await fsm_state(OWNER) == main.ExportStates.waiting_period.state
+        assert "Неверный формат" in session.sent[OWNER][-1]
+        await feed(OWNER, "/cancel")
+
+    asyncio.run(run())
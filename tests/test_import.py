@@ -0,0 +1,89 @@
+import asyncio
+import datetime
+import io
+import json
+
+import pytest
+
+import main
+
+def shift_json(day: str, hour: int) -> dict:
+    start = datetime.datetime.fromisoformat(day).replace(hour=hour, tzinfo=main.MSK)
+    # метрики нарочно не передаём: импорт считает их сам
+    return {"start": start.isoformat(), "end": (start + datetime.timedelta(hours=9)).isoformat(), "start_reason": None,
+            "end_reason": None, "comment": None, "comment_done": None}
+
+@pytest.mark.parametrize("text", ['{"a": 1}{"b": 2}', '{"a": 1} ]', "{} x", '{"a": 1}\n,'])
+def test_trailing_data_rejected(text):
+    with pytest.raises(main.ImportFormatError, match="лишние данные"):
+        list(main.iter_json_object(io.StringIO(text), chunk_size=3))
+
+def test_trailing_whitespace_accepted():
+    assert list(main.iter_json_object(io.StringIO('{"a": 1} \r\n\t'), chunk_size=3)) == [("a", 1)]
+
+def test_replace_import_streams_and_keeps_history_on_error(tmp_path):
+    main.STORE.replace_shifts(main.shift_months({"2024-05-06": {"5": shift_json("2024-05-06", 8)}}, recompute=True))
+
+    # месяц 2024-06 встречается в файле дважды, не подряд
+    data = {
+        "2024-06-03": {"1": shift_json("2024-06-03", 8)},
+        "2024-07-01": {"2": shift_json("2024-07-01", 9)},
+        "2024-06-04": {"3": shift_json("2024-06-04", 10)},
+    }
+    broken = tmp_path / "broken.json"
+    broken.write_text(json.dumps(data) + '{"2024-08-01": {}}', encoding="utf-8")
+    good = tmp_path / "shifts.json"
+    good.write_text(json.dumps(data), encoding="utf-8")
+
+    async def run():
+        await main.flush_now()  # несохранённые отметки прошлых тестов замена и так запишет первыми
+        before = main.STORE.export_shifts()
+        generation = main.FEED.generation
+        with pytest.raises(main.ImportFormatError):
+            await main.import_shifts_replace(broken, main.ImportStats())
+        assert main.STORE.export_shifts() == before
+        assert main.FEED.generation == generation
+        assert not main.JsonStore.staging_dir().exists()
+
+        stats = main.ImportStats()
+        await main.import_shifts_replace(good, stats)
+        assert stats.totals() == [3, 0, 0]
+        assert main.FEED.generation != generation
+
+    asyncio.run(run())
+    stored = main.STORE.export_shifts()
+    assert sorted(stored) == ["2024-06-03", "2024-06-04", "2024-07-01"]
+    assert stored["2024-06-04"]["3"]["late_start"] == 110  # 10:00 против нормы до 08:10
+    assert stored["2024-06-03"]["1"]["work_min"] == 540
+
+def test_sqlite_replace_rolls_back(tmp_path):
+    store = main.SqliteStore(tmp_path / "shifts.db")
+    store.open()
+    try:
+        store.replace_shifts(main.shift_months({"2024-06-03": {"1": shift_json("2024-06-03", 8)}}, recompute=True))
+        before = store.export_shifts()
+
+        def months():
+            yield from main.shift_months({"2024-07-01": {"2": shift_json("2024-07-01", 9)}}, recompute=True)
+            raise main.ImportFormatError("битый JSON")
+
+        with pytest.raises(main.ImportFormatError):
+            store.replace_shifts(months())
+        assert store.export_shifts() == before
+    finally:
+        store.close()
+
+def test_interrupted_replace_recovers(tmp_path, monkeypatch):
+    monkeypatch.setattr(main, "SHIFTS_DIR", tmp_path / "shifts")
+    store = main.JsonStore()
+    staging = store.staging_dir()
+    # упали между двумя os.replace: shifts/ уже убран, новая история собрана
+    staging.mkdir()
+    store.write_partition("2024-06", {"2024-06-03": {}}, staging)
+    store.recover_replace()
+    assert not staging.exists() and store.partition_months() == ["2024-06"]
+    # упали посреди разбора: недописанная история выбрасывается, текущая остаётся
+    staging.mkdir()
+    store.write_partition("2024-07", {}, staging)
+    store.recover_replace()
+    assert not staging.exists() and store.partition_months() == ["2024-06"]
@@ -0,0 +1,12 @@
+import datetime
+
+import main
+
+def test_standard_periods_skip_current_week():
+    today = datetime.date(2026, 10, 21)  # среда
+    yesterday, week, month = main.standard_periods(today)
+    assert yesterday == (datetime.date(2026, 10, 20),) * 2
+    # прошлая полная неделя пн—вс: сегодняшние отметки её не трогают
+    assert week == (datetime.date(2026, 10, 12), datetime.date(2026, 10, 18))
+    assert week[1] < today - datetime.timedelta(days=today.weekday())
+    assert month == (datetime.date(2026, 9, 1), datetime.date(2026, 9, 30))
@@ -0,0 +1,75 @@
+import asyncio
+import datetime
+import struct
+
+import pytest
+
+import main
+
+def test_journal_threshold_wakes_maintenance(monkeypatch):
+    monkeypatch.setattr(main, "JOURNAL_COMPACT_EVERY", 3)
+    monkeypatch.setattr(main, "JOURNAL_COMPACT_INTERVAL", 60)
+    batch = [("2024-06-03", uid, main.ShiftRecord(start=1717394400 + uid)) for uid in range(1, 4)]
+
+    async def run():
+        maintenance = asyncio.create_task(main.store_maintenance())
+        await asyncio.sleep(0)
+        try:
+            # пишет поток, как flush_now; порог журнала должен разбудить обслуживание в loop
+            await asyncio.to_thread(main.STORE.write_shifts, batch)
+            for _ in range(200):
+                if not main.STORE.pending():
+                    break
+                await asyncio.sleep(0.01)
+            assert main.STORE.pending() == 0
+            assert not main.STORE.flush_needed.is_set()
+        finally:
+            maintenance.cancel()
+
+    asyncio.run(run())
+    assert main.STORE.read_month("2024-06")["2024-06-03"][2].start == 1717394402
+
+def month_sample() -> dict:
+    start = 1741156200  # 2025-03-05 09:30 МСК
+    rec = main.materialize_metrics(main.ShiftRecord(start=start, end=start + 8 * 3600, start_reason="пробки", comment_done=True))
+    return {"2025-03-05": {7: rec, 8: main.materialize_metrics(main.ShiftRecord(start=start))}}
+
+def test_snapshot_roundtrip_and_v1():
+    days = month_sample()
+    assert main.unpack_month(main.pack_month(days)) == days
+    # прежний формат DSB1 (микросекунды + смещение пояса) читается так же
+    strings = {}
+    sid = lambda v: -1 if v is None else strings.setdefault(v, len(strings))
+    records = b"".join(
+        main.SNAPSHOT_RECORD_V1.pack(
+            datetime.date(2025, 3, 5).toordinal(), uid,
+            r.start * 1_000_000, main.NO_TIME if r.end is None else r.end * 1_000_000, 180, 180,
+            sid(r.start_reason), sid(r.end_reason), sid(r.comment), -1 if r.comment_done is None else int(r.comment_done),
+            sid(r.start_hm), sid(r.end_hm), r.early_start, r.late_start, r.early_end, r.late_end, r.work_min)
+        for uid, r in days["2025-03-05"].items())
+    encoded = [s.encode() for s in strings]
+    v1 = b"".join([main.SNAPSHOT_HEADER.pack(b"DSB1", len(encoded), 2), struct.pack(f"<{len(encoded)}I", *map(len, encoded)), *encoded, records])
+    assert main.unpack_month(v1) == days
+
+def test_corrupt_string_index_does_not_crash(tmp_path, caplog):
+    buf = bytearray(main.pack_month(month_sample()))
+    n_strings = main.SNAPSHOT_HEADER.unpack_from(buf)[1]
+    # start_reason первой записи указывает за пределы таблицы строк
+    first = len(buf) - 2 * main.SNAPSHOT_RECORD.size
+    struct.pack_into("<i", buf, first + 28, n_strings + 1000)
+    path = tmp_path / "2025-03.bin"
+    path.write_bytes(bytes(buf))
+    assert main.safe_load_snapshot(path) == {}
+    assert "повреждён" in caplog.text
+    # при живом .bak читается он
+    path.with_suffix(".bin.bak").write_bytes(main.pack_month(month_sample()))
+    assert main.safe_load_snapshot(path) == month_sample()
+
+def test_incomplete_backend_fails_on_creation():
+    class HalfStore(main.ShiftStore):
+        def load_employees(self):
+            return None
+
+    with pytest.raises(TypeError, match="write_shifts"):
+        HalfStore()
+    main.JsonStore()  # полные бэкенды создаются как раньше
@@ -0,0 +1,59 @@
+import asyncio
+import socket
+
+import aiohttp
+
+import bench
+import main
+from conftest import UPDATE_IDS
+
+OWNER = main.OWNER_ID
+SECRET = "test-secret"
+
+class SlowSession(bench.FakeSession):
+    """Каждый вызов API ровно delay сек — ответ гарантированно приходит после остановки."""
+
+    def __init__(self, delay: float):
+        super().__init__(latency=0)
+        self.delay = delay
+        self.methods: list[str] = []
+
+    async def make_request(self, bot, method, timeout=None):
+        self.methods.append(type(method).__name__)
+        await asyncio.sleep(self.delay)
+        return await super().make_request(bot, method, timeout)
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+def test_webhook_drains_accepted_updates(monkeypatch):
+    port = free_port()
+    monkeypatch.setattr(main, "WEBHOOK_URL", "https://bot.example")
+    monkeypatch.setattr(main, "WEBHOOK_SECRET", SECRET)
+    monkeypatch.setattr(main, "WEBHOOK_HOST", "127.0.0.1")
+    monkeypatch.setattr(main, "WEBHOOK_PORT", port)
+    session = SlowSession(delay=0.3)
+    monkeypatch.setattr(main.bot, "session", session)
+    url = f"http://127.0.0.1:{port}{main.WEBHOOK_PATH}"
+    update = bench.message_update(next(UPDATE_IDS), OWNER, "/whoami").model_dump(mode="json", exclude_none=True)
+
+    async def run():
+        stop = asyncio.Event()
+        server = asyncio.create_task(main.run_webhook(stop))
+        while "SetWebhook" not in session.methods or not session.requests:  # сервер поднят, webhook выставлен
+            await asyncio.sleep(0.01)
+        async with aiohttp.ClientSession() as http:
+            async with http.post(url, json=update, headers={"X-Telegram-Bot-Api-Secret-Token": "wrong"}) as resp:
+                assert resp.status == 401
+            async with http.post(url, json=update, headers={"X-Telegram-Bot-Api-Secret-Token": SECRET}) as resp:
+                assert resp.status == 200
+        # Telegram получил 200 раньше ответа пользователю
+        assert OWNER not in session.sent
+        stop.set()
+        await asyncio.wait_for(server, timeout=5)
+        # остановка дождалась фоновой обработки
+        assert session.sent[OWNER]
+
+    asyncio.run(run())